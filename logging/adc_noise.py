@@ -0,0 +1,258 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+ADC_BITS = 10                  # ATmega328P ADC
+FIRMWARE_N = 2000              # Conversions averaged by meas_pin_raw
+CHUNK_SIZE = 1 << 20           # Samples read at once from a capture
+
+
+def iter_chunks(path, column='data', chunksize=CHUNK_SIZE):
+    """
+    Read a raw capture piece by piece, so its size is not bounded by RAM.
+
+    Supported formats: CSV (one column of samples, e.g. arduino_data.csv),
+    .npy (memory mapped) and headerless little-endian uint16 (.bin / .raw).
+
+    Yields:
+        float64 arrays of at most chunksize samples
+    """
+    path = Path(path)
+    if path.suffix == '.csv':
+        import pandas as pd
+        for frame in pd.read_csv(path, usecols=[column], chunksize=chunksize):
+            yield frame[column].to_numpy(dtype=float)
+        return
+    if path.suffix == '.npy':
+        samples = np.load(path, mmap_mode='r')
+    else:
+        samples = np.memmap(path, dtype='<u2', mode='r')
+    for start in range(0, len(samples), chunksize):
+        yield np.asarray(samples[start:start + chunksize], dtype=float)
+
+
+class AllanDeviation:
+    """
+    Streaming octave Allan deviation.
+
+    Level k holds the averages of consecutive, non-overlapping blocks of 2**k
+    samples; each level is built by pairing the averages of the previous one, so
+    a chunk costs O(len(chunk)) and the state is two values per level. The Allan
+    variance at 2**k samples is half the mean squared difference between
+    successive averages of that level.
+    """
+
+    def __init__(self, levels=32):
+        self.levels = levels
+        self.last = [None] * levels       # Last average of every level (difference across chunks)
+        self.leftover = [np.empty(0)] * levels  # Unpaired average waiting for the next chunk
+        self.sum_sq = np.zeros(levels)
+        self.count = np.zeros(levels, np.int64)
+
+    def update(self, chunk):
+        values = np.asarray(chunk, dtype=float)
+        for k in range(self.levels):
+            if not len(values):
+                break
+            previous = values if self.last[k] is None else np.concatenate(([self.last[k]], values))
+            diff = np.diff(previous)
+            self.sum_sq[k] += np.dot(diff, diff)
+            self.count[k] += len(diff)
+            self.last[k] = values[-1]
+            values = np.concatenate((self.leftover[k], values))
+            paired = len(values) // 2 * 2
+            self.leftover[k] = values[paired:]
+            values = (values[0:paired:2] + values[1:paired:2]) / 2
+
+    def result(self, min_count=8):
+        """
+        Returns:
+            (averaging lengths m in samples, Allan deviation) for the levels with
+            at least min_count differences
+        """
+        ok = self.count >= min_count
+        m = 2 ** np.arange(self.levels)
+        return m[ok], np.sqrt(self.sum_sq[ok] / (2 * self.count[ok]))
+
+
+class WelchPSD:
+    """
+    Streaming Welch power spectral density (Hann window, 50 % overlap, mean
+    removed per segment, one-sided density): the same estimate as
+    scipy.signal.welch, accumulated segment by segment.
+    """
+
+    def __init__(self, nperseg=1024, fs=1.0):
+        self.nperseg = nperseg
+        self.step = nperseg // 2
+        self.fs = fs
+        self.window = np.hanning(nperseg + 1)[:-1]   # Periodic Hann, as scipy's 'hann'
+        self.tail = np.empty(0)
+        self.power = np.zeros(nperseg // 2 + 1)
+        self.segments = 0
+
+    def update(self, chunk):
+        values = np.concatenate((self.tail, np.asarray(chunk, dtype=float)))
+        if len(values) < self.nperseg:
+            self.tail = values
+            return
+        segments = np.lib.stride_tricks.sliding_window_view(values, self.nperseg)[::self.step]
+        spectrum = np.fft.rfft((segments - segments.mean(axis=1, keepdims=True)) * self.window, axis=1)
+        self.power += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=0)
+        self.segments += len(segments)
+        self.tail = values[len(segments) * self.step:]
+
+    def result(self):
+        """
+        Returns:
+            (frequencies, PSD in units²/Hz), None before the first full segment
+        """
+        if not self.segments:
+            return None
+        psd = self.power / (self.segments * self.fs * np.sum(self.window ** 2))
+        psd[1:-1 if self.nperseg % 2 == 0 else None] *= 2
+        return np.fft.rfftfreq(self.nperseg, 1 / self.fs), psd
+
+
+def enob(sigma_lsb, bits=ADC_BITS):
+    """
+    Effective number of bits of a reading whose noise is sigma_lsb: an ideal
+    ADC of that many bits has a quantization noise of 1/sqrt(12) of its LSB.
+    """
+    return bits - np.log2(np.asarray(sigma_lsb) * np.sqrt(12))
+
+
+def target_sigma(bits, adc_bits=ADC_BITS):
+    """
+    Noise (in ADC LSB) that corresponds to an effective resolution of `bits`.
+    """
+    return 2.0 ** (adc_bits - bits) / np.sqrt(12)
+
+
+def reads_for(peak, bits=ADC_BITS):
+    """
+    Fewest conversions summed into a sample that can reach `peak`.
+    """
+    return max(1, int(np.ceil(peak / (2 ** bits - 1))))
+
+
+def analyze(chunks, reads_per_sample=None, nperseg=1024, fs=1.0):
+    """
+    Stream a raw capture through the Allan deviation and Welch estimators.
+
+    Args:
+        reads_per_sample: ADC conversions summed into each sample, inferred
+            from the largest sample (reads_for()) when None
+
+    Returns:
+        dict with 'samples', 'reads_per_sample', 'N' (conversions averaged),
+        'sigma_lsb' (noise of an N-conversion average, in ADC LSB), 'enob' and
+        'psd' ((f, Pxx) of the samples, or None if the capture is shorter than
+        nperseg)
+
+    Raises:
+        ValueError if a sample exceeds what reads_per_sample conversions can sum to
+    """
+    allan = AllanDeviation()
+    welch = WelchPSD(nperseg, fs)
+    samples, peak = 0, 0.0
+    for chunk in chunks:
+        allan.update(chunk)
+        welch.update(chunk)
+        samples += len(chunk)
+        peak = max(peak, float(np.max(chunk, initial=0)))
+    if reads_per_sample is None:
+        reads_per_sample = reads_for(peak)
+    elif peak > reads_per_sample * (2 ** ADC_BITS - 1):
+        raise ValueError(f"A sample of {peak:g} exceeds {reads_per_sample} conversions of {ADC_BITS} bits "
+                         f"(at least {reads_for(peak)})")
+    m, adev = allan.result()
+    sigma_lsb = adev / reads_per_sample
+    return {
+        'samples': samples,
+        'reads_per_sample': reads_per_sample,
+        'N': m * reads_per_sample,
+        'sigma_lsb': sigma_lsb,
+        'enob': enob(sigma_lsb),
+        'psd': welch.result(),
+    }
+
+
+def recommend_n(n, sigma_lsb, target):
+    """
+    Smallest number of conversions per meas_pin_raw call whose average has a
+    noise of at most `target` LSB.
+
+    Between measured lengths the curve is interpolated in log-log; below the
+    shortest one white noise (sigma/sqrt(N)) is assumed.
+
+    Returns:
+        int, or None if the measured curve never reaches the target (noise
+        floor, drift, or a capture too short for the required length)
+    """
+    n = np.asarray(n, dtype=float)
+    sigma_lsb = np.asarray(sigma_lsb, dtype=float)
+    if sigma_lsb[0] <= target:
+        return max(1, int(np.ceil(n[0] * (sigma_lsb[0] / target) ** 2)))
+    below = np.flatnonzero(sigma_lsb <= target)
+    if not len(below):
+        return None
+    i = below[0]
+    slope = np.log(sigma_lsb[i] / sigma_lsb[i - 1]) / np.log(n[i] / n[i - 1])
+    return int(np.ceil(n[i - 1] * (target / sigma_lsb[i - 1]) ** (1 / slope)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Noise of raw ADC captures versus averaging length")
+    parser.add_argument('capture', nargs='?', default='arduino_data.csv', help="CSV, .npy or raw uint16 file")
+    parser.add_argument('--column', default='data')
+    parser.add_argument('--reads-per-sample', type=int,
+                        help="ADC conversions summed into each sample of the capture, "
+                             "default: the fewest that reach its largest sample")
+    parser.add_argument('--target-bits', type=float, default=12.0, help="Effective resolution to reach")
+    parser.add_argument('--nperseg', type=int, default=1024, help="Welch segment length")
+    parser.add_argument('--fs', type=float, default=1.0, help="Sample rate of the capture [Hz]")
+    parser.add_argument('--plot', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        result = analyze(iter_chunks(args.capture, args.column), args.reads_per_sample, args.nperseg, args.fs)
+    except ValueError as e:
+        parser.error(str(e))
+    reads = result['reads_per_sample']
+    inferred = " (inferred from the largest sample)" if args.reads_per_sample is None else ""
+    print(f"{Path(args.capture).name}: {result['samples']} samples of {reads} conversions{inferred}")
+    print(f"{'N':>10}{'sigma LSB':>12}{'ENOB':>8}")
+    for n, sigma, bits in zip(result['N'], result['sigma_lsb'], result['enob']):
+        print(f"{n:>10}{sigma:>12.4f}{bits:>8.2f}")
+
+    target = target_sigma(args.target_bits)
+    n = recommend_n(result['N'], result['sigma_lsb'], target)
+    if n is None:
+        print(f"{args.target_bits:g} effective bits ({target:.4f} LSB) are not reached by this capture")
+    else:
+        print(f"{args.target_bits:g} effective bits ({target:.4f} LSB): N = {n} "
+              f"({n / FIRMWARE_N:.1%} of the firmware's {FIRMWARE_N})")
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        fig, (ax_allan, ax_psd) = plt.subplots(1, 2, figsize=(12, 5))
+        ax_allan.loglog(result['N'], result['sigma_lsb'], 'o-')
+        ax_allan.axhline(target, color='r', linestyle='--', label=f'{args.target_bits:g} bits')
+        ax_allan.set_xlabel('Conversions averaged')
+        ax_allan.set_ylabel('Allan deviation [LSB]')
+        ax_allan.legend()
+        ax_allan.grid(True, which='both')
+        if result['psd'] is not None:
+            f, psd = result['psd']
+            ax_psd.loglog(f[1:], psd[1:] / reads ** 2)
+        ax_psd.set_xlabel('Frequency [Hz]')
+        ax_psd.set_ylabel('PSD [LSB²/Hz]')
+        ax_psd.grid(True, which='both')
+        plt.tight_layout()
+        plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'STMA'
+INDEX_MAGIC = b'STMI'
+VERSION = 1
+BLOCK_SIZE = 4096              # Samples per block
+NS_PER_S = 1_000_000_000
+RESOLUTIONS_NS = (NS_PER_S, 1_000_000, 1_000, 1)   # Time resolutions tried, coarsest first
+
+# Quantization (scale, offset) of the known channels: value = offset + q*scale.
+# Temperatures use the 12-bit payload scale over [-60, 60] °C, the battery the 8-bit one over [0, 15] V.
+QUANTA = {
+    'tempExt': (120 / 0xFFF, -60.0),
+    'tempInt': (120 / 0xFFF, -60.0),
+    'battVolt': (15 / 0xFF, 0.0),
+}
+DEFAULT_QUANTUM = (1.0, 0.0)   # Raw ADC counts and unknown channels
+
+_HEADER = struct.Struct('<4sBI')           # magic, version, JSON length
+_INDEX_ENTRY = np.dtype([('t_first', '<i8'), ('t_last', '<i8'), ('offset', '<u8'), ('n', '<u4')])
+_TRAILER = struct.Struct('<QI4s')          # index offset, number of blocks, magic
+
+
+def zigzag_encode(v):
+    v = np.asarray(v, dtype=np.int64)
+    return ((v << 1) ^ (v >> 63)).view(np.uint64)
+
+
+def zigzag_decode(u):
+    u = np.asarray(u, dtype=np.uint64)
+    return (u >> np.uint64(1)).view(np.int64) ^ -(u & np.uint64(1)).view(np.int64)
+
+
+_VARINT_LIMITS = np.uint64(1) << (np.uint64(7) * np.arange(1, 10, dtype=np.uint64))
+
+
+def varint_lengths(u):
+    """
+    Bytes of the LEB128 encoding of every value of a uint64 array.
+    """
+    nbytes = (u >= _VARINT_LIMITS[0]).astype(np.int64)
+    nbytes += 1
+    # Deltas are small: the few longer values are sized apart
+    long = np.flatnonzero(u >= _VARINT_LIMITS[1])
+    nbytes[long] = np.searchsorted(_VARINT_LIMITS, u[long], side='right') + 1
+    return nbytes
+
+
+def _varint_scatter(out, at, u, nbytes):
+    # One pass per byte position (at most 10) over the values still long enough
+    more = nbytes > 1
+    out[at] = (u.astype(np.uint8) & 0x7F) | (more.view(np.uint8) << 7)
+    long = np.flatnonzero(more)
+    j = 1
+    while len(long):
+        more = nbytes[long] > j + 1
+        out[at[long] + j] = ((u[long] >> np.uint64(7 * j)).astype(np.uint8) & 0x7F) | (more.view(np.uint8) << 7)
+        j += 1
+        long = long[more]
+
+
+def varint_encode(u):
+    """
+    LEB128-encode unsigned integers.
+
+    Args:
+        u: uint64 array
+
+    Returns:
+        uint8 array holding the concatenated varints
+    """
+    u = np.asarray(u, dtype=np.uint64)
+    nbytes = varint_lengths(u)
+    ends = np.cumsum(nbytes)
+    out = np.empty(ends[-1] if len(u) else 0, np.uint8)
+    _varint_scatter(out, ends - nbytes, u, nbytes)
+    return out
+
+
+def varint_decode(buf):
+    """
+    Decode concatenated LEB128 varints.
+
+    Args:
+        buf: uint8 array
+
+    Returns:
+        uint64 array
+    """
+    buf = np.asarray(buf, dtype=np.uint8)
+    if len(buf) == 0:
+        return np.empty(0, np.uint64)
+    ends = np.flatnonzero(buf < 0x80)
+    if len(ends) == 0 or ends[-1] != len(buf) - 1:
+        raise ValueError("Truncated varint stream")
+    if len(ends) == len(buf):
+        # Single-byte values only, the common case of slow channels
+        return buf.astype(np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    nbytes = ends - starts + 1
+    out = (buf[starts] & 0x7F).astype(np.uint64)
+    # One pass per byte position over the values still long enough, as the encoder
+    more = np.flatnonzero(nbytes > 1)
+    j = 1
+    while len(more):
+        out[more] |= (buf[starts[more] + j] & 0x7F).astype(np.uint64) << np.uint64(7 * j)
+        j += 1
+        more = more[nbytes[more] > j]
+    return out
+
+
+def _block_cumsum(x, starts):
+    """
+    Cumulative sum along axis 0 restarting at every block start, in place:
+    the first value of a block cancels the sum of the previous one.
+    """
+    sums = np.add.reduceat(x, starts, axis=0)
+    x[starts[1:]] -= sums[:-1]
+    return np.cumsum(x, axis=0, out=x)
+
+
+def _block_positions(sizes, starts, bases, totals):
+    """
+    Position of every item laid out block by block: each block starts at its
+    base and its items follow each other by their sizes. One cumsum, with the
+    jump to the next base added at every block start.
+
+    Args:
+        sizes: size of every item
+        starts: index of the first item of every block
+        bases: position of the first item of every block
+        totals: sum of the sizes of every block
+    """
+    x = np.empty(len(sizes), np.int64)
+    x[:1] = 0
+    x[1:] = sizes[:-1]
+    x[starts] += np.diff(bases - (np.cumsum(totals) - totals), prepend=0)
+    return np.cumsum(x, out=x)
+
+
+def quanta_for(channels, quanta=None):
+    quanta = {**QUANTA, **(quanta or {})}
+    return [tuple(quanta.get(c, DEFAULT_QUANTUM)) for c in channels]
+
+
+def encode_blocks(t, q, block_size=BLOCK_SIZE):
+    """
+    Encode consecutive blocks of block_size samples (the last one may be
+    shorter), all at once.
+
+    Each block is a header (sample count and byte length of every stream, u32)
+    followed by its streams: delta-of-delta timestamps, then the deltas of
+    every channel, zigzag and varint coded. Deltas restart at every block, so
+    a block decodes on its own.
+
+    Args:
+        t: int64 timestamps in time-resolution units, shape (n,)
+        q: int64 quantized values, shape (n, channels)
+
+    Returns:
+        (uint8 array of the blocks, byte offset of every block and of the end)
+    """
+    n = len(t)
+    starts = np.arange(0, n, block_size)
+    delta = np.diff(t, prepend=0)
+    delta[starts] = t[starts]
+    # Delta-of-delta: cumsum(cumsum(dod)) per block gives t back exactly
+    dod = np.diff(delta, prepend=0)
+    dod[starts] = delta[starts]
+    # Channels as rows: every stream contiguous
+    dq = np.empty((q.shape[1], n), np.int64)
+    np.subtract(q.T[:, 1:], q.T[:, :-1], out=dq[:, 1:])
+    dq[:, starts] = q[starts].T
+    streams = [zigzag_encode(dod)] + [zigzag_encode(row) for row in dq]
+    nbytes = [varint_lengths(u) for u in streams]
+    # Bytes of every stream per block, and where each stream of a block begins
+    lengths = np.stack([np.add.reduceat(b, starts) if n else b[:0] for b in nbytes], axis=1)
+    header_size = 4 * (len(streams) + 1)
+    offsets = np.concatenate(([0], np.cumsum(header_size + lengths.sum(axis=1))))
+    stream_starts = offsets[:-1, None] + header_size + np.cumsum(lengths, axis=1) - lengths
+    out = np.empty(offsets[-1], np.uint8)
+    headers = np.column_stack((np.diff(np.append(starts, n)), lengths)).astype('<u4').view(np.uint8)
+    out[(offsets[:-1, None] + np.arange(header_size)).ravel()] = headers.ravel()
+    for i, (u, b) in enumerate(zip(streams, nbytes)):
+        _varint_scatter(out, _block_positions(b, starts, stream_starts[:, i], lengths[:, i]), u, b)
+    return out, offsets
+
+
+def decode_blocks(buf, offsets, n_channels):
+    """
+    Decode consecutive blocks of buf, starting at the given offsets, all at
+    once.
+
+    Returns:
+        (t, q) as in encode_blocks, for all the blocks concatenated
+    """
+    buf = np.frombuffer(buf, np.uint8)
+    n_streams = n_channels + 1
+    header_size = 4 * (n_streams + 1)
+    headers = buf[np.asarray(offsets)[:, None] + np.arange(header_size)].copy().view('<u4').astype(np.int64)
+    counts, lengths = headers[:, 0], headers[:, 1:]
+    starts = np.cumsum(counts) - counts
+    segments = np.column_stack((np.full(len(counts), header_size), lengths))
+    ends = np.asarray(offsets) + segments.sum(axis=1)
+    if (lengths == 0).any() or (ends[:-1] != offsets[1:]).any() or (ends > len(buf)).any():
+        raise ValueError("Corrupted block")
+    # Which stream every byte belongs to (0 for headers), one pass per stream over it
+    label = np.repeat(np.tile(np.arange(n_streams + 1, dtype=np.uint8), len(counts)), segments.ravel())
+    buf = buf[offsets[0]:ends[-1]] if len(counts) else buf[:0]
+    decoded = []
+    for i in range(n_streams):
+        raw = buf[label == i + 1]
+        # Every block holds as many varints as samples and ends on the last one
+        block_starts = np.cumsum(lengths[:, i]) - lengths[:, i]
+        terminal = raw < 0x80
+        if len(counts) and (not terminal[block_starts + lengths[:, i] - 1].all()
+                            or (np.add.reduceat(terminal, block_starts) != counts).any()):
+            raise ValueError("Corrupted block")
+        decoded.append(zigzag_decode(varint_decode(raw)))
+    t = _block_cumsum(_block_cumsum(decoded[0], starts), starts)
+    if not n_channels:
+        return t, np.empty((len(t), 0), np.int64)
+    return t, _block_cumsum(np.stack(decoded[1:], axis=1), starts)
+
+
+class ArchiveWriter:
+    """
+    Append samples to an archive file.
+
+    Samples are buffered and written in blocks of block_size; the block index is
+    written as a footer on close(). Opening an existing archive reuses its
+    header and continues after its last block.
+
+    Timestamps are stored losslessly: in units of time_resolution_ns when
+    given (timestamps that are not multiples of it raise ValueError),
+    otherwise of the coarsest of RESOLUTIONS_NS dividing the first samples
+    written.
+    """
+
+    def __init__(self, path, channels, quanta=None, block_size=BLOCK_SIZE, time_resolution_ns=None):
+        self.path = Path(path)
+        self.block_size = block_size
+        self._pending_t = []
+        self._pending_v = []
+        self._n_pending = 0
+        if self.path.exists() and self.path.stat().st_size > 0:
+            meta, index = read_index(self.path)
+            if meta['channels'] != list(channels):
+                raise ValueError(f"{self.path} holds channels {meta['channels']}, not {list(channels)}")
+            self.meta = meta
+            self.index = [index]
+            self.file = open(self.path, 'r+b')
+            self.file.seek(meta['index_offset'])
+            self.file.truncate()
+        else:
+            self.meta = {
+                'channels': list(channels),
+                'quanta': quanta_for(channels, quanta),
+                'time_resolution_ns': time_resolution_ns,
+            }
+            self.index = []
+            self.file = open(self.path, 'wb')
+            if time_resolution_ns is not None:
+                self._write_header()
+        scale, offset = np.array(self.meta['quanta']).T.reshape(2, -1)
+        self._scale, self._offset = scale, offset
+
+    def _write_header(self):
+        header = json.dumps(self.meta).encode()
+        self.file.write(_HEADER.pack(MAGIC, VERSION, len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, timestamps_ns, values):
+        """
+        Add samples.
+
+        Args:
+            timestamps_ns: int64 ns since the epoch, shape (n,), non-decreasing
+            values: float array of shape (n, channels)
+        """
+        values = np.asarray(values, dtype=float).reshape(len(timestamps_ns), len(self._scale))
+        if np.isnan(values).any():
+            raise ValueError("NaN values cannot be archived")
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        resolution = self.meta['time_resolution_ns']
+        if resolution is not None and np.any(timestamps_ns % resolution):
+            raise ValueError(f"Timestamps are not multiples of the archive's {resolution} ns resolution")
+        self._pending_t.append(timestamps_ns)
+        self._pending_v.append(values)
+        self._n_pending += len(values)
+        if self._n_pending >= self.block_size:
+            self._write_blocks(final=False)
+
+    def _write_blocks(self, final):
+        pending_t, pending_v = np.concatenate(self._pending_t), np.concatenate(self._pending_v)
+        if self.meta['time_resolution_ns'] is None:
+            self.meta['time_resolution_ns'] = next(r for r in RESOLUTIONS_NS if not np.any(pending_t % r))
+            self._write_header()
+        t = pending_t // self.meta['time_resolution_ns']
+        q = np.rint((pending_v - self._offset) / self._scale).astype(np.int64)
+        n_full = len(t) if final else len(t) - len(t) % self.block_size
+        if n_full:
+            buf, offsets = encode_blocks(t[:n_full], q[:n_full], self.block_size)
+            starts = np.arange(0, n_full, self.block_size)
+            index = np.empty(len(starts), _INDEX_ENTRY)
+            index['t_first'], index['t_last'] = t[starts], t[np.append(starts[1:], n_full) - 1]
+            index['offset'], index['n'] = self.file.tell() + offsets[:-1], np.diff(np.append(starts, n_full))
+            self.index.append(index)
+            self.file.write(buf)
+        self._pending_t, self._pending_v = [pending_t[n_full:]], [pending_v[n_full:]]
+        self._n_pending = len(pending_t) - n_full
+
+    def flush(self):
+        """
+        Write the buffered samples as a (possibly short) block.
+        """
+        if self._n_pending:
+            self._write_blocks(final=True)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        if self.meta['time_resolution_ns'] is None:
+            # Nothing was written
+            self.meta['time_resolution_ns'] = 1
+            self._write_header()
+        index = np.concatenate(self.index) if self.index else np.empty(0, _INDEX_ENTRY)
+        index_offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.write(_TRAILER.pack(index_offset, len(index), INDEX_MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def read_index(path):
+    """
+    Read the header and the per-block time index of an archive.
+
+    Returns:
+        (metadata dict, structured array with t_first, t_last, offset and n per block)
+    """
+    with open(path, 'rb') as f:
+        magic, version, length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} archive")
+        meta = json.loads(f.read(length))
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        index_offset, n_blocks, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} has no block index (not closed properly?)")
+        f.seek(index_offset)
+        index = np.frombuffer(f.read(n_blocks * _INDEX_ENTRY.itemsize), _INDEX_ENTRY)
+    meta['index_offset'] = index_offset
+    return meta, index
+
+
+def read_archive(path, start=None, end=None):
+    """
+    Decode an archive, optionally only the samples in [start, end).
+
+    Args:
+        path: Archive file
+        start, end: Optional time bounds (int64 ns or datetime64); only the
+            blocks overlapping them are read and decoded
+
+    Returns:
+        (timestamps as int64 ns, values of shape (n, channels), channel names)
+    """
+    meta, index = read_index(path)
+    resolution = meta['time_resolution_ns']
+    channels = meta['channels']
+    lo = -np.inf if start is None else _ns(start) // resolution
+    hi = np.inf if end is None else -(-_ns(end) // resolution)
+    # Blocks are in time order: the overlapping ones are contiguous and read at once
+    selected = np.flatnonzero((index['t_last'] >= lo) & (index['t_first'] < hi))
+    if len(selected):
+        first, stop = int(index['offset'][selected[0]]), np.append(index['offset'], meta['index_offset'])[selected[-1] + 1]
+        with open(path, 'rb') as f:
+            f.seek(first)
+            buf = f.read(int(stop) - first)
+        t, q = decode_blocks(buf, index['offset'][selected].astype(np.int64) - first, len(channels))
+    else:
+        t, q = np.empty(0, np.int64), np.empty((0, len(channels)), np.int64)
+    if start is not None or end is not None:
+        mask = (t >= lo) & (t < hi)
+        t, q = t[mask], q[mask]
+    scale, offset = np.array(meta['quanta']).T.reshape(2, -1)
+    return t * resolution, offset + q * scale, channels
+
+
+def _ns(t):
+    t = np.asarray(t)
+    if t.dtype.kind == 'M':
+        return int(t.astype('datetime64[ns]').view(np.int64))
+    return int(t)
+
+
+def write_archive(path, timestamps_ns, values, channels, **kwargs):
+    """
+    Write a whole series to a new archive (see ArchiveWriter for the options).
+    """
+    if Path(path).exists():
+        os.remove(path)
+    with ArchiveWriter(path, channels, **kwargs) as writer:
+        writer.append(timestamps_ns, values)
+
+
+def csv_to_archive(csv_path, archive_path, **kwargs):
+    """
+    Convert a logger CSV (timestamp column + channels) to an archive.
+    """
+    import pandas as pd
+
+    frame = pd.read_csv(csv_path)
+    t = pd.to_datetime(frame.pop('timestamp')).to_numpy().astype('datetime64[ns]').view(np.int64)
+    write_archive(archive_path, t, frame.to_numpy(dtype=float), list(frame.columns), **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert logger CSVs to compressed archives and report the gain")
+    parser.add_argument('csv', nargs='+')
+    parser.add_argument('--out-dir', default='.')
+    args = parser.parse_args()
+
+    for path in args.csv:
+        out = Path(args.out_dir) / (Path(path).stem + '.stma')
+        csv_to_archive(path, out)
+        t0 = time.perf_counter()
+        t, values, channels = read_archive(out)
+        elapsed = time.perf_counter() - t0
+        csv_size, archive_size = os.path.getsize(path), os.path.getsize(out)
+        print(f"{path}: {len(t)} samples, {csv_size} -> {archive_size} bytes "
+              f"({csv_size / archive_size:.1f}x, {archive_size / max(len(t), 1):.2f} B/sample), "
+              f"decoded in {elapsed * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+asyncio client for the AT interface of the Sigfox modules (BRKWS01, LSM100A).
+
+One ATClient drives one module. Commands are queued and sent one at a time
+(the modules do not pipeline), responses are framed into lines up to a final
+result line, and every command gets its own timeout. Latencies and outcomes
+are recorded per command kind, so many modules can be driven from one event
+loop and compared.
+"""
+import argparse
+import asyncio
+import os
+import termios
+import time
+import tty
+from dataclasses import dataclass, field
+
+import numpy as np
+
+BAUD_RATE = 9600               # mySerial.begin(9600)
+DEFAULT_TIMEOUT = 5.0          # waitForOK() default
+TIMEOUTS = {'AT': 1.0, 'AT$SF': 15.0}  # As in main/main.ino
+FINAL_OK = ('OK',)
+FINAL_ERRORS = ('ERROR', 'AT_ERROR', 'AT_PARAM_ERROR', 'AT_BUSY_ERROR', 'AT_TEST_PARAM_OVERFLOW',
+                'AT_NO_NETWORK_JOINED', 'AT_RX_ERROR')
+
+
+class ATError(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.command!r} failed: {response.final or 'no response'}")
+        self.response = response
+
+
+class ATTimeout(ATError):
+    pass
+
+
+@dataclass
+class Response:
+    command: str
+    lines: list = field(default_factory=list)    # Information lines before the final one
+    final: str = ''                               # 'OK', an error code, or '' on timeout
+    latency: float = 0.0                          # From the end of the write to the final line [s]
+
+    @property
+    def ok(self):
+        return self.final in FINAL_OK
+
+
+def command_kind(command):
+    """
+    Metrics key of a command: its name without arguments (AT$SF=0123 -> AT$SF).
+    """
+    return command.split('=', 1)[0].split('?', 1)[0].upper()
+
+
+def is_final(line):
+    return line in FINAL_OK or line in FINAL_ERRORS or line.endswith('ERROR')
+
+
+class ATClient:
+    def __init__(self, reader, writer, name='module', timeouts=TIMEOUTS, default_timeout=DEFAULT_TIMEOUT,
+                 read_transport=None):
+        self.reader = reader
+        self.writer = writer
+        self.read_transport = read_transport     # Closed with the client when the reader has its own
+        self.name = name
+        self.timeouts = dict(timeouts)
+        self.default_timeout = default_timeout
+        self.stats = {}                          # kind -> {'ok', 'error', 'timeout', 'latency': [...]}
+        self._queue = asyncio.Queue()
+        self._lines = asyncio.Queue()
+        self._late_until = 0.0                   # A timed-out command may still answer until then
+        self._tasks = []
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._read_lines()), asyncio.create_task(self._run())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.writer.close()
+        if self.read_transport is not None:
+            self.read_transport.close()
+
+    async def _read_lines(self):
+        """
+        Split the byte stream into lines (modules end them with \\r\\n, some with \\r only).
+        """
+        buffer = b''
+        while True:
+            chunk = await self.reader.read(256)
+            if not chunk:
+                return
+            buffer += chunk
+            *lines, buffer = buffer.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')
+            for line in lines:
+                line = line.decode('ascii', 'replace').strip()
+                if line:
+                    self._lines.put_nowait(line)
+
+    async def _run(self):
+        while True:
+            command, timeout, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(await self._execute(command, timeout))
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+
+    async def _execute(self, command, timeout):
+        # A command that timed out may still answer until late_until. Its lines, up to
+        # its final one, are awaited and discarded before this command is sent: without
+        # an echo, nothing else tells its late final from this command's
+        late_until, self._late_until = self._late_until, 0.0
+        late = time.perf_counter() < late_until
+        while not self._lines.empty():
+            late = late and not is_final(self._lines.get_nowait())
+        try:
+            while late:
+                line = await asyncio.wait_for(self._lines.get(), late_until - time.perf_counter())
+                late = not is_final(line)
+        except asyncio.TimeoutError:
+            pass
+        response = Response(command)
+        self.writer.write(command.encode('ascii') + b'\r\n')
+        await self.writer.drain()
+        start = time.perf_counter()
+        deadline = start + timeout
+        try:
+            while True:
+                line = await asyncio.wait_for(self._lines.get(), deadline - time.perf_counter())
+                if line == command:
+                    continue                     # Echo
+                if is_final(line):
+                    response.final = line
+                    break
+                response.lines.append(line)
+        except asyncio.TimeoutError:
+            response.latency = time.perf_counter() - start
+            self._record(command, 'timeout', response.latency)
+            self._late_until = time.perf_counter() + timeout
+            raise ATTimeout(response) from None
+        response.latency = time.perf_counter() - start
+        self._record(command, 'ok' if response.ok else 'error', response.latency)
+        if not response.ok:
+            raise ATError(response)
+        return response
+
+    def _record(self, command, outcome, latency):
+        stats = self.stats.setdefault(command_kind(command), {'ok': 0, 'error': 0, 'timeout': 0, 'latency': []})
+        stats[outcome] += 1
+        if outcome != 'timeout':
+            stats['latency'].append(latency)
+
+    async def command(self, command, timeout=None):
+        """
+        Queue a command and wait for its response.
+
+        Raises:
+            ATError on an error result, ATTimeout when no final line came in time
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(command_kind(command), self.default_timeout)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((command, timeout, future))
+        return await future
+
+    async def wait_ready(self, attempts=10):
+        """
+        Send AT until the module answers OK, as setup() does.
+        """
+        for _ in range(attempts):
+            try:
+                return await self.command('AT')
+            except ATError:
+                pass
+        raise ATTimeout(Response('AT'))
+
+    async def send_payload(self, payload):
+        """
+        Send a hex payload (up to 12 bytes) with AT$SF.
+        """
+        return await self.command(f"AT$SF={payload}")
+
+    def metrics(self):
+        return summarize(self.stats)
+
+
+def summarize(stats):
+    """
+    Returns:
+        dict kind -> {'count', 'ok', 'error', 'timeout', 'p50', 'p95', 'max'} (latencies in seconds)
+    """
+    summary = {}
+    for kind, counts in stats.items():
+        latency = np.array(counts['latency']) if counts['latency'] else np.array([np.nan])
+        summary[kind] = {
+            'count': counts['ok'] + counts['error'] + counts['timeout'],
+            'ok': counts['ok'], 'error': counts['error'], 'timeout': counts['timeout'],
+            'p50': np.percentile(latency, 50), 'p95': np.percentile(latency, 95), 'max': latency.max(),
+        }
+    return summary
+
+
+def merge_metrics(clients):
+    """
+    Aggregate the metrics of several clients, per command kind.
+    """
+    merged = {}
+    for client in clients:
+        for kind, stats in client.stats.items():
+            total = merged.setdefault(kind, {'ok': 0, 'error': 0, 'timeout': 0, 'latency': []})
+            for key in ('ok', 'error', 'timeout'):
+                total[key] += stats[key]
+            total['latency'] += stats['latency']
+    return summarize(merged)
+
+
+def print_metrics(metrics):
+    columns = ('count', 'ok', 'error', 'timeout', 'p50', 'p95', 'max')
+    print(f"{'command':>10}" + ''.join(f"{c:>10}" for c in columns))
+    for kind, stats in metrics.items():
+        print(f"{kind:>10}" + ''.join(f"{stats[c]:>10}" if isinstance(stats[c], int) else f"{stats[c]:>10.3f}"
+                                       for c in columns))
+
+
+def _configure(fd, baud_rate):
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    speed = getattr(termios, f"B{baud_rate}")
+    attrs[4] = attrs[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+
+async def open_serial(path, baud_rate=BAUD_RATE):
+    """
+    Open a serial device (or the slave side of a pty) as asyncio streams.
+
+    Returns:
+        (StreamReader, StreamWriter, read transport)
+    """
+    loop = asyncio.get_running_loop()
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    _configure(fd, baud_rate)
+    reader = asyncio.StreamReader()
+    read_transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                     os.fdopen(os.dup(fd), 'rb', buffering=0))
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                        os.fdopen(fd, 'wb', buffering=0))
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer, read_transport
+
+
+async def connect(path, baud_rate=BAUD_RATE, **kwargs):
+    reader, writer, read_transport = await open_serial(path, baud_rate)
+    client = ATClient(reader, writer, name=path, read_transport=read_transport, **kwargs)
+    client.start()
+    return client
+
+
+async def _run_commands(args):
+    client = await connect(args.port, args.baud)
+    try:
+        for command in args.commands:
+            try:
+                response = await client.command(command)
+                print(f"{command}: {' | '.join(response.lines + [response.final])} ({response.latency * 1e3:.0f} ms)")
+            except ATError as e:
+                print(f"{command}: {e}")
+        print_metrics(client.metrics())
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send AT commands to a Sigfox module")
+    parser.add_argument('port', help="Serial device, e.g. /dev/ttyUSB0")
+    parser.add_argument('commands', nargs='*', default=['AT', 'AT$I=10'])
+    parser.add_argument('--baud', type=int, default=BAUD_RATE)
+    asyncio.run(_run_commands(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Emulated Sigfox module on a pseudo-terminal, to bench-test the AT client and
+the send path without radio hardware.
+
+Each ModuleEmulator owns a pty: the client opens the slave side
+(ModuleEmulator.port) like a real /dev/ttyUSB*, the emulator answers on the
+master side with the module's latencies and error responses:
+    AT               -> OK
+    AT$I=10          -> device id, OK
+    AT$SF=<hex>      -> OK after the transmit time, AT_PARAM_ERROR when the
+                        payload is not 1 to 12 bytes of hex
+    commands during a transmission -> AT_BUSY_ERROR
+    anything else    -> AT_ERROR
+Commands are echoed first when echo is on (ATE1).
+"""
+import argparse
+import asyncio
+import os
+import time
+import tty
+
+import numpy as np
+
+from at_client import ATError, ATTimeout, connect, merge_metrics, print_metrics, summarize
+from uplink_payload import PAYLOAD_BYTES
+
+# (mean, standard deviation) of the response time [s]
+LATENCY = {
+    'AT': (0.015, 0.005),
+    'AT$I': (0.020, 0.005),
+    'AT$SF': (6.0, 0.6),       # 3 repetitions on air
+    'default': (0.015, 0.005),
+}
+
+
+class ModuleEmulator:
+    def __init__(self, device_id=0, latency=LATENCY, time_scale=1.0, error_rate=0.0, drop_rate=0.0, echo=False,
+                 seed=None):
+        """
+        Args:
+            device_id: Value answered to AT$I=10
+            latency: dict command kind -> (mean, std) response time [s]
+            time_scale: Multiplies every latency (0.01 runs a bench 100x faster)
+            error_rate: Probability that an AT$SF fails with AT_ERROR
+            drop_rate: Probability that a command gets no answer at all
+            echo: Echo every command answered, before its response
+        """
+        self.device_id = device_id
+        self.latency = latency
+        self.time_scale = time_scale
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.echo = echo
+        self.rng = np.random.default_rng(seed)
+        self.received = []                       # Payloads accepted by AT$SF
+        self.busy_until = 0.0
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave                      # Kept open so the pty survives client reconnects
+        self._buffer = b''
+        self._tasks = set()
+
+    def start(self):
+        os.set_blocking(self.master, False)
+        asyncio.get_running_loop().add_reader(self.master, self._on_readable)
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.master)
+        for task in self._tasks:
+            task.cancel()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def _on_readable(self):
+        try:
+            self._buffer += os.read(self.master, 1024)
+        except BlockingIOError:
+            return
+        *lines, self._buffer = self._buffer.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')
+        for line in lines:
+            command = line.decode('ascii', 'replace').strip()
+            if command:
+                task = asyncio.create_task(self._handle(command))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def _delay(self, kind):
+        mean, std = self.latency.get(kind, self.latency['default'])
+        return max(0.0, self.rng.normal(mean, std)) * self.time_scale
+
+    def _write(self, *lines):
+        os.write(self.master, b''.join(line.encode('ascii') + b'\r\n' for line in lines))
+
+    async def _handle(self, command):
+        kind = command.split('=', 1)[0].upper()
+        if self.rng.random() < self.drop_rate:
+            return
+        if self.echo:
+            self._write(command)
+        if time.perf_counter() < self.busy_until:
+            self._write('AT_BUSY_ERROR')
+            return
+        delay = self._delay(kind)
+        if kind == 'AT$SF':
+            payload = command.split('=', 1)[1] if '=' in command else ''
+            try:
+                valid = 0 < len(payload) <= 2 * PAYLOAD_BYTES and len(payload) % 2 == 0 and bytes.fromhex(payload)
+            except ValueError:
+                valid = False
+            if not valid:
+                await asyncio.sleep(self._delay('default'))
+                self._write('AT_PARAM_ERROR')
+                return
+            self.busy_until = time.perf_counter() + delay
+            await asyncio.sleep(delay)
+            if self.rng.random() < self.error_rate:
+                self._write('AT_ERROR')
+            else:
+                self.received.append(payload.upper())
+                self._write('OK')
+            return
+        await asyncio.sleep(delay)
+        if kind == 'AT':
+            self._write('OK')
+        elif command.upper() == 'AT$I=10':
+            self._write(f"{self.device_id:08X}", 'OK')
+        else:
+            self._write('AT_ERROR')
+
+
+async def bench(n_modules, n_sends, time_scale=1.0, error_rate=0.0, drop_rate=0.0, echo=False, seed=0):
+    """
+    Drive n_modules emulated modules concurrently, each sending n_sends payloads.
+
+    A module that does not get through setup (AT until OK, then AT$I=10) is
+    counted in the 'setup' row of the metrics and left out; the others go on.
+
+    Returns:
+        (merged client metrics, wall time [s], payloads received by the emulators)
+    """
+    emulators = [ModuleEmulator(i, time_scale=time_scale, error_rate=error_rate, drop_rate=drop_rate, echo=echo,
+                                seed=seed + i) for i in range(n_modules)]
+    for emulator in emulators:
+        emulator.start()
+    timeouts = {'AT': 1.0, 'AT$SF': max(15.0 * time_scale, 1.0)}
+    clients = [await connect(emulator.port, timeouts=timeouts) for emulator in emulators]
+
+    setup = {'ok': 0, 'error': 0, 'timeout': 0, 'latency': []}
+
+    async def run(client, index):
+        start = time.perf_counter()
+        try:
+            await client.wait_ready()
+            await client.command('AT$I=10')
+        except ATError as e:
+            setup['timeout' if isinstance(e, ATTimeout) else 'error'] += 1
+            return
+        setup['ok'] += 1
+        setup['latency'].append(time.perf_counter() - start)
+        for k in range(n_sends):
+            try:
+                await client.send_payload(f"{index:02X}{k % 256:02X}{k * 7 % 4096:03X}{k * 3 % 4096:03X}")
+            except ATError:
+                pass
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(run(client, i) for i, client in enumerate(clients)))
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients:
+            await client.close()
+        for emulator in emulators:
+            emulator.close()
+    metrics = merge_metrics(clients)
+    metrics['setup'] = summarize({'setup': setup})['setup']
+    return metrics, elapsed, sum(len(emulator.received) for emulator in emulators)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bench the AT client against emulated modules")
+    parser.add_argument('--modules', type=int, default=20)
+    parser.add_argument('--sends', type=int, default=5, help="Payloads sent by every module")
+    parser.add_argument('--time-scale', type=float, default=0.05, help="Latency multiplier (1 = real time)")
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--drop-rate', type=float, default=0.01)
+    parser.add_argument('--echo', action='store_true', help="Modules echo the commands (ATE1)")
+    args = parser.parse_args()
+
+    metrics, elapsed, received = asyncio.run(bench(args.modules, args.sends, args.time_scale,
+                                                   args.error_rate, args.drop_rate, args.echo))
+    print(f"{args.modules} modules x {args.sends} sends in {elapsed:.2f} s "
+          f"(latencies x{args.time_scale:g}), {received} payloads received")
+    print_metrics(metrics)
+
+
+if __name__ == "__main__":
+    main()
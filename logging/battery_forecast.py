@@ -0,0 +1,307 @@
+"""
+Battery life forecast of a whole fleet from its battVolt series.
+
+Samples (logged battVolt, or the battery byte of the uplinks) are folded
+into per-device time buckets as they arrive: a ring of the last `window`
+bucket means per device, all devices in (devices, window) arrays, so an
+ingest of any number of samples of any number of devices is a few NumPy
+scatter operations.
+
+The discharge model is a straight line of the bucket means over the
+window, fitted by iteratively reweighted least squares with Huber weights
+(scale from the MAD of the residuals), which ignores outliers such as cold
+nights or a payload glitch. All devices are fitted at once with closed-form
+2x2 normal equations; an update only refits the devices that received
+samples, starting from their previous weights, so a couple of iterations
+per ingest are enough.
+
+The forecast is the time until the line reaches the cutoff voltage, with
+bounds where the confidence band of the line reaches it (closed form: a
+quadratic in t per device).
+"""
+import argparse
+import time
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from uplink_payload import SEND_PERIOD, batt_to_code, code_to_batt
+
+CUTOFF_V = 3.0                 # Below this the 3.3 V regulator of the Pro Mini drops out
+BUCKET_S = 6 * 3600            # Width of the decimation buckets
+WINDOW = 120                   # Buckets kept per device (30 days)
+CONFIDENCE = 0.9
+HUBER_K = 1.345
+NS_PER_S = 1_000_000_000
+DAY_S = 86400
+
+
+def fit_lines(x, y, mask, weights, iterations=2, k=HUBER_K):
+    """
+    Robust straight lines of many series at once (Huber IRLS).
+
+    Args:
+        x, y: (series, points) arrays
+        mask: (series, points) bool, points taking part in the fit
+        weights: (series, points) robust weights to start from (ones for a cold start)
+
+    Returns:
+        (intercept, slope, covariance (series, 2, 2), weights, residual scale)
+    """
+    for _ in range(iterations):
+        w = np.where(mask, weights, 0.0)
+        sw, swx, swy = w.sum(axis=1), (w * x).sum(axis=1), (w * y).sum(axis=1)
+        swxx, swxy = (w * x * x).sum(axis=1), (w * x * y).sum(axis=1)
+        det = sw * swxx - swx ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = np.where(det > 0, (sw * swxy - swx * swy) / det, 0.0)
+            intercept = np.where(sw > 0, (swy - slope * swx) / sw, np.nan)
+        residual = y - intercept[:, None] - slope[:, None] * x
+        # Median of the masked absolute residuals: sorted with the masked ones last (faster than nanmedian)
+        ordered = np.sort(np.where(mask, np.abs(residual), np.inf), axis=1)
+        n = mask.sum(axis=1)
+        lo, hi = np.maximum(n - 1, 0) // 2, n // 2
+        rows = np.arange(len(n))
+        scale = 1.4826 * 0.5 * (ordered[rows, lo] + ordered[rows, np.minimum(hi, ordered.shape[1] - 1)])
+        scale = np.maximum(np.nan_to_num(scale, posinf=0.0), 1e-6)
+        with np.errstate(all='ignore'):
+            weights = np.minimum(1.0, k * scale[:, None] / np.abs(residual))
+        weights = np.where(mask, np.nan_to_num(weights, nan=1.0), 1.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma2 = (w * residual ** 2).sum(axis=1, where=mask) / np.maximum(sw * (n - 2) / np.maximum(n, 1), 1e-12)
+        cov = sigma2[:, None, None] * np.stack([np.stack([swxx, -swx], -1), np.stack([-swx, sw], -1)], -2) \
+            / det[:, None, None]
+    cov[n < 3] = np.inf
+    return intercept, slope, cov, weights, scale
+
+
+def crossing_times(intercept, slope, cov, cutoff, z):
+    """
+    When the line, and the edges of its confidence band, reach the cutoff.
+
+    With d = intercept - cutoff, the band edges d + s*t -/+ z*se(t) reach 0
+    where (d + s*t)^2 = z^2 * (c00 + 2*c01*t + c11*t^2).
+
+    Returns:
+        (estimate, lower, upper) in the unit of the abscissa, from 0; inf when never reached
+    """
+    d = intercept - cutoff
+    c00, c01, c11 = cov[:, 0, 0], cov[:, 0, 1], cov[:, 1, 1]
+    with np.errstate(all='ignore'):
+        estimate = np.where(slope < 0, -d / slope, np.inf)
+        a = slope ** 2 - z ** 2 * c11
+        b = 2 * (d * slope - z ** 2 * c01)
+        c = d ** 2 - z ** 2 * c00
+        root = np.sqrt(b ** 2 - 4 * a * c)
+        t1, t2 = np.sort(np.stack([(-b - root) / (2 * a), (-b + root) / (2 * a)]), axis=0)
+        # a > 0: the band closes, both edges cross (if the slope is negative);
+        # a <= 0: the slope is not significant, only the lower edge crosses
+        lower = np.where(a > 0, np.where(slope < 0, t1, np.inf), t2)
+        upper = np.where((a > 0) & (slope < 0), t2, np.inf)
+    lower = np.where(np.isnan(lower) | (c < 0), 0.0, lower)
+    upper = np.where(np.isnan(upper), np.inf, upper)
+    estimate = np.where(d <= 0, 0.0, estimate)
+    return np.maximum(estimate, 0), np.maximum(lower, 0), np.maximum(upper, 0)
+
+
+class FleetForecaster:
+    def __init__(self, cutoff_v=CUTOFF_V, bucket_s=BUCKET_S, window=WINDOW, confidence=CONFIDENCE,
+                 capacity=1024):
+        """
+        Args:
+            cutoff_v: Battery voltage at which the device stops
+            bucket_s: Width of the buckets the samples are averaged in
+            window: Buckets (most recent) the lines are fitted on
+            confidence: Level of the bounds of the forecast
+        """
+        self.cutoff_v = cutoff_v
+        self.bucket_ns = bucket_s * NS_PER_S
+        self.window = window
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.names = []
+        self.index = {}
+        self._alloc(capacity)
+        self.n = 0
+
+    def _alloc(self, capacity):
+        shape = (capacity, self.window)
+        old = getattr(self, 'sum', None)
+        arrays = {
+            'sum': np.zeros(shape), 'count': np.zeros(shape, np.int64),
+            'key': np.full(shape, np.iinfo(np.int64).min), 'weights': np.ones(shape),
+            'latest': np.full(capacity, np.iinfo(np.int64).min), 'dirty': np.zeros(capacity, bool),
+            'intercept': np.full(capacity, np.nan), 'slope': np.full(capacity, np.nan),
+            'cov': np.full((capacity, 2, 2), np.inf), 'scale': np.full(capacity, np.nan),
+        }
+        for name, array in arrays.items():
+            if old is not None:
+                array[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, array)
+
+    def _device_indices(self, devices):
+        names, inverse = np.unique(np.asarray(devices).astype(str), return_inverse=True)
+        new = [name for name in names.tolist() if name not in self.index]
+        if self.n + len(new) > len(self.latest):
+            capacity = len(self.latest)
+            while capacity < self.n + len(new):
+                capacity *= 2
+            self._alloc(capacity)
+        for name in new:
+            self.index[name] = self.n
+            self.names.append(name)
+            self.n += 1
+        return np.array([self.index[name] for name in names.tolist()], np.int64)[inverse]
+
+    def ingest(self, devices, timestamps, volts):
+        """
+        Fold samples into the buckets (any order, any mix of devices).
+
+        Args:
+            devices: Device name of every sample
+            timestamps: datetime64 or int64 ns
+            volts: Battery voltage [V]
+        """
+        rows = self._device_indices(devices)
+        t = np.asarray(timestamps)
+        t = t.astype('datetime64[ns]').view(np.int64) if t.dtype.kind == 'M' else t.astype(np.int64)
+        volts = np.asarray(volts, float)
+        keep = ~np.isnan(volts)
+        rows, t, volts = rows[keep], t[keep], volts[keep]
+        keys = t // self.bucket_ns
+        slots = keys % self.window
+
+        # A slot holding an older bucket is reset for the newest bucket the batch brings to it
+        newest = self.key.copy()
+        np.maximum.at(newest, (rows, slots), keys)
+        reset = newest != self.key
+        self.sum[reset], self.count[reset], self.weights[reset] = 0.0, 0, 1.0
+        self.key = newest
+        current = keys == self.key[rows, slots]
+        np.add.at(self.sum, (rows[current], slots[current]), volts[current])
+        np.add.at(self.count, (rows[current], slots[current]), 1)
+        np.maximum.at(self.latest, rows, keys)
+        self.dirty[rows] = True
+
+    def update(self, iterations=2, all_devices=False):
+        """
+        Refit the devices that received samples since the last update.
+        """
+        rows = np.arange(self.n) if all_devices else np.flatnonzero(self.dirty[:self.n])
+        if not len(rows):
+            return
+        key, count = self.key[rows], self.count[rows]
+        age = self.latest[rows, None] - key
+        mask = (count > 0) & (age >= 0) & (age < self.window)
+        # Abscissa in days before the newest bucket's center: the intercept is the voltage now
+        x = -age * (self.bucket_ns / NS_PER_S / DAY_S)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            y = np.where(mask, self.sum[rows] / count, 0.0)
+        intercept, slope, cov, weights, scale = fit_lines(x, y, mask, self.weights[rows], iterations)
+        self.intercept[rows], self.slope[rows], self.cov[rows] = intercept, slope, cov
+        self.weights[rows], self.scale[rows] = weights, scale
+        self.dirty[rows] = False
+
+    def forecast(self):
+        """
+        Returns:
+            DataFrame per device: voltage now, slope [mV/day], buckets used,
+            days to cutoff with its lower and upper bounds (from the newest bucket)
+        """
+        n = self.n
+        estimate, lower, upper = crossing_times(self.intercept[:n], self.slope[:n], self.cov[:n],
+                                                self.cutoff_v, self.z)
+        age = self.latest[:n, None] - self.key[:n]
+        return pd.DataFrame({
+            'device': self.names,
+            'last_bucket': (self.latest[:n] * self.bucket_ns).view('datetime64[ns]'),
+            'volt_now': self.intercept[:n],
+            'mv_per_day': self.slope[:n] * 1e3,
+            'buckets': ((self.count[:n] > 0) & (age >= 0) & (age < self.window)).sum(axis=1),
+            'days_to_cutoff': estimate,
+            'days_lower': lower,
+            'days_upper': upper,
+        })
+
+
+def _synthetic_fleet(devices, rng):
+    """
+    Linear discharges with a daily temperature swing, noise and the uplink's 59 mV quantization.
+
+    Returns:
+        function(days) -> (device ids, timestamps ns, volts) of that span of uplinks,
+        true voltage at t=0 and true slope [V/day]
+    """
+    v0 = rng.uniform(3.2, 3.4, devices)
+    slope = -rng.uniform(0.001, 0.008, devices)
+    phase = rng.uniform(0, 2 * np.pi, devices)
+    step_s = SEND_PERIOD * 6                              # One uplink every 128 wakes of 6 s
+
+    def uplinks(day0, day1):
+        t_s = np.arange(day0 * DAY_S, day1 * DAY_S, step_s)
+        days = t_s / DAY_S
+        v = v0[:, None] + slope[:, None] * days + 0.03 * np.sin(2 * np.pi * days + phase[:, None])
+        v += rng.normal(0, 0.01, v.shape)
+        v = code_to_batt(batt_to_code(v))
+        ids = np.repeat(np.arange(devices), len(t_s)).astype(str)
+        return ids, np.tile(t_s * NS_PER_S, devices), v.ravel()
+
+    return uplinks, v0, slope
+
+
+def main():
+    from loader import load
+
+    parser = argparse.ArgumentParser(description="Days to battery cutoff per device")
+    parser.add_argument('csv', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'],
+                        help="Files, directories or glob patterns")
+    parser.add_argument('--cutoff', type=float, default=CUTOFF_V)
+    parser.add_argument('--bucket-hours', type=float, default=BUCKET_S / 3600)
+    parser.add_argument('--synthetic', type=int, metavar='DEVICES',
+                        help="Benchmark and check the bounds on a simulated fleet instead")
+    parser.add_argument('--days', type=int, default=30, help="Days of uplinks of the simulated fleet")
+    args = parser.parse_args()
+    bucket_s = int(args.bucket_hours * 3600)
+
+    if not args.synthetic:
+        forecaster = FleetForecaster(args.cutoff, bucket_s)
+        frame = load(args.csv, ['battVolt'])
+        forecaster.ingest(frame['device'].astype(str), frame['timestamp'], frame['battVolt'])
+        forecaster.update(iterations=10)
+        print(forecaster.forecast().to_string(index=False))
+        return
+
+    rng = np.random.default_rng(0)
+    uplinks, v0, slope = _synthetic_fleet(args.synthetic, rng)
+    forecaster = FleetForecaster(args.cutoff, bucket_s)
+    ingest_s, update_s, samples = 0.0, 0.0, 0
+    for day in range(args.days):
+        batch = uplinks(day, day + 1)
+        # One ingest per uplink period, as they arrive from the backend (here a day at a time in 8 slices)
+        for part in np.array_split(np.argsort(batch[1], kind='stable'), 8):
+            t0 = time.perf_counter()
+            forecaster.ingest(*(item[part] for item in batch))
+            t1 = time.perf_counter()
+            forecaster.update()
+            ingest_s += t1 - t0
+            update_s += time.perf_counter() - t1
+        samples += len(batch[0])
+    result = forecaster.forecast()
+    now = forecaster.latest[:forecaster.n] * forecaster.bucket_ns / NS_PER_S / DAY_S + 0.5 * bucket_s / DAY_S
+    true_days = np.maximum((args.cutoff - v0) / slope - now, 0)
+    order = result['device'].astype(int).to_numpy()
+    true_days = true_days[order]
+    alive = true_days > 0
+    inside = (result['days_lower'] <= true_days) & (true_days <= result['days_upper'])
+    error = np.abs(result['days_to_cutoff'] - true_days) / true_days
+    print(f"{args.synthetic} devices, {samples} uplinks over {args.days} days, {8 * args.days} ingests: "
+          f"ingest {ingest_s / (8 * args.days) * 1e3:.1f} ms, refit {update_s / (8 * args.days) * 1e3:.1f} ms "
+          f"per ingest")
+    print(f"{alive.sum()} devices above the cutoff: true days to cutoff inside the {CONFIDENCE:.0%} bounds "
+          f"for {inside[alive].mean():.1%}, median relative error {np.median(error[alive]):.1%}")
+    print(result.head(10).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Capture broker: one process owns a serial port and publishes its samples
+into a shared memory ring, so any number of local processes (the plotter,
+a CSV writer, an analysis job) read the same board at once.
+
+The ring is a multiprocessing.shared_memory block: a header (capacity,
+channel names, write sequence, heartbeat) followed by `capacity` records of
+RECORD fields: sequence number, receive time (int64 ns, wall clock, taken
+at the serial read as in the loggers) and the channel values. Sample n
+goes to slot n % capacity.
+
+There is a single writer and no lock. The writer invalidates the sequence
+numbers of the slots it is about to fill, writes the records, sets their
+sequence numbers, then advances the header's write sequence. A reader keeps
+its own cursor and reads at its own pace: the capture never waits for
+anyone. A reader lapped by the writer skips what was overwritten (counted as
+lost), and read() returns the records as views into the ring (zero-copy) or
+as a copy. Both are checked seqlock-style against the sequence numbers the
+reader expects: a copy by re-reading the sequence numbers of the ring once
+the records are copied, a zero-copy batch by intact(batch) after it was used.
+"""
+import argparse
+import json
+import os
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from clock_align import HostClock, burst_stamps
+from telemetry_frame import CHANNELS, FrameReader, samples
+
+MAGIC = b'STMR'
+VERSION = 1
+CAPACITY = 1 << 16             # Samples kept (3 days at 6 s, 2 MB)
+HEADER_BYTES = 512             # Records start here (a cache-line multiple)
+HEARTBEAT_S = 1.0              # The capture loop refreshes the heartbeat at least this often
+INVALID = np.iinfo(np.uint64).max
+
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'), ('capacity', '<u8'), ('n_channels', '<u4'),
+                         ('write_seq', '<u8'), ('heartbeat_ns', '<i8'), ('channels', 'S256')])
+
+
+def record_dtype(n_channels):
+    return np.dtype([('seq', '<u8'), ('t', '<i8'), ('values', '<f8', (n_channels,))])
+
+
+def ring_name(port):
+    """
+    Shared memory name of the ring of a serial port (/dev/ttyUSB2 -> sigtemp-ttyUSB2).
+    """
+    return f"sigtemp-{os.path.basename(port)}"
+
+
+def _views(buffer, capacity, n_channels):
+    header = np.ndarray((), HEADER_DTYPE, buffer)
+    records = np.ndarray((capacity,), record_dtype(n_channels), buffer, HEADER_BYTES)
+    return header, records
+
+
+class RingWriter:
+    def __init__(self, name, channels=CHANNELS, capacity=CAPACITY):
+        """
+        Create the ring (replacing a stale one left by a crashed broker).
+        """
+        size = HEADER_BYTES + capacity * record_dtype(len(channels)).itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.capacity = capacity
+        self.header, self.records = _views(self.shm.buf, capacity, len(channels))
+        self.records['seq'] = INVALID
+        self.header['magic'], self.header['version'] = MAGIC, VERSION
+        self.header['capacity'], self.header['n_channels'] = capacity, len(channels)
+        self.header['channels'] = json.dumps(list(channels)).encode()
+        self.header['write_seq'] = 0
+        self.beat()
+
+    def beat(self):
+        self.header['heartbeat_ns'] = time.time_ns()
+
+    def publish(self, timestamps_ns, values):
+        """
+        Append samples (never blocks: the oldest records are overwritten).
+
+        Args:
+            timestamps_ns: int64 ns per sample (or one for all)
+            values: (n, channels) array
+        """
+        values = np.asarray(values, float).reshape(-1, self.records.dtype['values'].shape[0])
+        n = len(values)
+        if not n:
+            return
+        timestamps_ns = np.broadcast_to(np.asarray(timestamps_ns, np.int64), (n,))
+        start = int(self.header['write_seq'])
+        # Only the newest `capacity` samples of a huge batch can be kept
+        skip = max(0, n - self.capacity)
+        seq = np.arange(start + skip, start + n, dtype=np.uint64)
+        slots = seq % self.capacity
+        self.records['seq'][slots] = INVALID
+        self.records['t'][slots] = timestamps_ns[skip:]
+        self.records['values'][slots] = values[skip:]
+        self.records['seq'][slots] = seq
+        self.header['write_seq'] = start + n
+        self.beat()
+
+    def close(self):
+        del self.header, self.records
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingView(np.ndarray):
+    """
+    Zero-copy batch of ring records, with the sequence number of its first record.
+    """
+    start = None
+
+
+class RingReader:
+    def __init__(self, name, start='latest'):
+        """
+        Attach to a broker's ring.
+
+        Args:
+            start: 'latest' to read the samples published from now on, 'oldest'
+                to begin with the oldest sample still in the ring
+        """
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the ring with the resource
+            # tracker, which would unlink it when this process exits
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                self.shm = shared_memory.SharedMemory(name)
+            finally:
+                resource_tracker.register = register
+        header = np.ndarray((), HEADER_DTYPE, self.shm.buf)
+        if bytes(header['magic']) != MAGIC or int(header['version']) != VERSION:
+            raise ValueError(f"{name} is not a broker ring")
+        self.capacity = int(header['capacity'])
+        self.channels = json.loads(bytes(header['channels']).rstrip(b'\0').decode())
+        self.header, self.records = _views(self.shm.buf, self.capacity, len(self.channels))
+        write_seq = int(self.header['write_seq'])
+        self.cursor = write_seq if start == 'latest' else max(0, write_seq - self.capacity)
+        self.lost = 0
+
+    def alive(self, timeout_s=5 * HEARTBEAT_S):
+        """
+        Whether the broker refreshed its heartbeat recently.
+        """
+        return time.time_ns() - int(self.header['heartbeat_ns']) < timeout_s * 1e9
+
+    def lag(self):
+        """
+        Samples published and not read yet.
+        """
+        return int(self.header['write_seq']) - self.cursor
+
+    def _skip_overwritten(self):
+        oldest = int(self.header['write_seq']) - self.capacity
+        if self.cursor < oldest:
+            self.lost += oldest - self.cursor
+            self.cursor = oldest
+
+    def read(self, max_samples=None, copy=True):
+        """
+        Records published since the last read.
+
+        Args:
+            max_samples: Upper bound of the batch (None: everything available)
+            copy: False for a RingView into the ring (up to the end of the
+                ring only, the next read continues at its start): check
+                intact() after using it
+
+        Returns:
+            RECORD array (fields seq, t, values)
+        """
+        self._skip_overwritten()
+        available = int(self.header['write_seq']) - self.cursor
+        n = available if max_samples is None else min(available, max_samples)
+        first = self.cursor % self.capacity
+        if not copy:
+            batch = self.records[first:first + min(n, self.capacity - first)].view(RingView)
+            batch.start = self.cursor
+            self.cursor += len(batch)
+            return batch
+        slots = (self.cursor + np.arange(n)) % self.capacity
+        batch = self.records[slots]
+        # The writer invalidates a record before rewriting it and gives it a new sequence number
+        # after: a record is whole if it carried the expected number both before and after the copy
+        expected = np.arange(self.cursor, self.cursor + n, dtype=np.uint64)
+        valid = (batch['seq'] == expected) & (self.records['seq'][slots] == expected)
+        if not valid.all():
+            keep = np.flatnonzero(~valid)[-1] + 1
+            self.lost += keep
+            batch = batch[keep:]
+        self.cursor += n
+        return batch
+
+    def intact(self, batch):
+        """
+        Whether a zero-copy batch was not overwritten, not even partly, since
+        read() returned it (call after using it).
+
+        Args:
+            batch: RingView returned by read(copy=False)
+        """
+        if getattr(batch, 'start', None) is None:
+            raise ValueError("intact() checks the batches returned by read(copy=False)")
+        expected = np.arange(batch.start, batch.start + len(batch), dtype=np.uint64)
+        return bool((batch['seq'] == expected).all())
+
+    def close(self):
+        del self.header, self.records
+        self.shm.close()
+
+
+def parse_line(line):
+    """
+    tempExt, tempInt, battVolt of a debug text line (as main.py), or None.
+    """
+    line = line.decode('utf-8', 'replace').strip()
+    if line and (line[0].isdigit() or line[0] == '-'):
+        try:
+            return [float(value) for value in line.split(', ')[:3]]
+        except ValueError:
+            return None
+    return None
+
+
+def capture(ser, writer, binary=False, clock=None, stop=lambda: False):
+    """
+    Read the port until stop() and publish every sample, stamped at the read.
+
+    Returns:
+        Number of samples published
+    """
+    clock = clock or HostClock()
+    frame_reader = FrameReader()
+    published = 0
+    while not stop():
+        if binary:
+            data = ser.read(ser.in_waiting or 1)
+            received = clock.to_wall_ns(clock.monotonic_ns())
+            rows = samples(frame_reader.feed(data))
+            received = burst_stamps(received, len(rows))
+        else:
+            line = ser.readline()
+            received = clock.to_wall_ns(clock.monotonic_ns())
+            row = parse_line(line) if line else None
+            rows = [row] if row else []
+        if len(rows):
+            writer.publish(received, rows)
+            published += len(rows)
+        else:
+            writer.beat()
+    return published
+
+
+def _write_csv(reader, path, stop):
+    """
+    Consumer: the durable path of the loggers (WAL, compacted into a CSV).
+    """
+    from wal import Compactor, CsvSink, WalWriter
+
+    wal = WalWriter(f"{path}.wal", reader.channels)
+    compactor = Compactor(wal, CsvSink(path))
+    compactor.start()
+    try:
+        while not stop():
+            batch = reader.read()
+            for t, values in zip(batch['t'].tolist(), batch['values']):
+                wal.append(t, values)
+            time.sleep(0.1)
+    finally:
+        compactor.stop()
+        wal.close()
+
+
+def _print_stats(reader, stop, every_s=5.0):
+    """
+    Consumer: sample rate, lag and losses of this reader.
+    """
+    last, count = time.monotonic(), 0
+    while not stop():
+        batch = reader.read(copy=False)
+        count += len(batch)
+        if time.monotonic() - last >= every_s:
+            print(f"{count / (time.monotonic() - last):.1f} samples/s, lag {reader.lag()}, lost {reader.lost}, "
+                  f"broker {'alive' if reader.alive() else 'silent'}")
+            last, count = time.monotonic(), 0
+        time.sleep(0.1)
+
+
+def _bench_consumer(name, delay_s, copy, duration_s, results):
+    reader = RingReader(name, start='oldest')
+    received = mismatches = 0
+    end = time.monotonic() + duration_s
+    while time.monotonic() < end:
+        batch = reader.read(copy=copy)
+        # Every value is its own sequence number: a torn, shifted or overwritten record shows up
+        expected = batch['seq'] if copy else batch.start + np.arange(len(batch))
+        mismatch = int((batch['values'][:, 0] != expected).sum())
+        if not copy and not reader.intact(batch):
+            reader.lost += len(batch)
+        else:
+            received += len(batch)
+            mismatches += mismatch
+        time.sleep(delay_s)
+    results.put((delay_s, copy, received, reader.lost, mismatches))
+    reader.close()
+
+
+def bench(consumers=4, duration_s=5.0, rate=50_000, capacity=CAPACITY):
+    """
+    Publish synthetic samples while fast consumers and one very slow one read,
+    alternately copying and zero-copy.
+    """
+    import multiprocessing
+
+    name = f"sigtemp-bench-{os.getpid()}"
+    writer = RingWriter(name, capacity=capacity)
+    results = multiprocessing.Queue()
+    delays = [0.001] * (consumers - 1) + [0.5]
+    processes = [multiprocessing.Process(target=_bench_consumer, args=(name, d, i % 2 == 0, duration_s, results))
+                 for i, d in enumerate(delays)]
+    for p in processes:
+        p.start()
+    time.sleep(0.5)
+    batch = max(1, rate // 1000)
+    latencies, published = [], 0
+    end = time.monotonic() + duration_s - 1
+    while time.monotonic() < end:
+        values = np.repeat(np.arange(published, published + batch, dtype=float)[:, None], 3, axis=1)
+        t0 = time.perf_counter_ns()
+        writer.publish(time.time_ns(), values)
+        latencies.append(time.perf_counter_ns() - t0)
+        published += batch
+        time.sleep(0.001)
+    rows = [results.get(timeout=duration_s + 10) for _ in processes]
+    for p in processes:
+        p.join()
+    writer.close()
+    p50, p99 = np.percentile(latencies, [50, 99]) / 1e3
+    print(f"Published {published} samples in batches of {batch}: publish p50 {p50:.1f} us, p99 {p99:.1f} us")
+    for delay_s, copy, received, lost, mismatches in sorted(rows):
+        print(f"  {'copying' if copy else 'zero-copy'} consumer polling every {delay_s * 1e3:5.0f} ms: "
+              f"{received} read, {lost} lost, {mismatches} corrupted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share one serial capture with many local processes")
+    parser.add_argument('--port', default='/dev/ttyUSB2', help="Serial port to capture (or to name the ring)")
+    parser.add_argument('--baud', type=int, default=74880)
+    parser.add_argument('--binary', action='store_true', help="Binary telemetry frames instead of text lines")
+    parser.add_argument('--ring', help="Shared memory name (default: from the port)")
+    parser.add_argument('--capacity', type=int, default=CAPACITY)
+    parser.add_argument('--csv', metavar='PATH', help="Consume the ring into a CSV instead of capturing")
+    parser.add_argument('--stats', action='store_true', help="Consume the ring and print its rate and losses")
+    parser.add_argument('--bench', type=int, metavar='CONSUMERS', help="Benchmark with synthetic samples")
+    args = parser.parse_args()
+    name = args.ring or ring_name(args.port)
+
+    if args.bench:
+        bench(args.bench, capacity=args.capacity)
+        return
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    stop = lambda: bool(stopping)
+    try:
+        if args.csv or args.stats:
+            reader = RingReader(name, start='oldest' if args.csv else 'latest')
+            _write_csv(reader, args.csv, stop) if args.csv else _print_stats(reader, stop)
+            return
+
+        import serial
+
+        ser = serial.Serial(args.port, args.baud, timeout=HEARTBEAT_S)
+        writer = RingWriter(name, capacity=args.capacity)
+        print(f"Capturing {args.port} into shared memory '{name}'")
+        try:
+            capture(ser, writer, args.binary, stop=stop)
+        finally:
+            ser.close()
+            writer.close()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
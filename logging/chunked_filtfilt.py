@@ -0,0 +1,248 @@
+"""
+Out-of-core zero-phase filtering, equivalent to scipy.signal.filtfilt.
+
+The series is cut into blocks that are filtered independently: each block is
+read with `margin` extra samples on both sides, filtered forward and backward
+(odd extension and steady-state initial conditions at the real ends of the
+series, as filtfilt does), and only its own samples are kept (overlap-save).
+For a stable filter the effect of a cut decays as the largest pole radius to
+the power of the distance, so with margin = settle_length(b, a, tol) the
+result matches filtfilt to about tol times the signal amplitude.
+
+Blocks only read their input range, so the input can be a memory-mapped
+.npy file of any size, blocks can run in separate processes, and appending
+data to an already-filtered series only recomputes the last margin samples
+plus the new ones.
+"""
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.signal import filtfilt, lfilter, lfilter_zi
+
+BLOCK = 1 << 20                # Samples per block
+TOLERANCE = 1e-10              # Relative error allowed by the default margin
+
+
+def default_padlen(b, a):
+    return 3 * max(len(np.atleast_1d(a)), len(np.atleast_1d(b)))
+
+
+def settle_length(b, a, tol=TOLERANCE):
+    """
+    Number of samples after which the filter forgets its state to within tol.
+    """
+    a = np.atleast_1d(a)
+    radius = np.abs(np.roots(a)).max() if len(a) > 1 else 0.0
+    if radius >= 1:
+        raise ValueError("The filter is not stable")
+    transient = int(np.ceil(np.log(tol) / np.log(radius))) if radius > 0 else len(np.atleast_1d(b))
+    return transient + default_padlen(b, a)
+
+
+def _odd_ext(x, n, left, right):
+    parts = [x]
+    if left:
+        parts.insert(0, 2 * x[0] - x[n:0:-1])
+    if right:
+        parts.append(2 * x[-1] - x[-2:-(n + 2):-1])
+    return np.concatenate(parts)
+
+
+def filtfilt_range(x, b, a, start, stop, margin, padlen=None):
+    """
+    Zero-phase filtered samples [start, stop) of x, along axis 0, reading only
+    x[start - margin:stop + margin].
+    """
+    n = len(x)
+    padlen = default_padlen(b, a) if padlen is None else padlen
+    lo, hi = max(0, start - margin), min(n, stop + margin)
+    segment = np.asarray(x[lo:hi], dtype=float)
+    left, right = lo == 0, hi == n
+    if (left or right) and len(segment) <= padlen:
+        raise ValueError(f"The series must be longer than padlen={padlen}")
+    ext = _odd_ext(segment, padlen, left, right)
+    zi = lfilter_zi(b, a).reshape((-1,) + (1,) * (ext.ndim - 1))
+    y, _ = lfilter(b, a, ext, axis=0, zi=zi * ext[0])
+    y, _ = lfilter(b, a, y[::-1], axis=0, zi=zi * y[-1])
+    y = y[::-1]
+    offset = (padlen if left else 0) + start - lo
+    return y[offset:offset + stop - start]
+
+
+def _blocks(start, stop, block):
+    return [(i, min(i + block, stop)) for i in range(start, stop, block)]
+
+
+def filtfilt_chunked(x, b, a, out=None, block=BLOCK, margin=None, padlen=None, start=0):
+    """
+    filtfilt of x along axis 0, one block at a time.
+
+    Args:
+        x: Array-like indexable by slices (ndarray, np.memmap, ...), (n,) or (n, channels)
+        out: Array of the same shape receiving the result (e.g. a writable memmap);
+            a new array when None
+        start: Only compute out[start:] (the rest of out is left untouched)
+
+    Returns:
+        out
+    """
+    margin = settle_length(b, a) if margin is None else margin
+    if out is None:
+        out = np.empty(x.shape, dtype=float)
+    for lo, hi in _blocks(start, len(x), block):
+        out[lo:hi] = filtfilt_range(x, b, a, lo, hi, margin, padlen)
+    return out
+
+
+def _filter_file_block(src, dst, b, a, lo, hi, margin, padlen):
+    x = np.load(src, mmap_mode='r')
+    out = np.load(dst, mmap_mode='r+')
+    out[lo:hi] = filtfilt_range(x, b, a, lo, hi, margin, padlen)
+    out.flush()
+
+
+def _run_blocks(src, dst, b, a, start, n, block, margin, padlen, workers):
+    blocks = _blocks(start, n, block)
+    if workers == 1:
+        for lo, hi in blocks:
+            _filter_file_block(src, dst, b, a, lo, hi, margin, padlen)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_filter_file_block, src, dst, b, a, lo, hi, margin, padlen) for lo, hi in blocks]
+        for future in futures:
+            future.result()
+
+
+def filtfilt_file(src, dst, b, a, block=BLOCK, margin=None, padlen=None, workers=1):
+    """
+    Filter a .npy file (n,) or (n, channels) into another .npy file (float64),
+    with blocks spread over `workers` processes. Neither file is loaded in memory.
+    """
+    x = np.load(src, mmap_mode='r')
+    margin = settle_length(b, a) if margin is None else margin
+    np.lib.format.open_memmap(dst, mode='w+', dtype=float, shape=x.shape).flush()
+    _run_blocks(src, dst, b, a, 0, len(x), block, margin, padlen, workers)
+
+
+def _resize_npy(path, n):
+    """
+    Change the number of rows of a .npy file in place (the header is rewritten
+    when its padding allows it, otherwise the file is copied).
+    """
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        shape, fortran, dtype = (np.lib.format.read_array_header_1_0(f) if version == (1, 0)
+                                 else np.lib.format.read_array_header_2_0(f))
+        offset = f.tell()
+        shape = (n,) + shape[1:]
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                      'fortran_order': fortran, 'shape': shape})
+        if len(header.getvalue()) == offset:
+            f.seek(0)
+            f.write(header.getvalue())
+            f.truncate(offset + int(np.prod(shape)) * dtype.itemsize)
+            return
+    old = np.load(path, mmap_mode='r')
+    tmp = f"{path}.tmp"
+    new = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=shape)
+    keep = min(len(old), n)
+    for lo, hi in _blocks(0, keep, BLOCK):
+        new[lo:hi] = old[lo:hi]
+    new.flush()
+    del old, new
+    os.replace(tmp, path)
+
+
+def extend_file(src, dst, b, a, block=BLOCK, margin=None, padlen=None, workers=1):
+    """
+    Bring dst, the filtered version of an earlier (shorter) src, up to date
+    after samples were appended to src. Only the last margin samples of dst
+    and the new ones are computed.
+
+    Returns:
+        Index of the first sample that was recomputed
+    """
+    n = len(np.load(src, mmap_mode='r'))
+    n_old = len(np.load(dst, mmap_mode='r'))
+    if n_old > n:
+        raise ValueError(f"{dst} has more samples ({n_old}) than {src} ({n})")
+    margin = settle_length(b, a) if margin is None else margin
+    _resize_npy(dst, n)
+    start = max(0, n_old - margin)
+    _run_blocks(src, dst, b, a, start, n, block, margin, padlen, workers)
+    return start
+
+
+def csv_to_npy(csv, columns, dst, chunksize=BLOCK):
+    """
+    Copy columns of a CSV log into a (n, len(columns)) .npy file, chunk by chunk.
+    """
+    import pandas as pd
+
+    n = sum(len(chunk) for chunk in pd.read_csv(csv, usecols=columns, chunksize=chunksize))
+    out = np.lib.format.open_memmap(dst, mode='w+', dtype=float, shape=(n, len(columns)))
+    pos = 0
+    for chunk in pd.read_csv(csv, usecols=columns, chunksize=chunksize):
+        out[pos:pos + len(chunk)] = chunk[columns].to_numpy(dtype=float)
+        pos += len(chunk)
+    out.flush()
+
+
+def main():
+    from scipy.signal import butter
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Check and time the out-of-core filtfilt")
+    parser.add_argument('--samples', type=int, default=20_000_000, help="Length of the synthetic series")
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--order', type=int, default=2)
+    parser.add_argument('--cutoff', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    b, a = butter(args.order, args.cutoff)
+    margin = settle_length(b, a)
+    print(f"butter({args.order}, {args.cutoff}): margin {margin} samples")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, 'x.npy'), os.path.join(tmp, 'y.npy')
+        rng = np.random.default_rng(0)
+        x = np.lib.format.open_memmap(src, mode='w+', dtype=float, shape=(args.samples, args.channels))
+        for lo, hi in _blocks(0, args.samples, BLOCK):
+            x[lo:hi] = rng.normal(0, 1, (hi - lo, args.channels)).cumsum(axis=0) * 0.01 + np.arange(lo, hi)[:, None] * 1e-6
+        x.flush()
+
+        # Accuracy against filtfilt on a part that fits in memory
+        check = min(args.samples, 2_000_000)
+        reference = filtfilt(b, a, x[:check], axis=0)
+        chunked = filtfilt_chunked(x[:check], b, a, block=100_000)
+        scale = np.abs(reference).max()
+        print(f"Max difference with filtfilt on {check} samples: {np.abs(chunked - reference).max() / scale:.1e} (relative)")
+
+        t0 = time.perf_counter()
+        filtfilt_file(src, dst, b, a, workers=args.workers)
+        elapsed = time.perf_counter() - t0
+        print(f"{args.samples} x {args.channels} samples from disk in {elapsed:.2f} s "
+              f"({args.samples / elapsed / 1e6:.1f} M samples/s, {args.workers} workers)")
+
+        # Incremental extension: filter the first part, append a day of 6 s samples, extend
+        day = 14400
+        part = os.path.join(tmp, 'part.npy')
+        np.save(part, x[:args.samples - day])
+        filtfilt_file(part, dst, b, a)
+        np.save(part, x[:])
+        t0 = time.perf_counter()
+        start = extend_file(part, dst, b, a)
+        elapsed = time.perf_counter() - t0
+        full = filtfilt_range(x, b, a, start - 10 * margin, args.samples, margin)
+        extended = np.load(dst, mmap_mode='r')[start - 10 * margin:]
+        print(f"Extension by {day} samples: recomputed from {start} in {elapsed * 1e3:.1f} ms, "
+              f"max difference {np.abs(extended - full).max() / scale:.1e} (relative)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Host receive timestamps and device clock alignment.
+
+The loggers stamp every read with HostClock: the monotonic clock (never
+steps, nanosecond resolution) taken right after the serial read returns,
+shifted to the local wall clock (as datetime.now(), which the CSVs hold), and
+kept as int64 ns in the WAL. Samples read together are back-dated by the
+sample period (burst_stamps()). Plot and
+write latency no longer leak into the timestamps, and the same monotonic
+reading gives the pipeline latency (read to redraw) of each sample.
+
+The board itself has no clock: it samples at every watchdog wake-up, whose
+period is far from the nominal 8 s (the WDT oscillator runs fast and
+depends on temperature and voltage). align() recovers it from the receive
+times: every sample gets its index in the device sequence (missing lines
+and samples read in one burst are accounted for), and the receive time of
+sample k is
+
+    received_k = t0 + k * period + latency_k,   latency_k >= 0
+
+so the device clock is the lower envelope of the receive times. Per
+segment between long gaps, it is the line through the minima of fixed
+blocks of samples (the mean period), and the aligned times follow the
+piecewise linear curve through those minima: the slopes between them give
+the period over time (its drift with the temperature). The aligned times
+give accurate intervals between samples, and received - aligned is the
+latency from the wake-up to the read (serial transmission, OS buffering,
+logger stalls) above its minimum.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from energy_model import MEASURED_PERIOD_S
+
+NS_PER_S = 1_000_000_000
+GAP_S = 60                     # Longer pauses start a new segment (logger stopped, board reset)
+BLOCK = 256                    # Samples per block of the lower envelope
+DRIFT_MIN_DAYS = 0.25          # Shorter segments do not report a drift
+LATENCY_WINDOW = 1000          # Pipeline latencies kept by the loggers
+
+
+class HostClock:
+    """
+    Local wall-clock nanoseconds from the monotonic clock, anchored once to the
+    wall clock.
+    """
+
+    def __init__(self):
+        self.offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def monotonic_ns(self):
+        return time.monotonic_ns()
+
+    def to_wall_ns(self, monotonic_ns):
+        # Naive local time, as the CSVs and the plots have it (the UTC offset follows daylight saving)
+        utc_ns = monotonic_ns + self.offset_ns
+        return utc_ns + time.localtime(utc_ns // NS_PER_S).tm_gmtoff * NS_PER_S
+
+
+def burst_stamps(received_ns, n, period_s=MEASURED_PERIOD_S):
+    """
+    Timestamps of n samples read at once: the last one at the read, the
+    earlier ones back-dated by the sample period, so that every row keeps its
+    own timestamp downstream (the WAL, the CSV, the loader's deduplication).
+    """
+    return received_ns - np.arange(n - 1, -1, -1, dtype=np.int64) * int(period_s * NS_PER_S)
+
+
+def sample_index(received_ns, period_ns):
+    """
+    Index of every sample in the device sequence.
+
+    A gap of n periods since the previous read counts n samples. Rows read
+    together were the last ones produced before the read: the loggers
+    back-date them by the nominal period (burst_stamps()), older logs give them
+    the same receive time. Either way the indices are made strictly increasing
+    from the end.
+    """
+    steps = np.rint(np.diff(received_ns) / period_ns).astype(np.int64)
+    k = np.concatenate(([0], np.cumsum(steps)))
+    i = np.arange(len(k))
+    k = np.minimum.accumulate((k - i)[::-1])[::-1] + i
+    return k - k[0]
+
+
+def read_times(received_ns, burst_period_s=MEASURED_PERIOD_S):
+    """
+    Whether every receive time was taken at a read, rather than derived from
+    the next one: back-dated by burst_stamps(), or equal in older logs.
+    """
+    derived = np.isin(np.diff(received_ns), (0, int(burst_period_s * NS_PER_S)))
+    return np.append(~derived, True)
+
+
+def lower_envelope(k, received_ns, period_ns, block=BLOCK, iterations=3, measured=None):
+    """
+    Minima of fixed blocks of the receive times, detrended by the period
+    fitted through them.
+
+    Args:
+        measured: bool per sample, False for times the minima must not use
+            (read_times()); blocks without any measured time are skipped
+
+    Returns:
+        (period ns, positions of the block minima)
+    """
+    n = len(k)
+    blocks = -(-n // block)
+    pad = blocks * block - n
+    x = k.astype(float)
+    y = (received_ns - received_ns[0]).astype(float)
+    excluded = np.append(np.zeros(n, bool) if measured is None else ~measured, np.ones(pad, bool))
+    for _ in range(iterations):
+        residual = np.concatenate((y - period_ns * x, np.zeros(pad)))
+        residual = np.where(excluded, np.inf, residual).reshape(blocks, block)
+        minima = residual.argmin(axis=1) + np.arange(blocks) * block
+        minima = minima[np.isfinite(residual.min(axis=1))]
+        if len(minima) > 1:
+            period_ns = np.polyfit(x[minima], y[minima], 1)[0]
+    return period_ns, minima
+
+
+def align(received_ns, nominal_period_s=MEASURED_PERIOD_S, gap_s=GAP_S, block=BLOCK):
+    """
+    Device sample times from host receive times.
+
+    Args:
+        received_ns: int64 receive times, sorted (a capture of one device)
+        nominal_period_s: Period the measured one is compared with (ppm)
+
+    Returns:
+        (aligned int64 ns, latency int64 ns (received - aligned),
+         segments DataFrame: start, end, samples, missing, period_s, ppm (vs nominal),
+         drift_ppm_per_day, latency_p50_ms, latency_p99_ms,
+         periods DataFrame: time, period_s between consecutive block minima)
+    """
+    received_ns = np.asarray(received_ns, np.int64)
+    aligned = np.empty_like(received_ns)
+    bounds = np.flatnonzero(np.diff(received_ns) > gap_s * NS_PER_S) + 1
+    segments, periods = [], []
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(received_ns)]):
+        r = received_ns[lo:hi]
+        measured = read_times(r)
+        if measured.sum() < 2:
+            aligned[lo:hi] = r
+            continue
+        # Count the samples on the usual spacing, then again on the fitted period
+        diffs = np.diff(r)
+        period_ns = np.median(diffs[diffs > 0]) if (diffs > 0).any() else nominal_period_s * NS_PER_S
+        size = min(block, max(8, (hi - lo) // 8))
+        for _ in range(2):
+            k = sample_index(r, period_ns)
+            period_ns, minima = lower_envelope(k, r, period_ns, size, measured=measured)
+        # Piecewise linear through the block minima (the period follows the temperature),
+        # extended with the fitted period, then lowered under every receive time taken at a read
+        xp = np.r_[k[0] - 1, k[minima], k[-1] + 1]
+        fp = np.r_[r[minima[0]] - (k[minima[0]] - k[0] + 1) * period_ns, r[minima],
+                   r[minima[-1]] + (k[-1] + 1 - k[minima[-1]]) * period_ns]
+        envelope = np.interp(k, xp, fp)
+        envelope += min(0.0, (r - envelope)[measured].min())
+        aligned[lo:hi] = np.rint(envelope).astype(np.int64)
+
+        local = np.diff(r[minima]) / np.diff(k[minima]) / NS_PER_S
+        middle = (r[minima[:-1]] + r[minima[1:]]) // 2
+        periods.append(pd.DataFrame({'time': middle.view('datetime64[ns]'), 'period_s': local}))
+        days = (middle - r[0]) / (86400 * NS_PER_S)
+        drift = np.nan
+        if len(local) > 2 and days[-1] - days[0] >= DRIFT_MIN_DAYS:
+            drift = np.polyfit(days, local, 1)[0] / (period_ns / NS_PER_S) * 1e6
+        latency = (r - aligned[lo:hi])[measured] / 1e6
+        segments.append({
+            'start': r[0].view('datetime64[ns]'),
+            'end': r[-1].view('datetime64[ns]'),
+            'samples': hi - lo,
+            'missing': int(k[-1] + 1 - (hi - lo)),
+            'period_s': period_ns / NS_PER_S,
+            'ppm': (period_ns / NS_PER_S / nominal_period_s - 1) * 1e6,
+            'drift_ppm_per_day': drift,
+            'latency_p50_ms': np.percentile(latency, 50),
+            'latency_p99_ms': np.percentile(latency, 99),
+        })
+    periods = pd.concat(periods, ignore_index=True) if periods else pd.DataFrame(columns=['time', 'period_s'])
+    return aligned, received_ns - aligned, pd.DataFrame(segments), periods
+
+
+def simulate(samples, period_s=5.98, ppm_swing=300, seed=0):
+    """
+    Receive times of a simulated capture, as the loggers stamp them: a
+    watchdog period swinging with a daily temperature cycle, serial and OS
+    latency, a stalled logger reading bursts of frames (back-dated by
+    burst_stamps()), lost lines and a 10 minute pause.
+
+    Returns:
+        (received int64 ns, true sample times int64 ns)
+    """
+    rng = np.random.default_rng(seed)
+    k = np.arange(samples)
+    day = k * period_s / 86400
+    true_period = period_s * (1 + ppm_swing * 1e-6 * np.sin(2 * np.pi * day))
+    true_ns = np.datetime64('2025-03-01', 'ns').astype(np.int64) + np.cumsum(true_period * NS_PER_S).astype(np.int64)
+    true_ns[samples // 2:] += 600 * NS_PER_S
+    # 90 characters at 74880 baud, then the OS and the 100 ms animation interval
+    latency = 0.012 + rng.exponential(0.005, samples) + rng.uniform(0, 0.1, samples)
+    received = true_ns + (latency * NS_PER_S).astype(np.int64)
+    # Stalls: the logger reads nothing for a few periods, then all waiting frames at once
+    stalls = rng.choice(samples - 10, samples // 2000, replace=False)
+    for start in stalls:
+        length = rng.integers(2, 8)
+        received[start:start + length + 1] = burst_stamps(received[start + length], length + 1)
+    keep = rng.random(samples) > 0.005
+    return received[keep], true_ns[keep]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watchdog period, drift and latency from receive timestamps")
+    parser.add_argument('source', nargs='*', default=['wal'],
+                        help="WAL directories, or CSV files of the loggers (millisecond timestamps)")
+    parser.add_argument('--nominal', type=float, default=MEASURED_PERIOD_S, help="Nominal sample period [s]")
+    parser.add_argument('--synthetic', type=int, metavar='SAMPLES',
+                        help="Check and time the alignment on a simulated capture instead")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        received, true_ns = simulate(args.synthetic)
+        t0 = time.perf_counter()
+        aligned, latency, segments, periods = align(received, args.nominal)
+        elapsed = time.perf_counter() - t0
+        print(segments.to_string(index=False))
+        # The aligned times carry the minimum latency: compare the intervals
+        error = np.diff(aligned) - np.diff(true_ns)
+        error_ms = np.abs(error[np.abs(error) < GAP_S * NS_PER_S]) / 1e6
+        raw_ms = np.abs(np.diff(received) - np.diff(true_ns))[np.abs(error) < GAP_S * NS_PER_S] / 1e6
+        print(f"{len(received)} samples aligned in {elapsed * 1e3:.0f} ms")
+        print(f"Interval error: receive times p50 {np.median(raw_ms):.1f} ms / p99 {np.percentile(raw_ms, 99):.1f} ms, "
+              f"aligned p50 {np.median(error_ms):.2f} ms / p99 {np.percentile(error_ms, 99):.2f} ms")
+        print(f"Local period swing: {(periods['period_s'].max() / periods['period_s'].min() - 1) * 1e6:.0f} ppm "
+              f"(simulated 600)")
+        return
+
+    from pathlib import Path
+
+    from loader import read_file
+    from wal import list_segments, read_segment
+
+    for source in args.source:
+        if Path(source).is_dir():
+            parts = [read_segment(path)[1] for path in list_segments(source)]
+            received = np.concatenate(parts) if parts else np.zeros(0, np.int64)
+        else:
+            received = read_file(source, [])[0].view(np.int64)
+        if len(received) < 2:
+            print(f"{source}: not enough samples")
+            continue
+        _, _, segments, periods = align(np.sort(received), args.nominal)
+        print(f"{source}:")
+        print(segments.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
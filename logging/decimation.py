@@ -0,0 +1,219 @@
+import numpy as np
+
+DISPLAY_POINTS = 2000  # Default number of points handed to Matplotlib
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if x.dtype.kind == 'M':
+        return x.astype('datetime64[ns]').view(np.int64).astype(float)
+    return x.astype(float, copy=False)
+
+
+def _segments(starts, n):
+    """
+    Length of every segment and the segment id of every element.
+    """
+    counts = np.diff(np.append(starts, n))
+    return counts, np.repeat(np.arange(len(starts)), counts)
+
+
+def _first_where(mask, segment_id):
+    """
+    Index of the first True element of every segment (every segment must have one).
+    """
+    idx = np.flatnonzero(mask)
+    sid = segment_id[idx]
+    return idx[np.concatenate(([True], sid[1:] != sid[:-1]))]
+
+
+def _segment_argmax(values, starts, counts, segment_id):
+    values = np.where(np.isnan(values), -np.inf, values)
+    peaks = np.maximum.reduceat(values, starts)
+    return _first_where(values == np.repeat(peaks, counts), segment_id)
+
+
+def lttb(x, y, n_out=DISPLAY_POINTS):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    The interior points are split into n_out-2 equal-count buckets and the point
+    forming the largest triangle with its neighbouring buckets is kept from each.
+    The left vertex of each triangle is the previous bucket's average instead of
+    its selected point, which removes the sequential dependency so that every
+    bucket is resolved in a single NumPy pass.
+
+    Args:
+        x: Sorted abscissa (numbers or datetime64)
+        y: Ordinate, same length as x
+        n_out: Number of points to keep
+
+    Returns:
+        Sorted indices of the kept points (first and last are always kept)
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+
+    starts = np.linspace(1, n - 1, n_out - 1).astype(np.int64)[:-1]
+    counts, bucket = _segments(starts, n - 1)
+    mean_x = np.add.reduceat(x[:-1], starts) / counts
+    mean_y = np.add.reduceat(y[:-1], starts) / counts
+
+    ax = np.repeat(np.concatenate(([x[0]], mean_x[:-1])), counts)
+    ay = np.repeat(np.concatenate(([y[0]], mean_y[:-1])), counts)
+    cx = np.repeat(np.concatenate((mean_x[1:], [x[-1]])), counts)
+    cy = np.repeat(np.concatenate((mean_y[1:], [y[-1]])), counts)
+    px, py = x[1:-1], y[1:-1]
+    area = np.abs((ax - cx) * (py - ay) - (ax - px) * (cy - ay))
+
+    picked = _segment_argmax(area, starts - 1, counts, bucket) + 1
+    return np.concatenate(([0], picked, [n - 1]))
+
+
+def minmax_envelope(x, y, n_pixels=DISPLAY_POINTS // 4, x_range=None):
+    """
+    Per-pixel-column envelope (M4): keep the first, last, min and max point of
+    every column so that the rendered line is identical to the full series.
+
+    Args:
+        x: Sorted abscissa (numbers or datetime64)
+        y: Ordinate, same length as x
+        n_pixels: Number of horizontal pixel columns
+        x_range: (x_min, x_max) of the view, defaults to the extent of x
+
+    Returns:
+        Sorted indices of the kept points (at most 4 per column)
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= 4 * n_pixels:
+        return np.arange(n)
+    x = _as_float(x)
+    x0, x1 = (x[0], x[-1]) if x_range is None else _as_float(x_range)
+    scale = n_pixels / (x1 - x0) if x1 > x0 else 0.0
+    column = np.clip(((x - x0) * scale).astype(np.int64), 0, n_pixels - 1)
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(column)) + 1))
+    counts, segment_id = _segments(starts, n)
+    last = np.append(starts[1:], n) - 1
+    top = _segment_argmax(y, starts, counts, segment_id)
+    bottom = _segment_argmax(-y, starts, counts, segment_id)
+    return np.unique(np.concatenate((starts, last, top, bottom)))
+
+
+class IncrementalEnvelope:
+    """
+    Per-pixel-column envelope of a growing history, updated in time
+    proportional to the samples of one column instead of the whole history.
+
+    Columns are aligned on multiples of a width that doubles whenever the
+    history outgrows n_pixels columns; the closed columns are then merged
+    pairwise (first of the left one, last of the right one, the higher max and
+    the lower min are the envelope of their union). An update re-envelopes
+    only the samples of the last, still open column and the new ones, so the
+    history uses between n_pixels / 2 and n_pixels columns.
+    """
+
+    def __init__(self, n_pixels=DISPLAY_POINTS // 4):
+        self.n_pixels = n_pixels
+        self.x0 = None
+        self.width = None
+        self.open_start = 0                       # First sample of the open column
+        self.ids = np.zeros(0, np.int64)          # Closed columns and their kept samples
+        self.first = np.zeros(0, np.int64)
+        self.last = np.zeros(0, np.int64)
+        self.top = None
+        self.bottom = None
+
+    def _merge(self, values):
+        ids = self.ids // 2
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(ids)] - 1
+        lo = np.arange(self.top.shape[1])
+        left, right = self.top[starts], self.top[ends]
+        self.top = np.where(values[right, lo] > values[left, lo], right, left)
+        left, right = self.bottom[starts], self.bottom[ends]
+        self.bottom = np.where(values[right, lo] < values[left, lo], right, left)
+        self.ids, self.first, self.last = ids[starts], self.first[starts], self.last[ends]
+
+    def update(self, x, values):
+        """
+        Args:
+            x: Sorted abscissa of the whole history (numbers or datetime64)
+            values: Channel values of the whole history, shape (n, channels)
+
+        Returns:
+            Sorted indices of the kept points of every channel (at most 4 per column)
+        """
+        values = np.asarray(values, dtype=float)
+        n, n_channels = values.shape
+        if self.width is None:
+            if n <= 4 * self.n_pixels:
+                return [np.arange(n)] * n_channels
+            x = _as_float(x)
+            self.x0 = x[0]
+            self.width = max(x[-1] - x[0], 1e-9) * 2 / self.n_pixels
+            self.top = self.bottom = np.zeros((0, n_channels), np.int64)
+        else:
+            x = _as_float(x)
+
+        while (x[-1] - self.x0) / self.width >= self.n_pixels:
+            self.width *= 2
+            self._merge(values)
+            if len(self.ids) and self.ids[-1] == int((x[self.open_start] - self.x0) // self.width):
+                # The open column swallowed the last closed one
+                self.open_start = self.first[-1]
+                self.ids, self.first, self.last = self.ids[:-1], self.first[:-1], self.last[:-1]
+                self.top, self.bottom = self.top[:-1], self.bottom[:-1]
+
+        # Envelope of the open column and the new samples
+        start = self.open_start
+        column = ((x[start:] - self.x0) // self.width).astype(np.int64)
+        column = np.maximum.accumulate(column)
+        starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+        counts, segment_id = _segments(starts, len(column))
+        top = np.column_stack([_segment_argmax(values[start:, i], starts, counts, segment_id)
+                               for i in range(n_channels)]) + start
+        bottom = np.column_stack([_segment_argmax(-values[start:, i], starts, counts, segment_id)
+                                  for i in range(n_channels)]) + start
+        first = starts + start
+        last = np.r_[starts[1:], len(column)] - 1 + start
+
+        # Every column but the last is closed for good
+        self.ids = np.r_[self.ids, column[starts[:-1]]]
+        self.first = np.r_[self.first, first[:-1]]
+        self.last = np.r_[self.last, last[:-1]]
+        self.top = np.vstack((self.top, top[:-1]))
+        self.bottom = np.vstack((self.bottom, bottom[:-1]))
+        self.open_start = first[-1]
+
+        shared = np.r_[self.first, self.last, first[-1], last[-1]]
+        return [np.unique(np.r_[shared, self.top[:, i], self.bottom[:, i], top[-1, i], bottom[-1, i]])
+                for i in range(n_channels)]
+
+
+def decimate(x, y, n_out=DISPLAY_POINTS, method='lttb'):
+    """
+    Reduce a series to about n_out points for plotting.
+
+    Args:
+        x: Sorted abscissa (numbers or datetime64)
+        y: Ordinate, same length as x
+        n_out: Target number of points
+        method: 'lttb' or 'minmax'
+
+    Returns:
+        (x, y) decimated
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if method == 'lttb':
+        idx = lttb(x, y, n_out)
+    elif method == 'minmax':
+        idx = minmax_envelope(x, y, max(n_out // 4, 1))
+    else:
+        raise ValueError(f"Unknown decimation method '{method}'")
+    return x[idx], y[idx]
@@ -0,0 +1,239 @@
+import argparse
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+
+# Firmware as flashed (main/main.ino)
+F_CPU = 8e6                    # Pro Mini 3.3 V
+ADC_PRESCALER = 64             # Arduino core default at 8 MHz -> 125 kHz ADC clock
+ADC_CYCLES = 13                # ADC clock cycles per conversion
+ADC_MAX_CLOCK = 200e3          # Above this the ADC loses resolution (datasheet)
+N_SAMPLES = 2000               # analogRead calls per meas_pin_raw
+N_CHANNELS = 3                 # meas_pin_raw calls per wake
+WDT_PRESCALER = 9              # setup_watchdog(9): 8 s nominal
+SEND_THRESHOLD = 128           # send_counter_threshold
+ALPHA = 0.73                   # filter() coefficient
+PRE_SLEEP_DELAY_S = 0.100      # delay(100) before sleep()
+COMPUTE_CYCLES = 8000          # Soft-float work per wake: Th(), filter(), scaling
+SERIAL_BAUD = 74880
+SERIAL_CHARS = 90              # Debug text printed per wake
+SEND_BLINK_S = 0.6 + 1.2       # blink(2) before and blink(4) after a send
+TX_S = 6.0                     # Module time from AT$SF to OK (3 repetitions)
+MEASURED_PERIOD_S = 6.0        # Sample spacing in the logs: the WDT runs fast
+
+# Supply currents [mA] (typical datasheet values, adjust to the board)
+CURRENTS_MA = {
+    'active': 3.0,             # ATmega328P at 8 MHz / 3.3 V
+    'adc': 0.3,                # ADC on, during conversions
+    'led': 2.0,                # LED on (LED_PIN LOW, active-low) half of the blink() time; it idles HIGH
+    'sleep': 0.005,            # Power-down with the watchdog running
+    'always_on': 0.47,         # Regulator (0.08) + LM35 (0.06) + 10 kΩ battery divider (0.33)
+    'module_tx': 40.0,         # Sigfox module while transmitting
+    'module_idle': 0.01,       # Sigfox module between commands
+}
+BATTERY_MAH = 2000
+
+# Temperature per ADC LSB for each channel (tempExt: 1.1 V ref, 10 mV/°C)
+LSB_DEGC = {'tempExt': 1.1 / 1023 * 100}
+QUANTIZATION_LSB = 1 / np.sqrt(12)  # Noise of one conversion of an ideal ADC
+DITHER_LSB = 0.5               # Input noise from which conversions are self-dithered
+LOGGED_CSV = ('arduino_data2.csv', 'arduino_data3.csv')  # Series logged by the current firmware
+
+
+def watchdog_period(prescaler, measured_period_s=MEASURED_PERIOD_S):
+    """
+    Real sleep duration for a WDT prescaler (0..9), scaled to the measured oscillator.
+    """
+    nominal = 0.016 * 2.0 ** np.asarray(prescaler)
+    wake_s = wake_time(N_SAMPLES, ADC_PRESCALER)['total']
+    return nominal * (measured_period_s - wake_s) / (0.016 * 2.0 ** WDT_PRESCALER)
+
+
+def wake_time(n, adc_prescaler, pre_sleep_delay_s=PRE_SLEEP_DELAY_S, f_cpu=F_CPU):
+    """
+    Duration of one measurement wake, broken down by activity (broadcasts over arrays).
+
+    Returns:
+        dict of seconds: 'adc', 'compute', 'serial', 'delay' and 'total'
+    """
+    ones = np.ones(np.broadcast(n, adc_prescaler, pre_sleep_delay_s).shape)
+    parts = {
+        'adc': N_CHANNELS * np.asarray(n) * ADC_CYCLES * np.asarray(adc_prescaler) / f_cpu * ones,
+        'compute': COMPUTE_CYCLES / f_cpu * ones,
+        'serial': SERIAL_CHARS * 10 / SERIAL_BAUD * ones,
+        'delay': pre_sleep_delay_s * ones,
+    }
+    parts['total'] = sum(parts.values())
+    return parts
+
+
+def wake_charge_mas(n, adc_prescaler, pre_sleep_delay_s=PRE_SLEEP_DELAY_S, currents=CURRENTS_MA):
+    """
+    Charge drawn above the sleep current by one measurement wake [mA.s] (broadcasts over arrays).
+    """
+    wake = wake_time(n, adc_prescaler, pre_sleep_delay_s)
+    return currents['active'] * wake['total'] + currents['adc'] * wake['adc']
+
+
+def average_current(n, adc_prescaler, sleep_s, send_every, tx_s=TX_S,
+                    pre_sleep_delay_s=PRE_SLEEP_DELAY_S, currents=CURRENTS_MA):
+    """
+    Mean supply current over a send cycle (broadcasts over arrays).
+
+    Returns:
+        (mean current [mA], wake period [s])
+    """
+    c = currents
+    wake = wake_time(n, adc_prescaler, pre_sleep_delay_s)
+    # Charge per measurement wake and per send [mA.s]
+    wake_charge = wake_charge_mas(n, adc_prescaler, pre_sleep_delay_s, currents)
+    send_s = SEND_BLINK_S + tx_s
+    send_charge = c['active'] * send_s + c['led'] * SEND_BLINK_S / 2 + (c['module_tx'] - c['module_idle']) * tx_s
+    period = wake['total'] + sleep_s
+    cycle = period * send_every + send_s
+    charge = (wake_charge + c['sleep'] * sleep_s) * send_every + send_charge
+    return charge / cycle + c['always_on'] + c['module_idle'], period
+
+
+def battery_life_days(mean_ma, capacity_mah=BATTERY_MAH):
+    return capacity_mah / mean_ma / 24
+
+
+def series_noise(series, alpha=0.0):
+    """
+    Noise of logged series from their sample-to-sample differences, using the
+    median absolute deviation so that real moves and glitches do not count.
+
+    A series logged after filter() is an AR(1) process, whose differences have
+    a variance of 2 * sigma**2 * (1 - alpha); alpha=0 for unfiltered samples.
+    """
+    diff = np.concatenate([np.diff(np.asarray(values, dtype=float)) for values in series])
+    sigma_diff = 1.4826 * np.median(np.abs(diff - np.median(diff)))
+    return sigma_diff / np.sqrt(2 * (1 - alpha))
+
+
+def filtered_noise(sigma_reading, alpha=ALPHA):
+    return sigma_reading * np.sqrt((1 - alpha) / (1 + alpha))
+
+
+def reading_noise(n, sigma_conversion, lsb, alpha=ALPHA):
+    """
+    Noise of a meas_pin_raw average of n conversions after filter().
+
+    White noise averages down as 1/sqrt(n) only when it dithers the input (at
+    least DITHER_LSB): below that, the conversions of a steady input return the
+    same code, and neither the average nor filter() go under the quantization
+    noise of one LSB.
+    """
+    noise = filtered_noise(sigma_conversion / np.sqrt(n), alpha)
+    if sigma_conversion >= DITHER_LSB * lsb:
+        return noise
+    return np.maximum(noise, lsb * QUANTIZATION_LSB)
+
+
+def optimize(sigma_conversion, lsb, target, max_period_s=10.0, max_uplinks_per_day=140, tx_s=TX_S,
+             n_grid=(16, 32, 64, 128, 256, 512, 1000, 2000, 4000),
+             prescaler_grid=(16, 32, 64, 128),
+             wdt_grid=(WDT_PRESCALER,),
+             send_grid=(SEND_THRESHOLD,),
+             delay_grid=(PRE_SLEEP_DELAY_S, 0.002)):
+    """
+    Sweep the loop parameters and keep the configurations meeting the constraints.
+
+    The WDT period and the send threshold (the uplink cadence) stay as flashed
+    unless grids are given for them, so the ranking compares only what a wake
+    costs: its duration, then its charge. ADC clocks above ADC_MAX_CLOCK are
+    out of specification and rejected.
+
+    Args:
+        sigma_conversion: Noise of a single conversion, in output units
+        lsb: One ADC step, in output units
+        target: Maximum noise after filter(), in output units
+        max_period_s: Longest acceptable time between two measurements
+        max_uplinks_per_day: Sigfox limit
+
+    Returns:
+        dict of 1-D arrays (one entry per feasible configuration), sorted by
+        increasing wake time, then charge per wake
+    """
+    grid = np.array(list(product(n_grid, prescaler_grid, wdt_grid, send_grid, delay_grid)), dtype=float)
+    n, prescaler, wdt, send_every, delay = grid.T
+    sleep_s = watchdog_period(wdt)
+    current, period = average_current(n, prescaler, sleep_s, send_every, tx_s, delay)
+    noise = reading_noise(n, sigma_conversion, lsb)
+    uplinks = 86400 / (period * send_every)
+    wake_ms = wake_time(n, prescaler, delay)['total'] * 1e3
+    charge_uc = wake_charge_mas(n, prescaler, delay) * 1e3
+    ok = ((noise <= target) & (F_CPU / prescaler <= ADC_MAX_CLOCK) & (period <= max_period_s)
+          & (uplinks <= max_uplinks_per_day))
+    order = np.lexsort((charge_uc[ok], wake_ms[ok]))
+    result = {
+        'N': n, 'prescaler': prescaler, 'wdt': wdt, 'send_every': send_every, 'delay_s': delay,
+        'wake_ms': wake_ms, 'wake_uC': charge_uc, 'period_s': period, 'uplinks/day': uplinks,
+        'noise': noise, 'mean_mA': current, 'life_days': battery_life_days(current),
+    }
+    return {key: value[ok][order] for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Battery life model of the firmware loop and parameter optimizer")
+    parser.add_argument('--capture', help="Raw ADC capture (see adc_noise.py) giving the noise of one conversion, "
+                                          "default: the quantization floor")
+    parser.add_argument('--reads-per-sample', type=int,
+                        help="ADC conversions summed into each sample of the capture, "
+                             "default: the fewest that reach its largest sample")
+    parser.add_argument('--channel', default='tempExt', choices=sorted(LSB_DEGC))
+    parser.add_argument('--logged', nargs='+', default=LOGGED_CSV,
+                        help="CSV logged by the current firmware, whose noise is the target")
+    parser.add_argument('--target', type=float, help="Noise target after filter() [°C], instead of --logged")
+    parser.add_argument('--max-period', type=float, default=10.0, help="Longest time between measurements [s]")
+    parser.add_argument('--tx', type=float, default=TX_S, help="Module transmit time [s]")
+    parser.add_argument('--sweep-cadence', action='store_true', help="Also vary the WDT period and the send threshold")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.capture:
+        from adc_noise import analyze, iter_chunks
+
+        from adc_noise import iter_chunks, reads_for
+
+        chunks = list(iter_chunks(args.capture))
+        reads = args.reads_per_sample or reads_for(max(chunk.max(initial=0) for chunk in chunks))
+        # Noise of one sample (a sum of conversions) scaled back to one conversion (white noise)
+        sigma_lsb = series_noise(chunks) / np.sqrt(reads)
+        source = Path(args.capture).name
+    else:
+        sigma_lsb, source = QUANTIZATION_LSB, "quantization floor"
+    lsb = LSB_DEGC[args.channel]
+    sigma_conversion = sigma_lsb * lsb
+    current_noise = reading_noise(N_SAMPLES, sigma_conversion, lsb)
+    if args.target is None:
+        import pandas as pd
+
+        target = series_noise([pd.read_csv(path)[args.channel] for path in args.logged], ALPHA)
+        target_source = ", ".join(Path(path).name for path in args.logged)
+    else:
+        target, target_source = args.target, "--target"
+    print(f"{args.channel}: {sigma_lsb:.3f} LSB ({sigma_conversion:.4f} °C) per conversion ({source}), "
+          f"{current_noise:.4f} °C after filter() at N={N_SAMPLES}; target {target:.4f} °C ({target_source})")
+
+    wake = wake_time(N_SAMPLES, ADC_PRESCALER)
+    mean_ma, period = average_current(N_SAMPLES, ADC_PRESCALER, watchdog_period(WDT_PRESCALER), SEND_THRESHOLD, args.tx)
+    print("Current firmware: wake " + ", ".join(f"{k} {v * 1e3:.1f} ms" for k, v in wake.items())
+          + f", {wake_charge_mas(N_SAMPLES, ADC_PRESCALER) * 1e3:.0f} uC; period {period:.2f} s, "
+            f"{mean_ma:.3f} mA, {battery_life_days(mean_ma):.0f} days")
+
+    grids = {'wdt_grid': (6, 7, 8, 9), 'send_grid': (32, 64, 96, 128, 192, 256, 512)} if args.sweep_cadence else {}
+    best = optimize(sigma_conversion, lsb, target, args.max_period, tx_s=args.tx, **grids)
+    if not len(best['N']):
+        print(f"No configuration reaches {target:.4f} °C")
+        return
+    columns = list(best)
+    print(''.join(f"{c:>12}" for c in columns))
+    for i in range(min(args.top, len(best['N']))):
+        print(''.join(f"{best[c][i]:>12.4g}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.signal import butter, filtfilt, cheby1
-import pandas as pd
+from scipy.signal import butter, cheby1
 
-raw_data = pd.read_csv("arduino_data3.csv")
-raw_data.head()
+from chunked_filtfilt import filtfilt_chunked
+from decimation import decimate
+from loader import load
 
-# Convertir la colonne 'timestamp' en type datetime
-raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp'])
+# Charger le journal (format d'horodatage fixe, types fixes)
+raw_data = load("arduino_data3.csv").drop(columns='device')
+raw_data.head()
 
 # Échantillonner les données pour ne garder qu'un échantillon toutes les 8 secondes
 data = raw_data.set_index('timestamp').resample('8s').first().reset_index()
@@ -24,10 +25,14 @@ def plot_original_and_resampled_with_plot_date(signal_name):
     original_signal = raw_data[['timestamp', signal_name]].dropna()
     resampled_signal = data[['timestamp', signal_name]].dropna()
 
+    # Réduire chaque série à ~2000 points (LTTB) en conservant les pics
+    original_t, original_y = decimate(original_signal['timestamp'], original_signal[signal_name])
+    resampled_t, resampled_y = decimate(resampled_signal['timestamp'], resampled_signal[signal_name])
+
     # Tracer les signaux avec plot_date
     plt.figure(figsize=(12, 6))
-    plt.plot_date(original_signal['timestamp'], original_signal[signal_name], label='Signal original', alpha=0.7, linestyle='-')
-    plt.plot_date(resampled_signal['timestamp'], resampled_signal[signal_name], label='Signal échantillonné', alpha=0.7, linestyle='--')
+    plt.plot_date(original_t, original_y, label='Signal original', alpha=0.7, linestyle='-')
+    plt.plot_date(resampled_t, resampled_y, label='Signal échantillonné', alpha=0.7, linestyle='--')
     plt.title(f'Comparaison des signaux {signal_name}')
     plt.xlabel('Timestamp')
     plt.ylabel('Amplitude')
@@ -71,12 +76,12 @@ def filter_signal(signal_name, method='butter', order=2, cutoff=0.1, ripple=5, p
     else:
         raise ValueError(f"Méthode de filtrage '{method}' non supportée.")
 
-    # Appliquer le filtre au signal
-    filtered_signal = filtfilt(b, a, signal)
-    # Tracer le signal original et le signal filtré
+    # Appliquer le filtre au signal (par blocs, identique à filtfilt à 1e-10 près)
+    filtered_signal = filtfilt_chunked(signal.to_numpy(dtype=float), b, a)
+    # Tracer le signal original et le signal filtré, réduits à ~2000 points (LTTB)
     if plot_original:
-        plt.plot(signal, label='Signal original', alpha=0.7)
-    plt.plot(filtered_signal, label=f'{method}-order={order}', alpha=0.7)
+        plt.plot(*decimate(signal.index, signal), label='Signal original', alpha=0.7)
+    plt.plot(*decimate(signal.index, filtered_signal), label=f'{method}-order={order}', alpha=0.7)
 
 # Exemple d'utilisation de la fonction
 plt.figure(figsize=(12, 6))
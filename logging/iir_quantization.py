@@ -0,0 +1,286 @@
+"""
+Numeric implementations of the firmware's smoothing filter, simulated on logged traces.
+
+main/main.ino smooths every channel with filter(): y = alpha*y + (1-alpha)*x
+in soft float (alpha = 0.73). This tool runs the same recursion under
+integer arithmetic that an 8-bit AVR does cheaply and compares it with
+float64:
+    float32: the firmware as flashed (IEEE single, rounded after every operation)
+    q:       input with F fractional bits, state with G more, alpha as a/2^K,
+             y = (a*y + (2^K - a)*(x << G) + r) >> K (one multiply-accumulate)
+    shift:   alpha = 1 - 2^-s (3/4 for s=2), y += ((x << G) - y + r) >> s on a
+             state with G extra (guard) fractional bits, no multiply
+r is 0 for floor (an arithmetic shift) or half an LSB for round.
+
+The time recursion is a single loop; every step updates all the
+configurations of the grid at once. Besides the error against float64 on
+the traces, a constant-input test gives each configuration's dead band (how
+far from a constant input the state gets stuck) and limit cycle (peak to
+peak of the output once settled).
+
+The logs hold filter() outputs: unless --logged, the readings that went
+into the filter are recovered as x = (y[n] - alpha*y[n-1]) / (1 - alpha).
+"""
+import argparse
+from itertools import product
+
+import numpy as np
+from scipy.signal import lfilter
+
+from energy_model import ALPHA
+
+CHANNELS = ('tempExt', 'tempInt', 'battVolt')
+ALPHAS = (0.5, 0.6, 0.7, 0.73, 0.75, 0.8, 0.85, 0.9, 0.95)
+FRAC_BITS = (0, 4, 8)                  # Fractional bits of the input, in channel units (°C, V)
+COEFF_BITS = (8, 16)                   # Bits of the q coefficient
+SHIFTS = (1, 2, 3, 4)                  # alpha = 0.5, 0.75, 0.875, 0.9375
+GUARD_BITS = (0, 4, 8)
+ROUNDING = ('floor', 'round')
+TOLERANCE = 0.01                       # The CSV logs and the uplink resolve 0.01 °C at best
+
+
+def integer_grid(alphas=ALPHAS, frac_bits=FRAC_BITS, coeff_bits=COEFF_BITS, shifts=SHIFTS,
+                 guard_bits=GUARD_BITS, rounding=ROUNDING):
+    """
+    Integer configurations to simulate.
+
+    Returns:
+        dict of equal-length arrays: 'kind' ('q' or 'shift'), 'nominal' (alpha
+        asked for), 'alpha' (alpha implemented), 'a', 'coeff_bits', 'frac_bits',
+        'guard_bits', 'round' (bool)
+    """
+    rows = []
+    for alpha, k, g, f, mode in product(alphas, coeff_bits, guard_bits, frac_bits, rounding):
+        a = int(round(alpha * 2 ** k))
+        rows.append(('q', alpha, a / 2 ** k, a, k, f, g, mode == 'round'))
+    for s, g, f, mode in product(shifts, guard_bits, frac_bits, rounding):
+        rows.append(('shift', 1 - 2.0 ** -s, 1 - 2.0 ** -s, 2 ** s - 1, s, f, g, mode == 'round'))
+    names = ('kind', 'nominal', 'alpha', 'a', 'coeff_bits', 'frac_bits', 'guard_bits', 'round')
+    return {name: np.array(column) for name, column in zip(names, zip(*rows))}
+
+
+def describe(configs, i):
+    rounding = 'round' if configs['round'][i] else 'floor'
+    f, k = configs['frac_bits'][i], configs['coeff_bits'][i]
+    if configs['kind'][i] == 'q':
+        return f"q: x Q.{f}, alpha {configs['a'][i]}/2^{k}, {configs['guard_bits'][i]} guard bits, {rounding}"
+    return f"shift: x Q.{f}, y += (x-y)>>{k}, {configs['guard_bits'][i]} guard bits, {rounding}"
+
+
+def _bits(peak):
+    """
+    Signed register width holding values up to |peak|.
+    """
+    return np.ceil(np.log2(np.asarray(peak, float) + 1)).astype(int) + 1
+
+
+def quantize_input(x, configs):
+    """
+    Readings as the integers every configuration filters: Q.F, shifted left by the guard bits.
+    """
+    scale = 2.0 ** configs['frac_bits']
+    return np.round(np.asarray(x, float)[..., None] * scale).astype(np.int64) << configs['guard_bits']
+
+
+def simulate_integer(X, Y, configs):
+    """
+    Run every configuration over integer inputs.
+
+    Args:
+        X: (n, ...) int64 inputs, the last axis running over the configurations
+        Y: Initial states, shaped like X[0]
+
+    Returns:
+        (states (n, ...) int64, register width needed per configuration)
+    """
+    a = configs['a']
+    k = configs['coeff_bits']
+    b = (1 << k) - a
+    r = np.where(configs['round'], 1 << (k - 1), 0)
+    shift = configs['kind'] == 'shift'
+    out = np.empty(X.shape, np.int64)
+    peak_mac = np.abs(Y).reshape(-1, len(a)).max(axis=0)
+    peak_diff = peak_mac.copy()
+    for i in range(len(X)):
+        # a*y + b*x + r equals (y << s) + (x - y) + r for the shift kind: same result, narrower registers
+        mac = a * Y + b * X[i] + r
+        diff = X[i] - Y + r
+        Y = mac >> k
+        out[i] = Y
+        peak_mac = np.maximum(peak_mac, np.abs(mac).reshape(-1, len(a)).max(axis=0))
+        peak_diff = np.maximum(peak_diff, np.abs(diff).reshape(-1, len(a)).max(axis=0))
+    return out, np.where(shift, _bits(np.maximum(peak_diff, np.abs(out).reshape(-1, len(a)).max(axis=0))),
+                         _bits(peak_mac))
+
+
+def to_units(Y, configs):
+    return Y / 2.0 ** (configs['frac_bits'] + configs['guard_bits'])
+
+
+def simulate_float32(x, alphas):
+    """
+    filter() in IEEE single precision for every alpha, started on the first reading.
+
+    Returns:
+        (n, alphas) float64 array of the float32 outputs
+    """
+    x = np.asarray(x, np.float32)
+    alpha = np.asarray(alphas, np.float32)
+    beta = np.float32(1) - alpha
+    y = np.repeat(x[0], len(alpha))
+    out = np.empty((len(x), len(alpha)))
+    for i in range(len(x)):
+        y = alpha * y + beta * x[i]
+        out[i] = y
+    return out
+
+
+def reference(x, alphas):
+    """
+    filter() in float64 for every alpha, started on the first reading.
+    """
+    x = np.asarray(x, float)
+    return np.column_stack([lfilter([1 - alpha], [1, -alpha], x, zi=[alpha * x[0]])[0] for alpha in alphas])
+
+
+def unfilter(y, alpha=ALPHA):
+    """
+    Readings that produced a logged filter() output.
+    """
+    y = np.asarray(y, float)
+    return np.concatenate(([y[0]], (y[1:] - alpha * y[:-1]) / (1 - alpha)))
+
+
+def steady_state(configs, level=20.0, n_levels=32, settle=2000, window=256):
+    """
+    Constant-input test: every configuration starts 32 input LSBs below and
+    above a constant input (n_levels inputs spread over 4 LSBs around level).
+
+    Returns:
+        (dead band: largest |output - input| once settled, limit cycle: largest
+        peak to peak of the output over the last `window` steps), in channel units
+    """
+    lsb = 2.0 ** -configs['frac_bits']
+    c = level + np.arange(n_levels)[:, None] / n_levels * 4 * lsb
+    X = np.round(c / lsb).astype(np.int64) << configs['guard_bits']
+    X = np.broadcast_to(X, (2, n_levels, len(lsb)))
+    start = X + (np.array([-32, 32])[:, None, None] << configs['guard_bits'])
+    Y, _ = simulate_integer(np.broadcast_to(X, (settle + window,) + X.shape), start, configs)
+    y, x = to_units(Y[-window:], configs), to_units(X, configs)
+    dead_band = np.abs(y[-1] - x).max(axis=(0, 1))
+    limit_cycle = (y.max(axis=0) - y.min(axis=0)).max(axis=(0, 1))
+    return dead_band, limit_cycle
+
+
+def analyze(traces, configs, tolerance=TOLERANCE):
+    """
+    Error against float64 of every configuration on a list of reading traces.
+
+    Returns:
+        list of dicts (one per configuration, float32 ones first) with 'name',
+        'alpha', 'rms', 'max' (against float64 at the nominal alpha), 'rms_firmware'
+        (against float64 at ALPHA), 'dead_band', 'limit_cycle', 'bits'
+    """
+    alphas = sorted(set(configs['nominal']) | {ALPHA})
+    sq32, sq, peak32, peak = 0, 0, 0, 0
+    sq_fw32, sq_fw, bits, n = 0, 0, 0, 0
+    for x in traces:
+        ref = reference(x, alphas)
+        column = {alpha: i for i, alpha in enumerate(alphas)}
+        y32 = simulate_float32(x, alphas)
+        Y, b = simulate_integer(quantize_input(x, configs), quantize_input(x[:1], configs)[0], configs)
+        y = to_units(Y, configs)
+        err32 = y32 - ref
+        err = y - ref[:, [column[alpha] for alpha in configs['nominal']]]
+        fw = ref[:, [column[ALPHA]]]
+        sq32, peak32 = sq32 + (err32 ** 2).sum(axis=0), np.maximum(peak32, np.abs(err32).max(axis=0))
+        sq, peak = sq + (err ** 2).sum(axis=0), np.maximum(peak, np.abs(err).max(axis=0))
+        sq_fw32, sq_fw = sq_fw32 + ((y32 - fw) ** 2).sum(axis=0), sq_fw + ((y - fw) ** 2).sum(axis=0)
+        bits, n = np.maximum(bits, b), n + len(x)
+    dead_band, limit_cycle = steady_state(configs, level=float(np.median(np.concatenate(traces))))
+
+    rows = [{'name': 'float32', 'alpha': alpha, 'rms': np.sqrt(sq32[i] / n), 'max': peak32[i],
+             'rms_firmware': np.sqrt(sq_fw32[i] / n), 'dead_band': 0.0, 'limit_cycle': 0.0, 'bits': 32}
+            for i, alpha in enumerate(alphas)]
+    rows += [{'name': describe(configs, i), 'alpha': configs['alpha'][i], 'nominal': configs['nominal'][i],
+              'rms': np.sqrt(sq[i] / n), 'max': peak[i], 'rms_firmware': np.sqrt(sq_fw[i] / n), 'dead_band': dead_band[i],
+              'limit_cycle': limit_cycle[i], 'bits': int(bits[i]), 'kind': configs['kind'][i], 'index': i}
+             for i in range(len(configs['a']))]
+    for row in rows:
+        row['ok'] = row['max'] <= tolerance and row['dead_band'] <= tolerance and row['limit_cycle'] <= tolerance
+    return rows
+
+
+def print_rows(rows, limit):
+    print(f"{'implementation':<58}{'alpha':>8}{'rms':>10}{'max':>10}{'dead band':>11}{'cycle':>9}"
+          f"{'bits':>6}{'rms vs fw':>11}")
+    for row in rows[:limit]:
+        print(f"{row['name']:<58}{row['alpha']:>8.4f}{row['rms']:>10.2e}{row['max']:>10.2e}"
+              f"{row['dead_band']:>11.2e}{row['limit_cycle']:>9.2e}{row['bits']:>6}{row['rms_firmware']:>11.2e}")
+
+
+def main():
+    from loader import load, to_arrays
+
+    parser = argparse.ArgumentParser(description="Fixed-point versions of the firmware's filter() on logged traces")
+    parser.add_argument('csv', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'],
+                        help="Files, directories or glob patterns")
+    parser.add_argument('--channels', nargs='*', default=list(CHANNELS))
+    parser.add_argument('--logged', action='store_true', help="Filter the logged values instead of the readings")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="Largest error, dead band and limit cycle accepted [channel units]")
+    parser.add_argument('--top', type=int, default=12, help="Rows printed per channel")
+    parser.add_argument('--plot', action='store_true')
+    args = parser.parse_args()
+
+    devices = to_arrays(load(args.csv, args.channels))
+    configs = integer_grid()
+    print(f"{len(configs['a'])} integer and {len(set(configs['nominal']) | {ALPHA})} float32 configurations, "
+          f"{sum(len(t) for t, _ in devices.values())} samples of {len(devices)} devices")
+    best = {}
+    for j, channel in enumerate(args.channels):
+        traces = [values[:, j] if args.logged else unfilter(values[:, j]) for _, values in devices.values()]
+        rows = analyze(traces, configs, args.tolerance)
+        integer = [row for row in rows if 'kind' in row]
+        float32 = next(row for row in rows if row['name'] == 'float32' and row['alpha'] == ALPHA)
+        print(f"\n{channel}: float32 at alpha={ALPHA}: rms {float32['rms']:.2e}, max {float32['max']:.2e}")
+        print("Closest to float64 at the same alpha:")
+        print_rows(sorted(integer, key=lambda row: row['rms']), args.top)
+        # Within the tolerance, with the narrowest registers
+        candidates = sorted((row for row in integer if row['ok']),
+                            key=lambda row: (row['bits'], abs(row['alpha'] - ALPHA), row['rms']))
+        print(f"Cheapest within {args.tolerance:g} ({len(candidates)} of {len(integer)}):")
+        print_rows(candidates, args.top)
+        shift = [row for row in candidates if row['kind'] == 'shift']
+        same = [row for row in candidates if row['kind'] == 'q' and row['nominal'] == ALPHA]
+        for label, found in (("Without multiply", shift), (f"Same response (alpha {ALPHA})", same)):
+            if found:
+                row = found[0]
+                print(f"{label}: {row['name']}, {row['bits']} bit registers, max error {row['max']:.2e}, "
+                      f"rms {row['rms_firmware']:.2e} from the float filter at alpha={ALPHA}")
+            else:
+                print(f"{label}: nothing within {args.tolerance:g}")
+        if shift:
+            best[channel] = shift[0]
+
+    if args.plot and best:
+        import matplotlib.pyplot as plt
+        fig, axs = plt.subplots(len(best), 1, figsize=(12, 3 * len(best)), squeeze=False)
+        x_all = next(iter(devices.values()))[1]
+        for ax, (channel, row) in zip(axs[:, 0], best.items()):
+            x = x_all[:, args.channels.index(channel)]
+            x = x if args.logged else unfilter(x)
+            single = {name: values[row['index']:row['index'] + 1] for name, values in configs.items()}
+            Y, _ = simulate_integer(quantize_input(x, single), quantize_input(x[:1], single)[0], single)
+            ax.plot(x, '.', markersize=2, alpha=0.4, label='readings')
+            ax.plot(reference(x, [ALPHA])[:, 0], label=f'float64, alpha={ALPHA}')
+            ax.plot(to_units(Y, single)[:, 0], label=row['name'])
+            ax.set_ylabel(channel)
+            ax.legend()
+            ax.grid(True)
+        plt.tight_layout()
+        plt.show()
+
+
+if __name__ == "__main__":
+    main()
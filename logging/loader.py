@@ -0,0 +1,212 @@
+"""
+Parallel loader for the logger CSVs of a whole fleet.
+
+Files are selected by glob, directory or list, parsed on a process pool with
+fixed dtypes and the ISO 8601 timestamps of main.py, tagged with their
+device, and concatenated into one frame sorted by timestamp and device with
+exact duplicate rows (a file or WAL segment read twice) removed. Distinct
+samples sharing a timestamp are all kept, in file order. Files need not have
+the same columns (a raw ADC capture next to the logger CSVs): the frame has
+all of them, NaN where a file lacks one.
+
+Column projection and time filters are applied while reading: only the
+requested columns are parsed, and a file whose first and last timestamps
+fall outside [start, end) is skipped without being parsed.
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'   # strftime of the first captures (synthetic fleets too)
+PARSE_FORMAT = 'ISO8601'                 # Also reads the millisecond timestamps of the WAL compaction
+DTYPES = {'tempExt': 'float64', 'tempInt': 'float64', 'battVolt': 'float64', 'data': 'float64'}
+PARALLEL_MIN_FILES = 8                    # Below this, parsing in-process is faster than spawning workers
+
+
+def find_files(source, pattern='*.csv'):
+    """
+    CSV files of a glob pattern, a directory (searched recursively) or a list of either, sorted.
+    """
+    if isinstance(source, (list, tuple)):
+        return sorted({path for item in source for path in find_files(item, pattern)})
+    source = str(source)
+    if os.path.isdir(source):
+        return sorted(str(path) for path in Path(source).rglob(pattern))
+    return sorted(glob.glob(source, recursive=True))
+
+
+def device_name(path, device='auto'):
+    """
+    Device tag of a file: 'stem' (file name), 'parent' (directory name), or
+    'auto': the directory name for day files such as <device>/2025-03-03.csv,
+    else the file name.
+    """
+    path = Path(path)
+    if callable(device):
+        return device(path)
+    if device == 'auto':
+        device = 'parent' if path.stem[:1].isdigit() else 'stem'
+    return path.parent.name if device == 'parent' else path.stem
+
+
+def time_bounds(path):
+    """
+    First and last timestamp of a file, read from its second and last lines only.
+    """
+    with open(path, 'rb') as f:
+        f.readline()
+        first = f.readline()
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 256))
+        last = f.read().rstrip(b'\r\n').rsplit(b'\n', 1)[-1]
+    if not first:
+        return None
+    parse = lambda line: pd.to_datetime(line.split(b',', 1)[0].decode(), format=PARSE_FORMAT)
+    try:
+        return parse(first), parse(last)
+    except ValueError:
+        return None
+
+
+def read_file(path, columns=None, start=None, end=None):
+    """
+    Parse one CSV with fixed dtypes and timestamp format.
+
+    Returns:
+        (timestamps datetime64[ns] array, {column: float array} of the columns
+        the file has), or None when nothing is in [start, end)
+    """
+    if start is not None or end is not None:
+        bounds = time_bounds(path)
+        if bounds is not None and ((end is not None and bounds[0] >= end) or
+                                   (start is not None and bounds[1] < start)):
+            return None
+    usecols = None if columns is None else lambda name: name == 'timestamp' or name in columns
+    frame = pd.read_csv(path, usecols=usecols, dtype=DTYPES, engine='c')
+    timestamps = pd.to_datetime(frame.pop('timestamp'), format=PARSE_FORMAT).to_numpy().astype('datetime64[ns]')
+    keep = np.ones(len(timestamps), bool)
+    if start is not None:
+        keep &= timestamps >= start.to_datetime64()
+    if end is not None:
+        keep &= timestamps < end.to_datetime64()
+    if not keep.any():
+        return None
+    # Plain arrays travel between processes much faster than a DataFrame
+    return timestamps[keep], {name: frame[name].to_numpy()[keep] for name in frame.columns}
+
+
+def _read_file(args):
+    return read_file(*args)
+
+
+def load(source, columns=None, start=None, end=None, device='auto', workers=None):
+    """
+    Load every CSV of source into one frame.
+
+    Args:
+        source: Glob pattern, directory, file, or a list of them
+        columns: Channels to read (all those of any file when None)
+        start, end: Keep rows with start <= timestamp < end (anything pd.Timestamp accepts)
+        device: How files are tagged, see device_name()
+        workers: Worker processes (os.cpu_count() by default, 1 to parse in-process)
+
+    Returns:
+        DataFrame (device (categorical), timestamp, columns...) sorted by
+        timestamp then device, without exact duplicate rows; NaN for the
+        columns a file does not have
+    """
+    files = find_files(source)
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    tasks = [(path, columns, start, end) for path in files]
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(files) >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_read_file, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    else:
+        parts = [_read_file(task) for task in tasks]
+
+    devices = sorted({device_name(path, device) for path in files})
+    names = [device_name(path, device) for path, part in zip(files, parts) if part is not None]
+    parts = [part for part in parts if part is not None]
+    channels = columns or list(dict.fromkeys(name for _, values in parts for name in values))
+    if not parts:
+        return pd.DataFrame(columns=['device', 'timestamp', *channels])
+    codes = np.concatenate([np.full(len(t), devices.index(name), np.int32) for name, (t, _) in zip(names, parts)])
+    timestamps = np.concatenate([t for t, _ in parts])
+    # Sort by timestamp then device (lexsort is stable: rows sharing both stay in file order)
+    order = np.lexsort((codes, timestamps))
+    frame = pd.DataFrame({
+        'device': pd.Categorical.from_codes(codes[order], devices),
+        'timestamp': timestamps[order],
+    })
+    for name in channels:
+        frame[name] = np.concatenate([values.get(name, np.full(len(t), np.nan)) for t, values in parts])[order]
+    # Only rows equal in every column are the same sample read twice
+    return frame[~frame.duplicated(keep='last')].reset_index(drop=True)
+
+
+def to_arrays(frame):
+    """
+    Split a loaded frame per device.
+
+    Returns:
+        dict device -> (timestamps datetime64[ns] array, values (n, channels) float array)
+    """
+    channels = [c for c in frame.columns if c not in ('device', 'timestamp')]
+    return {device: (group['timestamp'].to_numpy(), group[channels].to_numpy(dtype=float))
+            for device, group in frame.groupby('device', observed=True, sort=True)}
+
+
+def write_synthetic_fleet(directory, devices, days, period_s=6):
+    """
+    Day files <directory>/<device>/<date>.csv in the format of main.py.
+    """
+    rng = np.random.default_rng(0)
+    n = int(86400 / period_s)
+    for d in range(devices):
+        os.makedirs(os.path.join(directory, f"device{d:03d}"), exist_ok=True)
+        for day in range(days):
+            t0 = np.datetime64('2025-03-01') + np.timedelta64(day, 'D')
+            timestamps = t0 + np.arange(n) * np.timedelta64(period_s, 's')
+            values = rng.normal((10, 20, 3.3), (3, 1, 0.01), (n, 3))
+            frame = pd.DataFrame(values, columns=['tempExt', 'tempInt', 'battVolt'])
+            frame.insert(0, 'timestamp', pd.to_datetime(timestamps).strftime(TIMESTAMP_FORMAT))
+            frame.to_csv(os.path.join(directory, f"device{d:03d}", f"{t0}.csv"), index=False, float_format='%.8f')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load logger CSVs of several devices")
+    parser.add_argument('source', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'],
+                        help="Files, directories or glob patterns")
+    parser.add_argument('--columns', nargs='*')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--synthetic', nargs=2, type=int, metavar=('DEVICES', 'DAYS'),
+                        help="Benchmark on a generated fleet of day files instead")
+    args = parser.parse_args()
+
+    source = args.source
+    if args.synthetic:
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        write_synthetic_fleet(tmp.name, *args.synthetic)
+        source = tmp.name
+    t0 = time.perf_counter()
+    frame = load(source, args.columns, args.start, args.end, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+    print(frame)
+    print(f"{len(find_files(source))} files, {frame['device'].nunique()} devices, {len(frame)} rows "
+          f"in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,46 @@
 import serial
-import csv
-from datetime import datetime, timedelta
+from collections import deque
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import matplotlib.dates as mdates
 import numpy as np
 
+from broker import RingReader
+from clock_align import LATENCY_WINDOW, HostClock, burst_stamps
+from decimation import IncrementalEnvelope
+from sample_history import SampleHistory
+from telemetry_frame import FrameReader, samples
+from wal import Compactor, CsvSink, WalWriter
+
 # Configuration
 SERIAL_PORT = '/dev/ttyUSB1'  # Replace with your serial port
 BAUD_RATE = 74880              # Match this to your Arduino's baud rate
 CSV_FILE = 'arduino_data2.csv' # Output CSV file
-MAX_POINTS = 1000              # Maximum number of points to display
+DISPLAY_POINTS = 2000          # Maximum number of points handed to Matplotlib per line
+BINARY_TELEMETRY = False       # Decode binary frames (telemetry_mode & TELEMETRY_BINARY in main.ino)
+WAL_DIR = 'wal'                # Samples are made durable here, then compacted into CSV_FILE
+BROKER_RING = None             # Read this broker.py ring (e.g. 'sigtemp-ttyUSB2') instead of owning SERIAL_PORT
+
+# Serial connection and write-ahead log, opened by main() (soak.py substitutes its own)
+ser = None
+wal = None
+ring = None
+
+# Exceptions caught by update_plot
+error_count = 0
+
+# Receive clock (monotonic, anchored to the wall clock) and read-to-redraw latency of the last reads
+clock = HostClock()
+pipeline_latency_ns = deque(maxlen=LATENCY_WINDOW)
+
+# Binary frame decoder (keeps partial frames between reads)
+frame_reader = FrameReader()
 
-# Initialize serial connection
-ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+# Full capture history (Matplotlib date numbers and the three channels)
+history = SampleHistory(3)
 
-# Initialize data containers - defined globally
-timestamps = []
-data_values = []
+# Per-pixel min/max envelope of the history, updated with the new samples only
+envelope = IncrementalEnvelope(DISPLAY_POINTS // 4)
 
 # Create figure and subplots
 fig, axs = plt.subplots(2, 2, figsize=(12, 8))
@@ -57,91 +80,136 @@ for ax in axs.flat:
         # fig.autofmt_xdate()  # Rotate and align x-axis labels
         plt.setp(ax.xaxis.get_majorticklabels(), rotation=30, ha='right')
 
+# Read the samples that arrived since the last call, as
+# (receive time, wall-clock ns of the serial read per row, (tempExt, tempInt, battVolt) rows)
+def read_samples():
+    if ring is not None:
+        # Samples the broker captured since the last call, stamped at its own serial read
+        batch = ring.read()
+        return clock.monotonic_ns(), batch['t'], batch['values']
+
+    if BINARY_TELEMETRY:
+        # Every complete frame of the bytes waiting, decoded at once
+        data = ser.read(ser.in_waiting or 1)
+        received = clock.monotonic_ns()
+        rows = samples(frame_reader.feed(data))
+        return received, burst_stamps(clock.to_wall_ns(received), len(rows)), rows
+
+    # Read data from the serial port
+    line_data = ser.readline()
+    received = clock.monotonic_ns()
+    line_data = line_data.decode('utf-8').strip()
+
+    if line_data and line_data[0].isdigit():  # Allow negative numbers
+        data = line_data.split(', ')
+
+        # Convert data to float
+        tempExt = float(data[0])
+        tempInt = float(data[1])
+        battVolt = float(data[2])
+        return received, clock.to_wall_ns(received), [(tempExt, tempInt, battVolt)]
+    return received, None, []
+
 # Function to update the plot
 def update_plot(frame):
-    global timestamps, data_values  # Use global variables
+    global error_count
+    received, rows = None, []
 
     try:
-        # Read data from the serial port
-        line_data = ser.readline()
-        line_data = line_data.decode('utf-8').strip()
-
-        if line_data and line_data[0].isdigit():  # Allow negative numbers
-            # Get the current timestamp
-            current_time = datetime.now()
-            timestamp_str = current_time.strftime('%Y-%m-%d %H:%M:%S')
-
-            data = line_data.split(', ')
+        received, stamps, rows = read_samples()
 
-            # Convert data to float
-            tempExt = float(data[0])
-            tempInt = float(data[1])
-            battVolt = float(data[2])
+        if len(rows):
+            # Timestamps of the read itself (wall-clock ns, one per row), not of the redraw
+            stamps = np.broadcast_to(np.asarray(stamps, np.int64), (len(rows),))
 
-            # Log data to CSV
-            with open(CSV_FILE, mode='a', newline='') as file:
-                csv_writer = csv.writer(file)
-                if file.tell() == 0:  # Write header if file is empty
-                    csv_writer.writerow(['timestamp', 'tempExt', 'tempInt', 'battVolt'])
-                csv_writer.writerow([timestamp_str, tempExt, tempInt, battVolt])
+            # Log data to the WAL (committed to disk within a second; broker.py --csv does it for a ring)
+            if wal is not None:
+                for stamp, row in zip(stamps.tolist(), rows):
+                    wal.append(stamp, row)
 
             # Update data containers
-            timestamps.append(current_time)
-            data_values.append((tempExt, tempInt, battVolt))
-
-            # Keep only the most recent data points
-            if len(timestamps) > MAX_POINTS:
-                timestamps = timestamps[-MAX_POINTS:]
-                data_values = data_values[-MAX_POINTS:]
-
-            dtv = np.array(data_values)
-            # Update the plot data
-            line_ext.set_xdata(timestamps)
-            line_ext.set_ydata(dtv[:,0])
-            line_int.set_xdata(timestamps)
-            line_int.set_ydata(dtv[:,1])
-            line_batt.set_xdata(timestamps)
-            line_batt.set_ydata(dtv[:,2])
+            history.extend(mdates.date2num(stamps.astype('datetime64[ns]')), np.asarray(rows))
+            timestamps = history.timestamps
+
+            # Hand Matplotlib a per-pixel min/max envelope of the full history
+            kept = envelope.update(timestamps, history.values)
+            for line, ax, idx in zip((line_ext, line_int, line_batt), [axs[0, 0], axs[0, 1], axs[1, 0]], [0, 1, 2]):
+                keep = kept[idx]
+                shown = history.values[keep, idx]
+                line.set_data(timestamps[keep], shown)
+
+                # Dynamically adjust y-axis to fit the actual data values
+                # (the envelope keeps every extremum, so its bounds are the data's)
+                data_min = shown.min()
+                data_max = shown.max()
+                buffer = (data_max - data_min) * 0.1 if data_max > data_min else 0.1
+                ax.set_ylim(data_min - buffer, data_max + buffer)
 
             # Adjust x-axis limits to show the time window
             if len(timestamps) > 1:
-                time_range = (timestamps[-1] - timestamps[0]).total_seconds()
+                time_range = (timestamps[-1] - timestamps[0]) * 86400
                 buffer = max(time_range * 0.05, 1)  # 5% buffer or at least 1 second
                 for ax in axs.flat:
                     if ax != axs[1, 1]:  # Skip the empty subplot
                         ax.set_xlim(
                             timestamps[0],
-                            timestamps[-1] + timedelta(seconds=buffer)
+                            timestamps[-1] + buffer / 86400
                         )
 
-            # Dynamically adjust y-axis to fit the actual data values
-            if data_values:
-                for ax, idx in zip([axs[0, 0], axs[0, 1], axs[1, 0]], [0, 1, 2]):
-                    data_min = dtv[:, idx].min()
-                    data_max = dtv[:, idx].max()
-                    buffer = (data_max - data_min) * 0.1 if data_max > data_min else 0.1
-                    ax.set_ylim(data_min - buffer, data_max + buffer)
-
     except Exception as e:
+        error_count += 1
         print(f"Error: {e}")
 
     # Redraw the canvas
     fig.canvas.draw()
+    if len(rows):
+        pipeline_latency_ns.append(clock.monotonic_ns() - received)
 
     return line_ext, line_int, line_batt
 
-# Set up animation
-ani = animation.FuncAnimation(
-    fig, 
-    update_plot,
-    interval=100,  # Update every 100ms
-    blit=False  # Set to False to force redraw of the entire canvas
-)
-
-# Show the plot
-plt.tight_layout(pad=2.0)  # Increase padding to make room for rotated labels
-plt.show()
-
-# Close the serial connection when the plot window is closed
-print("Closing serial connection...")
-ser.close()
+def main():
+    global ser, wal, ring
+
+    if BROKER_RING:
+        # broker.py owns the port (and its --csv consumer writes the CSV)
+        ring = RingReader(BROKER_RING)
+    else:
+        # Initialize serial connection
+        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+
+        # Write-ahead log, rolled into the CSV by a background thread every minute
+        wal = WalWriter(WAL_DIR, ['tempExt', 'tempInt', 'battVolt'])
+        compactor = Compactor(wal, CsvSink(CSV_FILE))
+        compactor.start()
+
+    # Set up animation
+    ani = animation.FuncAnimation(
+        fig, 
+        update_plot,
+        interval=100,  # Update every 100ms
+        blit=False  # Set to False to force redraw of the entire canvas
+    )
+
+    # Show the plot
+    plt.tight_layout(pad=2.0)  # Increase padding to make room for rotated labels
+    plt.show()
+
+    if pipeline_latency_ns:
+        p50, p99 = np.percentile(pipeline_latency_ns, [50, 99]) / 1e6
+        print(f"Read to redraw latency: p50 {p50:.0f} ms, p99 {p99:.0f} ms")
+
+    if ring is not None:
+        ring.close()
+        return
+
+    # Close the serial connection when the plot window is closed
+    print("Closing serial connection...")
+    ser.close()
+
+    # Move what is left in the WAL to the CSV
+    compactor.stop()
+    wal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Batch reports of a fleet of loggers: one PNG per device and period (a week
+by default), rendered headless with the Agg backend on a process pool.
+
+Each report shows the three channels raw and zero-phase filtered (as in
+filter_synthesis.py), the battery trend (least-squares slope over the
+period) and the calibration residual of tempInt: the firmware's Th()
+polynomial against the Beta model it was fitted to, at the temperatures
+the device saw.
+
+Every worker builds the figure once (a template whose lines, texts and
+limits are updated for each report) instead of one figure per report, and
+every plotted series is reduced to a min/max envelope of the figure width.
+
+A manifest in the output directory records the signature of the inputs of
+every report (paths, sizes and modification times of the CSVs overlapping
+the period, and the report settings); reports whose signature did not
+change are not rendered again. index.csv summarizes every report.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from decimation import minmax_envelope
+from loader import device_name, find_files, read_file, time_bounds
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'test_CTN'))
+from sensor_models import KELVIN, beta_temperature, firmware_temperature  # noqa: E402
+
+REPORT_VERSION = 1             # Bump when the figure changes, to render every report again
+CHANNELS = ('tempExt', 'tempInt', 'battVolt')
+PERIOD = 'W'                   # pandas period frequency of the reports (weeks ending on Sunday)
+FILTER = (1, 0.05)             # Butterworth order and normalized cutoff, as filter_synthesis.py
+FIGSIZE = (12, 8)
+DPI = 100
+PIXELS = FIGSIZE[0] * DPI // 2  # Width of one panel
+MANIFEST = 'manifest.json'
+GAP = np.timedelta64(60, 's')  # Longer pauses split the series: filtered separately, not joined on the plot
+
+_template = None
+
+
+def calibration_residual(temp_int_degc):
+    """
+    Th() minus the Beta model [°C], at the divider ratios that gave these
+    firmware temperatures.
+    """
+    H = np.linspace(0.01, 0.99, 4096)
+    T = firmware_temperature(H) - KELVIN               # Decreasing in H
+    h = np.interp(temp_int_degc, T[::-1], H[::-1])
+    return temp_int_degc - (beta_temperature(h) - KELVIN)
+
+
+def plan(source, period=PERIOD, device='auto', settings=None):
+    """
+    Reports to produce and the signature of their inputs.
+
+    Returns:
+        dict (device, period name) -> {'files': [...], 'start', 'end', 'signature'}
+    """
+    settings = json.dumps({'version': REPORT_VERSION, 'period': period, 'filter': FILTER, **(settings or {})},
+                          sort_keys=True)
+    reports = {}
+    for path in find_files(source):
+        bounds = time_bounds(path)
+        if bounds is None:
+            continue
+        stat = os.stat(path)
+        for p in pd.period_range(bounds[0], bounds[1], freq=period):
+            report = reports.setdefault((device_name(path, device), str(p)), {
+                'files': [], 'inputs': [], 'start': p.start_time, 'end': p.end_time + pd.Timedelta(1, 'ns')})
+            report['files'].append(path)
+            report['inputs'].append((path, stat.st_size, stat.st_mtime_ns))
+    for report in reports.values():
+        digest = hashlib.sha256(settings.encode())
+        for item in sorted(report.pop('inputs')):
+            digest.update(repr(item).encode())
+        report['signature'] = digest.hexdigest()
+    return reports
+
+
+def _build_template():
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    fig, axs = plt.subplots(2, 2, figsize=FIGSIZE, dpi=DPI)
+    template = {'fig': fig, 'axes': {}, 'raw': {}, 'filtered': {}}
+    for ax, channel in zip(axs.flat, CHANNELS):
+        template['axes'][channel] = ax
+        template['raw'][channel], = ax.plot([], [], '-', color='0.7', linewidth=0.6, label='raw')
+        template['filtered'][channel], = ax.plot([], [], '-', linewidth=1.2, label='filtered')
+        ax.set_ylabel(channel)
+        ax.grid(True)
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    template['trend'], = template['axes']['battVolt'].plot([], [], '--', color='k', linewidth=1, label='trend')
+    template['axes']['battVolt'].legend(loc='upper right')
+    ax = axs[1, 1]
+    template['residual'], = ax.plot([], [], '.', markersize=2)
+    ax.set_xlabel('tempInt [°C]')
+    ax.set_ylabel('Th() - Beta model [°C]')
+    ax.grid(True)
+    template['residual_ax'] = ax
+    template['title'] = fig.suptitle('')
+    fig.tight_layout(rect=(0, 0, 1, 0.96))
+    return template
+
+
+def _set_series(line, x, y):
+    keep = minmax_envelope(x, y, PIXELS)
+    line.set_data(x[keep], y[keep])
+
+
+def render(device, period, files, start, end, path, columns=CHANNELS):
+    """
+    Read the samples of a device over [start, end) and render its report into path.
+
+    Returns:
+        Summary dict of the report (None when the period holds no sample)
+    """
+    global _template
+    from scipy.signal import butter
+
+    from chunked_filtfilt import default_padlen, filtfilt_chunked
+
+    parts = [part for part in (read_file(f, list(columns), start, end) for f in files) if part is not None]
+    if not parts:
+        return None
+    t = np.concatenate([ts for ts, _ in parts])
+    values = np.column_stack([np.concatenate([v[c] for _, v in parts]) for c in columns])
+    order = np.argsort(t, kind='stable')
+    t, values = t[order], values[order]
+
+    b, a = butter(*FILTER)
+    gaps = np.flatnonzero(np.diff(t) > GAP) + 1
+    filtered = values.copy()
+    for lo, hi in zip(np.r_[0, gaps], np.r_[gaps, len(t)]):
+        if hi - lo > default_padlen(b, a):
+            filtered[lo:hi] = filtfilt_chunked(values[lo:hi], b, a)
+    days = (t - t[0]) / np.timedelta64(1, 'D')
+    slope, intercept = np.polyfit(days, values[:, 2], 1) if len(t) > 1 else (0.0, values[0, 2])
+    residual = calibration_residual(values[:, 1])
+
+    if _template is None:
+        _template = _build_template()
+    import matplotlib.dates as mdates
+
+    # A NaN row right after every gap breaks the lines there
+    x = mdates.date2num(np.insert(t, gaps, t[gaps - 1] + GAP // 2))
+    shown = np.insert(values, gaps, np.nan, axis=0), np.insert(filtered, gaps, np.nan, axis=0)
+    for i, channel in enumerate(columns):
+        _set_series(_template['raw'][channel], x, shown[0][:, i])
+        _set_series(_template['filtered'][channel], x, shown[1][:, i])
+        ax = _template['axes'][channel]
+        ax.set_xlim(mdates.date2num(start), mdates.date2num(end))
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+    _template['trend'].set_data(mdates.date2num(t[[0, -1]]), intercept + slope * days[[0, -1]])
+    order = np.argsort(values[:, 1])
+    _set_series(_template['residual'], values[order, 1], residual[order])
+    _template['residual_ax'].relim()
+    _template['residual_ax'].autoscale_view()
+    _template['title'].set_text(f"{device} — {period} — {len(t)} samples, battery {slope * 1e3:+.1f} mV/day")
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    _template['fig'].savefig(path)
+    return {
+        'samples': len(t),
+        'first': str(t[0]),
+        'last': str(t[-1]),
+        'tempExt_min': values[:, 0].min(),
+        'tempExt_max': values[:, 0].max(),
+        'tempInt_min': values[:, 1].min(),
+        'tempInt_max': values[:, 1].max(),
+        'battVolt_start': intercept,
+        'battVolt_end': intercept + slope * days[-1],
+        'battVolt_mv_per_day': slope * 1e3,
+        'calibration_max_residual': np.abs(residual).max(),
+    }
+
+
+def _render_task(task):
+    key, report, path = task
+    return key, report['signature'], render(*key, report['files'], report['start'], report['end'], path)
+
+
+def report_path(out, device, period):
+    return Path(out) / device / f"{period.replace('/', '_')}.png"
+
+
+def generate(source, out, period=PERIOD, workers=None, force=False, device='auto'):
+    """
+    Render the reports whose inputs changed since the last run into out.
+
+    Returns:
+        (rendered, skipped) numbers of reports
+    """
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    manifest_path = out / MANIFEST
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    tasks = []
+    skipped = 0
+    for key, report in sorted(plan(source, period, device).items()):
+        path = report_path(out, *key)
+        entry = manifest.get('/'.join(key))
+        if not force and entry and entry['signature'] == report['signature'] and path.exists():
+            skipped += 1
+            continue
+        tasks.append((key, report, path))
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_render_task, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    else:
+        results = [_render_task(task) for task in tasks]
+
+    for (device_, period_), signature, summary in results:
+        if summary is not None:
+            manifest[f"{device_}/{period_}"] = {'signature': signature, 'device': device_, 'period': period_,
+                                                 'png': str(report_path(out, device_, period_).relative_to(out)),
+                                                 **summary}
+    tmp = manifest_path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent=1, default=float))
+    os.replace(tmp, manifest_path)
+    index = pd.DataFrame(list(manifest.values())).drop(columns='signature')
+    index.sort_values(['period', 'device']).to_csv(out / 'index.csv', index=False)
+    return len(tasks), skipped
+
+
+def main():
+    from loader import write_synthetic_fleet
+
+    parser = argparse.ArgumentParser(description="Render per-device, per-period reports of logged CSVs")
+    parser.add_argument('source', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'],
+                        help="Files, directories or glob patterns")
+    parser.add_argument('--out', default='reports')
+    parser.add_argument('--period', default=PERIOD, help="pandas frequency: D, W, M, ...")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--force', action='store_true', help="Render every report, changed or not")
+    parser.add_argument('--synthetic', nargs=2, type=int, metavar=('DEVICES', 'DAYS'),
+                        help="Benchmark on a generated fleet of day files instead")
+    args = parser.parse_args()
+
+    source = args.source
+    if args.synthetic:
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        write_synthetic_fleet(tmp.name, *args.synthetic)
+        source = tmp.name
+    t0 = time.perf_counter()
+    rendered, skipped = generate(source, args.out, args.period, args.workers, args.force)
+    print(f"{rendered} reports rendered, {skipped} unchanged, in {time.perf_counter() - t0:.1f} s -> {args.out}")
+    if args.synthetic:
+        t0 = time.perf_counter()
+        rendered, skipped = generate(source, args.out, args.period, args.workers)
+        print(f"Second run: {rendered} rendered, {skipped} unchanged, in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
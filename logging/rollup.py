@@ -0,0 +1,319 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Bucket widths of the pyramid, finest first
+LEVELS = {
+    '1min': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+CHANNELS = ('tempExt', 'tempInt', 'battVolt')
+
+NS_PER_S = 1_000_000_000
+
+
+def to_ns(timestamps):
+    """
+    Convert timestamps to int64 nanoseconds since the epoch.
+
+    Args:
+        timestamps: datetime64 array-like (numpy, pandas) or integers already in ns
+
+    Returns:
+        int64 numpy array
+    """
+    t = np.asarray(timestamps)
+    if t.dtype.kind == 'M':
+        return t.astype('datetime64[ns]').view(np.int64)
+    return t.astype(np.int64, copy=False)
+
+
+def aggregate(keys, values):
+    """
+    Reduce samples into buckets.
+
+    Args:
+        keys: int64 bucket index of every sample, sorted
+        values: float array of shape (n, channels), NaN for missing values
+
+    Returns:
+        (bucket keys, count, min, max, sum), per-channel arrays of shape (buckets, channels)
+    """
+    starts = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], starts))
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+    mn = np.fmin.reduceat(values, starts, axis=0)
+    mx = np.fmax.reduceat(values, starts, axis=0)
+    sm = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+    return keys[starts], count, mn, mx, sm
+
+
+class RollupLevel:
+    """
+    One resolution of the pyramid: sorted bucket keys with their aggregates,
+    stored in over-allocated arrays so that appending is amortized O(1).
+    """
+
+    FIELDS = ('count', 'min', 'max', 'sum')
+
+    def __init__(self, width_s, n_channels, capacity=1024):
+        self.width = width_s * NS_PER_S
+        self.n = 0
+        self.keys = np.empty(capacity, np.int64)
+        self.count = np.zeros((capacity, n_channels), np.int64)
+        self.min = np.empty((capacity, n_channels))
+        self.max = np.empty((capacity, n_channels))
+        self.sum = np.zeros((capacity, n_channels))
+
+    def _reserve(self, n):
+        capacity = len(self.keys)
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        self.keys = np.resize(self.keys, capacity)
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            new = np.empty((capacity, old.shape[1]), old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def _combine(self, idx, count, mn, mx, sm):
+        self.count[idx] += count
+        self.min[idx] = np.fmin(self.min[idx], mn)
+        self.max[idx] = np.fmax(self.max[idx], mx)
+        self.sum[idx] += sm
+
+    def _append(self, keys, count, mn, mx, sm):
+        n = len(keys)
+        self._reserve(self.n + n)
+        s = slice(self.n, self.n + n)
+        self.keys[s] = keys
+        self.count[s] = count
+        self.min[s] = mn
+        self.max[s] = mx
+        self.sum[s] = sm
+        self.n += n
+
+    def update(self, t_ns, values):
+        """
+        Fold a batch of samples (sorted by time) into this level.
+        """
+        keys, count, mn, mx, sm = aggregate(t_ns // self.width, values)
+        if self.n == 0 or keys[0] >= self.keys[self.n - 1]:
+            # Fast path: samples arrive in order, only the last bucket can be shared
+            if self.n and keys[0] == self.keys[self.n - 1]:
+                self._combine(self.n - 1, count[0], mn[0], mx[0], sm[0])
+                keys, count, mn, mx, sm = keys[1:], count[1:], mn[1:], mx[1:], sm[1:]
+            self._append(keys, count, mn, mx, sm)
+            return
+
+        # Late samples: merge into existing buckets, insert the missing ones
+        pos = np.searchsorted(self.keys[:self.n], keys)
+        clipped = np.minimum(pos, self.n - 1)
+        exists = self.keys[clipped] == keys
+        self._combine(clipped[exists], count[exists], mn[exists], mx[exists], sm[exists])
+        new = ~exists
+        if not new.any():
+            return
+        pos = pos[new]
+        self.keys = np.insert(self.keys[:self.n], pos, keys[new])
+        for name, data in zip(self.FIELDS, (count, mn, mx, sm)):
+            setattr(self, name, np.insert(getattr(self, name)[:self.n], pos, data[new], axis=0))
+        self.n = len(self.keys)
+
+    def slice(self, start_ns, end_ns):
+        keys = self.keys[:self.n]
+        lo = np.searchsorted(keys, start_ns // self.width)
+        hi = np.searchsorted(keys, -(-end_ns // self.width))
+        return slice(lo, hi)
+
+
+class RollupStore:
+    """
+    Incrementally maintained min/max/mean/count pyramid per device.
+
+    Samples are folded into every level of LEVELS as they are appended, so a
+    query never touches raw rows: it reads the coarsest level that still gives
+    at least one bucket per pixel over the requested range.
+    """
+
+    def __init__(self, channels=CHANNELS, levels=LEVELS):
+        self.channels = tuple(channels)
+        self.levels = dict(levels)
+        self.devices = {}
+        self.last_ns = {}                    # Latest sample time appended per device
+
+    def _device(self, device):
+        if device not in self.devices:
+            self.devices[device] = {
+                name: RollupLevel(width, len(self.channels))
+                for name, width in self.levels.items()
+            }
+        return self.devices[device]
+
+    def append(self, device, timestamps, values):
+        """
+        Add samples of a device to the store.
+
+        Args:
+            device: Device identifier
+            timestamps: Sample times (datetime64 or int64 ns), shape (n,)
+            values: Channel values, shape (n, channels) in the order of self.channels
+        """
+        t = to_ns(timestamps)
+        v = np.asarray(values, dtype=float).reshape(len(t), len(self.channels))
+        if len(t) == 0:
+            return
+        if np.any(t[1:] < t[:-1]):
+            order = np.argsort(t, kind='stable')
+            t, v = t[order], v[order]
+        for level in self._device(device).values():
+            level.update(t, v)
+        self.last_ns[device] = max(self.last_ns.get(device, t[-1]), t[-1])
+
+    def append_new(self, device, timestamps, values):
+        """
+        Add only the samples later than the last one of the device, so that
+        re-reading a growing CSV into a loaded store does not count rows twice.
+        """
+        t = to_ns(timestamps)
+        new = t > self.last_ns.get(device, np.iinfo(np.int64).min)
+        self.append(device, t[new], np.asarray(values, dtype=float).reshape(len(t), -1)[new])
+
+    def append_frame(self, device, frame, timestamp_column='timestamp'):
+        """
+        Add the rows of a pandas DataFrame holding a timestamp column and the store's channels.
+        """
+        self.append(device, frame[timestamp_column].to_numpy(), frame[list(self.channels)].to_numpy(dtype=float))
+
+    def pick_level(self, start, end, width_px):
+        """
+        Name of the coarsest level with at least one bucket per pixel over [start, end).
+        """
+        span_s = (int(to_ns(end)) - int(to_ns(start))) / NS_PER_S
+        best = min(self.levels, key=self.levels.get)
+        for name, width in sorted(self.levels.items(), key=lambda item: item[1]):
+            if width * width_px <= span_s:
+                best = name
+        return best
+
+    def query(self, device, start, end, width_px=1000, level=None):
+        """
+        Read the aggregates of a device over a time range.
+
+        Args:
+            device: Device identifier
+            start, end: Time range (datetime64 or int64 ns), end excluded
+            width_px: Horizontal resolution the result is meant for
+            level: Force a level name instead of picking it from width_px
+
+        Returns:
+            dict with 'level', 'timestamp' (bucket starts, datetime64[ns]),
+            'count', 'min', 'max' and 'mean' (arrays of shape (buckets, channels))
+        """
+        if level is None:
+            level = self.pick_level(start, end, width_px)
+        lvl = self.devices[device][level]
+        s = lvl.slice(int(to_ns(start)), int(to_ns(end)))
+        count = lvl.count[s]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = lvl.sum[s] / count
+        return {
+            'level': level,
+            'timestamp': (lvl.keys[s] * lvl.width).view('datetime64[ns]'),
+            'count': count,
+            'min': lvl.min[s],
+            'max': lvl.max[s],
+            'mean': mean,
+        }
+
+    def time_range(self, device):
+        """
+        First and last bucket start of a device at the finest level, as datetime64[ns].
+        """
+        lvl = self._device(device)[min(self.levels, key=self.levels.get)]
+        if lvl.n == 0:
+            raise ValueError(f"No data for device '{device}'")
+        ends = lvl.keys[[0, lvl.n - 1]] * lvl.width + [0, lvl.width]
+        return ends.view('datetime64[ns]')
+
+    def save(self, path):
+        """
+        Write the whole store to a .npz file.
+        """
+        arrays = {'channels': np.array(self.channels), 'level_names': np.array(list(self.levels)),
+                  'level_widths': np.array(list(self.levels.values())), 'devices': np.array(list(self.devices)),
+                  'last_ns': np.array([self.last_ns[device] for device in self.devices], np.int64)}
+        for i, levels in enumerate(self.devices.values()):
+            for name, lvl in levels.items():
+                arrays[f'{i}/{name}/keys'] = lvl.keys[:lvl.n]
+                for field in RollupLevel.FIELDS:
+                    arrays[f'{i}/{name}/{field}'] = getattr(lvl, field)[:lvl.n]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a store written by save().
+        """
+        with np.load(path) as f:
+            levels = dict(zip(f['level_names'].tolist(), f['level_widths'].tolist()))
+            store = cls(f['channels'].tolist(), levels)
+            for i, device in enumerate(f['devices'].tolist()):
+                for name, lvl in store._device(device).items():
+                    keys = f[f'{i}/{name}/keys']
+                    lvl._append(keys, *(f[f'{i}/{name}/{field}'] for field in RollupLevel.FIELDS))
+                if 'last_ns' in f:
+                    store.last_ns[device] = int(f['last_ns'][i])
+                else:
+                    # Stores saved without it: the end of the last finest bucket
+                    store.last_ns[device] = int(store.time_range(device)[1].view(np.int64)) - 1
+        return store
+
+
+def main():
+    import matplotlib.pyplot as plt
+
+    from loader import load, to_arrays
+
+    parser = argparse.ArgumentParser(description="Build a rollup store from logged CSVs and plot a device's full history")
+    parser.add_argument('csv', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'],
+                        help="Files, directories or glob patterns")
+    parser.add_argument('--store', help="Load/save the store from/to this .npz file (only newer rows are added)")
+    parser.add_argument('--width', type=int, default=1200, help="Plot width in pixels")
+    args = parser.parse_args()
+
+    if args.store and Path(args.store).exists():
+        store = RollupStore.load(args.store)
+    else:
+        store = RollupStore()
+    for device, (timestamps, values) in to_arrays(load(args.csv, list(store.channels))).items():
+        store.append_new(device, timestamps, values)
+    if args.store:
+        store.save(args.store)
+
+    for device in store.devices:
+        start, end = store.time_range(device)
+        t0 = time.perf_counter()
+        r = store.query(device, start, end, args.width)
+        print(f"{device}: {len(r['timestamp'])} buckets at {r['level']} in {(time.perf_counter()-t0)*1e3:.2f} ms")
+
+        fig, axs = plt.subplots(len(store.channels), 1, figsize=(12, 8), sharex=True)
+        for i, (ax, channel) in enumerate(zip(axs, store.channels)):
+            ax.fill_between(r['timestamp'], r['min'][:, i], r['max'][:, i], step='post', alpha=0.3, label='min/max')
+            ax.step(r['timestamp'], r['mean'][:, i], where='post', label='mean')
+            ax.set_ylabel(channel)
+            ax.grid(True)
+        axs[0].set_title(f"{device} ({r['level']})")
+        axs[0].legend()
+        fig.autofmt_xdate()
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class SampleHistory:
+    """
+    Growable in-memory capture history.
+
+    Timestamps and channel values live in over-allocated NumPy arrays (the
+    capacity doubles when full), so appending a sample is amortized O(1) and the
+    whole history is available as array views without rebuilding lists.
+    """
+
+    def __init__(self, n_channels, capacity=4096, time_dtype=float):
+        self.n = 0
+        self._t = np.empty(capacity, time_dtype)
+        self._values = np.empty((capacity, n_channels))
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, n):
+        capacity = len(self._t)
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        t = np.empty(capacity, self._t.dtype)
+        t[:self.n] = self._t[:self.n]
+        values = np.empty((capacity, self._values.shape[1]))
+        values[:self.n] = self._values[:self.n]
+        self._t, self._values = t, values
+
+    def append(self, t, values):
+        """
+        Add one sample.
+        """
+        self._reserve(self.n + 1)
+        self._t[self.n] = t
+        self._values[self.n] = values
+        self.n += 1
+
+    def extend(self, t, values):
+        """
+        Add a batch of samples, t of shape (n,) and values of shape (n, channels).
+        """
+        k = len(t)
+        self._reserve(self.n + k)
+        self._t[self.n:self.n + k] = t
+        self._values[self.n:self.n + k] = values
+        self.n += k
+
+    def drop(self, k):
+        """
+        Forget the k oldest samples; the storage shrinks to twice what is kept.
+        """
+        keep = self.n - k
+        capacity = max(16, 2 * keep)
+        t = np.empty(capacity, self._t.dtype)
+        t[:keep] = self._t[k:self.n]
+        values = np.empty((capacity, self._values.shape[1]))
+        values[:keep] = self._values[k:self.n]
+        self._t, self._values, self.n = t, values, keep
+
+    @property
+    def timestamps(self):
+        return self._t[:self.n]
+
+    @property
+    def values(self):
+        return self._values[:self.n]
@@ -0,0 +1,361 @@
+import argparse
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from scipy.signal import lfilter
+
+from uplink_payload import SEND_PERIOD, batt_to_code, code_to_batt, code_to_temp, temp_to_code
+
+WAKE_PERIOD_S = 6.0            # Measured spacing of the logged samples (8 s nominal watchdog)
+MAX_UPLINKS_PER_DAY = 140      # Sigfox subscription limit
+CHANNELS = ('tempExt', 'tempInt', 'battVolt')
+WEATHER_RHO = 1 - WAKE_PERIOD_S / (2 * 86400)
+
+
+@dataclass
+class Policy:
+    """
+    Uplink scheduling strategy, evaluated at every wake-up.
+
+    A sample is sent when any channel moved by more than its deadband since the
+    last uplink (but not sooner than min_interval wake-ups after it), or when
+    max_interval wake-ups went by (heartbeat). Below low_battery volts, the
+    intervals and the deadband are multiplied by backoff.
+    """
+    name: str
+    max_interval: int = SEND_PERIOD
+    min_interval: int = 1
+    deadband: tuple = (np.inf, np.inf, np.inf)
+    low_battery: float = 0.0
+    backoff: float = 1.0
+
+
+def rate_limited_interval(period_s=WAKE_PERIOD_S, per_day=MAX_UPLINKS_PER_DAY):
+    """
+    Smallest number of wake-ups between uplinks that respects the daily limit.
+    """
+    return int(np.ceil(86400 / per_day / period_s))
+
+
+DEFAULT_POLICIES = [
+    Policy('fixed-128'),
+    Policy('heartbeat-1h', max_interval=600),
+    Policy('deadband-0.25', max_interval=1800, min_interval=rate_limited_interval(),
+           deadband=(0.25, 0.25, 0.1)),
+    Policy('deadband-0.5', max_interval=1800, min_interval=rate_limited_interval(),
+           deadband=(0.5, 0.5, 0.2)),
+    Policy('deadband-0.25+backoff', max_interval=1800, min_interval=rate_limited_interval(),
+           deadband=(0.25, 0.25, 0.1), low_battery=3.0, backoff=4.0),
+]
+
+
+def quantize(traces):
+    """
+    Values the backend sees once they went through the payload coding.
+    """
+    out = np.empty_like(traces)
+    out[..., :2] = code_to_temp(temp_to_code(traces[..., :2]))
+    out[..., 2] = code_to_batt(batt_to_code(traces[..., 2]))
+    return out
+
+
+PIECE = 1 << 16                # Wake-ups (~4.5 days) of a trace replayed independently by replay()
+WINDOW = 32                    # Wake-ups scanned per uplink chain and step of replay()
+
+
+def replay(traces, policy):
+    """
+    Decide the uplinks of every device under a policy.
+
+    The next uplink only depends on where the last one was, so the traces are
+    cut in pieces of PIECE wake-ups, all followed together as if an uplink was
+    sent at their start. Then a second pass goes on from the last uplink of
+    every piece into the next ones, until it lands on an uplink of the first
+    pass: from there on, both agree (chains from different starts join within
+    a few hours of quiet traces). Going through each trace in order, every
+    continuation that starts from a true uplink replaces what the first pass
+    decided up to that point, so the result is the same as a replay from the
+    start of the traces.
+
+    Args:
+        traces: float array (devices, wake-ups, 3) of tempExt, tempInt, battVolt
+        policy: Policy
+
+    Returns:
+        bool array (devices, wake-ups), True where an uplink is sent
+    """
+    n_dev, n, n_ch = traces.shape
+    deadband = np.asarray(policy.deadband, dtype=float)
+    sent = np.zeros((n_dev, n), bool)
+    if np.isinf(deadband).all() and policy.backoff == 1.0:
+        # Plain heartbeat: nothing to search
+        sent[:, ::policy.max_interval] = True
+        return sent
+
+    starts = np.arange(0, n, PIECE)
+    device = np.repeat(np.arange(n_dev), len(starts))
+    begin = np.tile(starts, n_dev)
+    end = np.minimum(begin + PIECE, n)
+    sent[device, begin] = True
+    chain, at, last = _follow(traces, policy, device, begin, end)
+    sent[device[chain], at] = True
+
+    cont = np.flatnonzero(end < n)
+    chain, at, joined = _follow(traces, policy, device[cont], last[cont], np.full(len(cont), n), sent)
+    order = np.argsort(chain, kind='stable')
+    bounds = np.searchsorted(chain[order], np.arange(len(cont) + 1))
+    at = at[order]
+    # Wake-up up to which the uplinks of each device are final: a continuation from before is not a true one
+    settled = np.zeros(n_dev, np.int64)
+    for i, piece in enumerate(cont):
+        d = device[piece]
+        if settled[d] > last[piece]:
+            continue
+        sent[d, end[piece]:joined[i]] = False
+        sent[d, at[bounds[i]:bounds[i + 1]]] = True
+        settled[d] = joined[i]
+    return sent
+
+
+def _follow(traces, policy, device, start, end, stop=None):
+    """
+    Follow chains of uplinks, each from a given uplink, all together.
+
+    At every step, each chain scans the next WINDOW wake-ups of its search range
+    (from min_interval after its last uplink up to the heartbeat) for a
+    deadband crossing. A crossing or the heartbeat is its next uplink and
+    restarts its range; otherwise it moves on to the following window. The loop
+    runs about once per uplink (a few more times across quiet periods) rather
+    than once per wake-up.
+
+    Args:
+        traces: float array (devices, wake-ups, 3) of tempExt, tempInt, battVolt
+        policy: Policy
+        device: int array, trace followed by every chain
+        start: int array, wake-up of the uplink every chain starts from
+        end: int array, every chain stops before its first uplink at or after end
+        stop: optional bool array (devices, wake-ups), every chain also stops
+            at its first uplink marked there (not included in the results)
+
+    Returns:
+        (chain, wake-up) int arrays of the uplinks found after the starts, and
+        per chain, its last uplink (without stop) or the one it stopped at
+        (with stop, end if none)
+    """
+    n_dev, n, n_ch = traces.shape
+    deadband = np.asarray(policy.deadband, dtype=float)
+    width = min(WINDOW, n)
+    last_start = n - width
+    # Every run of `width` wake-ups of the channels with a deadband as a view: (devices, start, width)
+    watched = np.flatnonzero(~np.isinf(deadband))
+    windows = [np.lib.stride_tricks.sliding_window_view(traces[..., c], width, axis=1) for c in watched]
+    offsets = np.arange(width)
+    # Bands in the traces' type, rounded inwards so that comparisons keep their result
+    lower, upper = (np.empty((len(watched), len(device)), traces.dtype) for _ in range(2))
+    search, hi, heartbeat = (np.empty(len(device), np.int64) for _ in range(3))
+    last = start.copy()
+    result = end.copy() if stop is not None else last
+    found_chain, found_at = [np.empty(0, np.int64)], [np.empty(0, np.int64)]
+
+    def uplink(chains, at):
+        # Send at `at`, then set the band and the search range of the next uplink
+        last[chains] = at
+        value = traces[device[chains], at]
+        scale = np.where(value[:, 2] < policy.low_battery, policy.backoff, 1.0)
+        for i, c in enumerate(watched):
+            lower[i, chains] = _round_to(value[:, c] - deadband[c] * scale, traces.dtype, np.inf)
+            upper[i, chains] = _round_to(value[:, c] + deadband[c] * scale, traces.dtype, -np.inf)
+        search[chains] = at + np.ceil(np.maximum(policy.min_interval * scale, 1)).astype(np.int64)
+        heartbeat[chains] = at + np.ceil(policy.max_interval * scale).astype(np.int64)
+        hi[chains] = np.minimum(heartbeat[chains], end[chains] - 1)
+
+    active = np.arange(len(device))
+    uplink(active, start)
+    while len(active):
+        # Windows are shifted back to fit at the end of the traces, masking what precedes the range
+        first = np.minimum(search[active], last_start)
+        outside = np.zeros((len(active), width), bool)
+        for i, view in enumerate(windows):
+            window = view[device[active], first]
+            outside |= window > upper[i, active, None]
+            outside |= window < lower[i, active, None]
+        if (search[active] > last_start).any():
+            outside &= offsets >= (search[active] - first)[:, None]
+        crossing = outside.argmax(axis=1)
+        at = first + crossing
+        found = outside[np.arange(len(active)), crossing] & (at <= hi[active])
+        passed = ~found & (first + (width - 1) >= hi[active])
+        beat = passed & (heartbeat[active] < end[active])
+        search[active] += width
+        new = found | beat
+        chains, at = active[new], np.where(found, at, heartbeat[active])[new]
+        if stop is not None:
+            joined = stop[device[chains], at]
+            result[chains[joined]] = at[joined]
+            chains, at = chains[~joined], at[~joined]
+            new[new] = ~joined
+            keep = ~passed & ~found | new
+        else:
+            keep = ~passed | beat
+        found_chain.append(chains)
+        found_at.append(at)
+        uplink(chains, at)
+        active = active[keep]
+    return np.concatenate(found_chain), np.concatenate(found_at), result
+
+
+def _round_to(values, dtype, toward):
+    """
+    Cast float64 values to dtype, rounding toward +inf or -inf where inexact.
+    """
+    out = values.astype(dtype)
+    if out.dtype != values.dtype:
+        inexact = out < values if toward > 0 else out > values
+        out[inexact] = np.nextafter(out[inexact], out.dtype.type(toward))
+    return out
+
+
+EVALUATE_CHUNK = 1 << 20       # Wake-ups (all devices together) scored per step of evaluate()
+
+
+def evaluate(traces, sent, period_s=WAKE_PERIOD_S):
+    """
+    Score uplink decisions against the full traces.
+
+    The backend holds the last received (payload-quantized) value until the next
+    uplink, so the reconstruction error at every wake-up is the gap between the
+    true value and that held value. The devices are scored as one sequence of
+    segments, each an uplink and the wake-ups until the next one, in chunks of
+    whole segments, one channel at a time.
+
+    Returns:
+        dict of per-device arrays: 'uplinks/day', 'rmse' and 'max error' (per
+        channel) and 'staleness' (longest time without uplink, in seconds)
+    """
+    n_dev, n, n_ch = traces.shape
+    flat = traces.reshape(-1, n_ch)
+    # The first wake-up of every device starts a segment, as the first uplink
+    uplinks = sent.copy()
+    uplinks[:, 0] = True
+    starts = np.flatnonzero(uplinks)
+    lengths = np.diff(starts, append=len(flat))
+    held = quantize(flat[starts]).T.copy()
+    square = np.empty((n_ch, len(starts)))
+    worst = np.empty((n_ch, len(starts)))
+    bounds = np.unique(np.searchsorted(starts, np.arange(0, len(flat), EVALUATE_CHUNK)))
+    for first, last in zip(bounds, np.append(bounds[1:], len(starts))):
+        segment = slice(first, last)
+        rows = slice(starts[first], starts[first] + lengths[segment].sum())
+        at = starts[segment] - starts[first]
+        for c in range(n_ch):
+            err = flat[rows, c] - np.repeat(held[c, segment], lengths[segment])
+            square[c, segment] = np.add.reduceat(np.square(err, dtype=float), at)
+            worst[c, segment] = np.maximum.reduceat(np.abs(err, out=err), at)
+    devices = np.searchsorted(starts, np.arange(n_dev) * n)
+    return {
+        'uplinks/day': sent.sum(axis=1) / (n * period_s / 86400),
+        'rmse': np.sqrt(np.add.reduceat(square.T, devices) / n),
+        'max error': np.maximum.reduceat(worst.T, devices),
+        'staleness': (np.maximum.reduceat(lengths, devices) - 1) * period_s,
+    }
+
+
+def synthetic_traces(n_devices, days, period_s=WAKE_PERIOD_S, seed=0):
+    """
+    Fleet of plausible traces: diurnal cycle, weather random walk, sensor noise
+    and a slow battery discharge.
+
+    Returns:
+        float32 array (devices, wake-ups, 3)
+    """
+    rng = np.random.default_rng(seed)
+    n = int(days * 86400 / period_s)
+    t = np.arange(n, dtype=np.float32) * np.float32(period_s / 86400)
+    traces = np.empty((n_devices, n, 3), np.float32)
+    for trace in traces:
+        diurnal = rng.uniform(2, 8) * np.sin(2 * np.pi * t + rng.uniform(0, 2 * np.pi))
+        # Mean-reverting weather with a ~2 days memory and ~4 °C spread
+        weather = lfilter([1.0], [1.0, -WEATHER_RHO], rng.normal(0, 0.033, n)).astype(np.float32) + rng.uniform(-5, 20)
+        trace[:, 0] = weather + diurnal + rng.normal(0, 0.03, n)
+        trace[:, 1] = weather + 5 + 0.3 * diurnal + rng.normal(0, 0.01, n)
+        trace[:, 2] = 3.3 - rng.uniform(0.1, 0.6) / 365 * t + rng.normal(0, 0.005, n)
+    return traces
+
+
+def synthetic_fleet(n_devices, days, batch=32, period_s=WAKE_PERIOD_S, seed=0):
+    """
+    Generate a synthetic fleet in batches of devices, to bound memory use
+    (a device-year is ~63 MB). replay() steps all the devices of a batch
+    together, so larger batches are faster.
+    """
+    for i, start in enumerate(range(0, n_devices, batch)):
+        yield synthetic_traces(min(batch, n_devices - start), days, period_s, seed + i)
+
+
+def compare(batches, policies=DEFAULT_POLICIES, period_s=WAKE_PERIOD_S):
+    """
+    Replay every policy and aggregate the metrics over the fleet.
+
+    Args:
+        batches: Iterable of trace arrays (devices, wake-ups, 3)
+        policies: Policies to compare
+
+    Returns:
+        list of (policy name, dict of fleet-level metrics, replay seconds)
+    """
+    per_policy = {policy.name: [] for policy in policies}
+    elapsed = dict.fromkeys(per_policy, 0.0)
+    for traces in batches:
+        for policy in policies:
+            t0 = time.perf_counter()
+            sent = replay(traces, policy)
+            elapsed[policy.name] += time.perf_counter() - t0
+            per_policy[policy.name].append(evaluate(traces, sent, period_s))
+
+    rows = []
+    for name, results in per_policy.items():
+        m = {key: np.concatenate([r[key] for r in results]) for key in results[0]}
+        rows.append((name, {
+            'uplinks/day': m['uplinks/day'].mean(),
+            'max uplinks/day': m['uplinks/day'].max(),
+            'rmse ext': m['rmse'][:, 0].mean(),
+            'rmse int': m['rmse'][:, 1].mean(),
+            'max err ext': m['max error'][:, 0].max(),
+            'staleness h': m['staleness'].max() / 3600,
+        }, elapsed[name]))
+    return rows
+
+
+def print_table(rows):
+    names = list(rows[0][1])
+    print(f"{'policy':>24}" + ''.join(f"{name:>16}" for name in names) + f"{'replay s':>10}")
+    for policy, metrics, elapsed in rows:
+        print(f"{policy:>24}" + ''.join(f"{metrics[name]:>16.3f}" for name in names) + f"{elapsed:>10.2f}")
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compare uplink scheduling policies on recorded and synthetic traces")
+    parser.add_argument('csv', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'])
+    parser.add_argument('--devices', type=int, default=20, help="Synthetic fleet size (0 to skip)")
+    parser.add_argument('--days', type=float, default=365, help="Synthetic trace duration")
+    parser.add_argument('--batch', type=int, default=32, help="Devices replayed together")
+    args = parser.parse_args()
+
+    for path in args.csv:
+        frame = pd.read_csv(path)
+        traces = frame[list(CHANNELS)].to_numpy(dtype=float)[None]
+        print(f"{Path(path).name} ({traces.shape[1]} wake-ups)")
+        print_table(compare([traces]))
+    if args.devices:
+        print(f"Synthetic fleet: {args.devices} devices x {args.days:g} days")
+        t0 = time.perf_counter()
+        print_table(compare(synthetic_fleet(args.devices, args.days, args.batch)))
+        print(f"Total {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Soak test of the live logger pipeline (main.py / main2.py), headless.
+
+The logger's update_plot() is driven frame after frame with a synthetic
+serial port and a simulated clock, so weeks of 6 s samples go through the
+real code path (decode, WAL append and compaction, SampleHistory, envelope
+decimation, Agg redraw) in minutes: in binary telemetry mode every frame
+reads a burst of samples, as after a stalled GUI.
+
+At regular checkpoints it records the process RSS, the memory traced by
+tracemalloc, the number of objects tracked by the garbage collector and the
+latency percentiles of update_plot() over the frames since the previous
+checkpoint. Growth is measured from the end of a warm-up (Matplotlib caches,
+first capacity doublings) to the end of the run and compared with budgets;
+the exit status is 1 when one is exceeded, so it can run in CI.
+
+tracemalloc slows the allocation-heavy redraw down; latencies are only
+compared with each other, within the run.
+"""
+import argparse
+import contextlib
+import gc
+import importlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import numpy as np
+
+from telemetry_frame import encode_frames
+from wal import Compactor, CsvSink, WalWriter
+
+CHANNELS = ['tempExt', 'tempInt', 'battVolt']
+PERIOD_S = 6                   # Sampling period of main.ino
+
+
+class SyntheticSerial:
+    """
+    Serial port stand-in producing a daily temperature cycle with noise and a
+    slowly discharging battery, as text lines or binary frames.
+    """
+
+    def __init__(self, rows_per_read=1, period_s=PERIOD_S, binary=True, seed=0):
+        self.rows_per_read = rows_per_read
+        self.period_s = period_s
+        self.binary = binary
+        self.rng = np.random.default_rng(seed)
+        self.samples = 0
+        self._pending = b''
+
+    def _rows(self, n):
+        t = (self.samples + np.arange(n)) * self.period_s
+        day = 2 * np.pi * t / 86400
+        temp_ext = 10 + 6 * np.sin(day) + self.rng.normal(0, 0.2, n)
+        temp_int = 20 + 2 * np.sin(day - 0.5) + self.rng.normal(0, 0.05, n)
+        batt = 4.1 - 0.6 * t / (60 * 86400) + self.rng.normal(0, 0.005, n)
+        self.samples += n
+        return temp_ext, temp_int, batt
+
+    def readline(self):
+        temp_ext, temp_int, batt = self._rows(1)
+        return f"{temp_ext[0]:.2f}, {temp_int[0]:.2f}, {batt[0]:.3f}\r\n".encode()
+
+    @property
+    def in_waiting(self):
+        if not self._pending:
+            seq = (self.samples + np.arange(self.rows_per_read)) % 65536
+            self._pending = encode_frames(seq, *self._rows(self.rows_per_read))
+        return len(self._pending)
+
+    def read(self, size=1):
+        self.in_waiting
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class SimulatedClock:
+    """
+    Replaces the logger's HostClock: receive times map to the time of the last
+    sample produced by the port, latencies are measured on the real clock.
+    """
+
+    def __init__(self, port, start=datetime(2025, 3, 1)):
+        self.port = port
+        self.start_ns = np.datetime64(start, 'ns').astype(np.int64)
+
+    def monotonic_ns(self):
+        return time.monotonic_ns()
+
+    def to_wall_ns(self, monotonic_ns):
+        return int(self.start_ns + self.port.samples * self.port.period_s * 1_000_000_000)
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # Peak instead of current RSS where /proc is missing (kB on Linux, bytes on macOS)
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def checkpoint(frame, samples, latencies, errors):
+    """
+    One row of the soak timeline.
+    """
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3 if len(latencies) else (np.nan,) * 3
+    return {
+        'frame': frame,
+        'days': samples * PERIOD_S / 86400,
+        'samples': samples,
+        'rss_mb': _rss_bytes() / 2**20,
+        'traced_mb': tracemalloc.get_traced_memory()[0] / 2**20,
+        'objects': len(gc.get_objects()),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'errors': errors,
+    }
+
+
+def run(logger='main', days=30, frames=1000, binary=True, checkpoints=30, warmup=0.1,
+        compact_interval_s=5.0, seed=0):
+    """
+    Drive the logger's update_plot() over `days` of simulated samples.
+
+    Args:
+        logger: Module name of the logger (main or main2)
+        frames: Number of update_plot() calls (binary mode; text mode reads one sample per frame)
+        warmup: Fraction of the frames before the reference checkpoint
+
+    Returns:
+        (timeline: list of checkpoint dicts, tracemalloc snapshots at the reference and at the end)
+    """
+    module = importlib.import_module(logger)
+    samples = int(days * 86400 / PERIOD_S)
+    frames = frames if binary else samples
+    port = SyntheticSerial(max(1, samples // frames), binary=binary, seed=seed)
+    module.ser = port
+    module.clock = SimulatedClock(port)
+    module.BINARY_TELEMETRY = binary
+
+    every = max(1, frames // checkpoints)
+    reference = max(every, int(frames * warmup) // every * every)
+    timeline, snapshots, latencies = [], [], []
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        module.wal = WalWriter(Path(tmp) / 'wal', CHANNELS)
+        compactor = Compactor(module.wal, CsvSink(Path(tmp) / 'soak.csv'), interval_s=compact_interval_s)
+        compactor.start()
+        try:
+            # The logger prints every raw line and error; the error count is kept by the module
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                for frame in range(1, frames + 1):
+                    start = time.perf_counter()
+                    module.update_plot(frame)
+                    latencies.append(time.perf_counter() - start)
+                    if frame % every == 0 or frame == frames:
+                        timeline.append(checkpoint(frame, port.samples, latencies, module.error_count))
+                        latencies = []
+                        if frame == reference or frame == frames:
+                            snapshots.append(tracemalloc.take_snapshot())
+        finally:
+            compactor.stop()
+            module.wal.close()
+            tracemalloc.stop()
+    return timeline, snapshots
+
+
+def evaluate(timeline, max_bytes_per_sample=128, max_rss_mb=256, max_object_growth=5000,
+             max_latency_growth=3.0, max_p99_ms=1000, warmup=0.1):
+    """
+    Compare the growth between the reference checkpoint and the end with the budgets.
+
+    Args:
+        max_bytes_per_sample: Traced memory growth allowed per sample (the history
+            itself takes 32 bytes per sample, twice that right after a capacity doubling)
+        max_rss_mb: RSS growth allowed [MiB]
+        max_object_growth: Growth of the number of gc-tracked objects
+        max_latency_growth: Growth of the p95 latency over the run
+        max_p99_ms: p99 latency allowed in every window after the warm-up
+
+    Returns:
+        List of failure messages (empty when every budget holds)
+    """
+    first = max(0, int(len(timeline) * warmup) - 1)
+    ref, end = timeline[first], timeline[-1]
+    samples = max(1, end['samples'] - ref['samples'])
+    failures = []
+    per_sample = (end['traced_mb'] - ref['traced_mb']) * 2**20 / samples
+    if per_sample > max_bytes_per_sample:
+        failures.append(f"traced memory grew by {per_sample:.0f} B/sample (budget {max_bytes_per_sample})")
+    if end['rss_mb'] - ref['rss_mb'] > max_rss_mb:
+        failures.append(f"RSS grew by {end['rss_mb'] - ref['rss_mb']:.0f} MiB (budget {max_rss_mb})")
+    if end['objects'] - ref['objects'] > max_object_growth:
+        failures.append(f"{end['objects'] - ref['objects']} more gc objects (budget {max_object_growth})")
+    # Median p95 of the first and last quarter of the windows after the warm-up (single windows are noisy)
+    p95 = np.array([row['p95_ms'] for row in timeline[first + 1:]])
+    quarter = max(1, len(p95) // 4)
+    early, late = np.median(p95[:quarter]), np.median(p95[-quarter:])
+    if late > max_latency_growth * early:
+        failures.append(f"p95 latency went from {early:.1f} to {late:.1f} ms (budget x{max_latency_growth:g})")
+    worst = max(row['p99_ms'] for row in timeline[first + 1:])
+    if worst > max_p99_ms:
+        failures.append(f"p99 latency reached {worst:.1f} ms (budget {max_p99_ms} ms)")
+    if end['errors']:
+        failures.append(f"update_plot() caught {end['errors']} exceptions")
+    return failures
+
+
+def print_timeline(timeline):
+    print(f"{'frame':>7} {'days':>6} {'samples':>8} {'RSS MiB':>8} {'traced':>7} {'objects':>8} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'errors':>6}")
+    for row in timeline:
+        print(f"{row['frame']:7d} {row['days']:6.1f} {row['samples']:8d} {row['rss_mb']:8.1f} "
+              f"{row['traced_mb']:7.1f} {row['objects']:8d} {row['p50_ms']:7.1f} {row['p95_ms']:7.1f} "
+              f"{row['p99_ms']:7.1f} {row['errors']:6d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless soak test of the live logger")
+    parser.add_argument('--logger', default='main', choices=['main', 'main2'])
+    parser.add_argument('--days', type=float, default=30, help="Simulated capture length")
+    parser.add_argument('--frames', type=int, default=1000, help="update_plot() calls (binary telemetry)")
+    parser.add_argument('--text', action='store_true',
+                        help="Text telemetry, one sample per frame (use a few --days)")
+    parser.add_argument('--checkpoints', type=int, default=30)
+    parser.add_argument('--max-bytes-per-sample', type=float, default=128)
+    parser.add_argument('--max-rss-mb', type=float, default=256)
+    parser.add_argument('--max-object-growth', type=int, default=5000)
+    parser.add_argument('--max-latency-growth', type=float, default=3.0)
+    parser.add_argument('--max-p99-ms', type=float, default=1000)
+    parser.add_argument('--csv', help="Write the timeline to this CSV")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    timeline, snapshots = run(args.logger, args.days, args.frames, not args.text, args.checkpoints)
+    print(f"{args.logger}.py: {timeline[-1]['samples']} samples ({timeline[-1]['days']:.1f} days) "
+          f"in {timeline[-1]['frame']} frames, {time.perf_counter() - t0:.0f} s")
+    print_timeline(timeline)
+    if args.csv:
+        import pandas as pd
+        pd.DataFrame(timeline).to_csv(args.csv, index=False)
+
+    print("\nLargest allocation growth since the warm-up:")
+    for stat in snapshots[-1].compare_to(snapshots[0], 'lineno')[:10]:
+        print(f"  {stat}")
+
+    failures = evaluate(timeline, args.max_bytes_per_sample, args.max_rss_mb, args.max_object_growth,
+                        args.max_latency_growth, args.max_p99_ms)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Binary telemetry frames of main/main.ino (telemetry_mode & TELEMETRY_BINARY).
+
+A frame is the packed little-endian struct FRAME_DTYPE: sequence number,
+tempExt, tempInt, battVolt (float32) and the avr-libc CRC-CCITT of the first
+14 bytes. It is COBS encoded (always 17 bytes, the struct is shorter than
+254 bytes) and sent between two 0x00 delimiters, so it can be interleaved
+with the text lines.
+
+Decoding works on a whole buffer at once: every 0x00 is a candidate frame
+end, the 17 bytes before it are gathered into a 2-D array and COBS, CRC and
+the struct are decoded column-wise, without a Python object per frame.
+"""
+import numpy as np
+
+FRAME_DTYPE = np.dtype([('seq', '<u2'), ('tempExt', '<f4'), ('tempInt', '<f4'), ('battVolt', '<f4'),
+                        ('crc', '<u2')])
+ENCODED_SIZE = FRAME_DTYPE.itemsize + 1  # COBS overhead of one byte below 254 bytes
+CRC_INIT = 0xFFFF
+CHANNELS = ('tempExt', 'tempInt', 'battVolt')
+
+
+def _crc_table():
+    """
+    Byte table of _crc_ccitt_update (util/crc16.h): the reflected 0x1021
+    polynomial, 0x8408.
+    """
+    table = np.arange(256, dtype=np.uint16)
+    for _ in range(8):
+        table = np.where(table & 1, (table >> 1) ^ 0x8408, table >> 1).astype(np.uint16)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc_ccitt(data):
+    """
+    CRC of every row of a (frames, bytes) uint8 array (or of one bytes object),
+    as computed with _crc_ccitt_update from CRC_INIT.
+    """
+    data = np.atleast_2d(np.frombuffer(data, np.uint8) if isinstance(data, (bytes, bytearray)) else data)
+    crc = np.full(len(data), CRC_INIT, np.uint16)
+    for column in data.T:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ column) & 0xFF]
+    return crc
+
+
+def cobs_encode(data):
+    """
+    COBS encoding of one packet (reference implementation, used to build test streams).
+    """
+    out = bytearray()
+    for block in bytes(data).split(b'\x00'):
+        while len(block) >= 254:
+            out += b'\xff' + block[:254]
+            block = block[254:]
+        out += bytes([len(block) + 1]) + block
+    if len(data) and len(data) % 254 == 0 and b'\x00' not in data[-254:]:
+        out += b'\x01'
+    return bytes(out)
+
+
+def encode_frames(seq, tempExt, tempInt, battVolt):
+    """
+    Byte stream the firmware emits for these samples (for tests and emulation).
+    """
+    frames = np.zeros(len(seq), FRAME_DTYPE)
+    frames['seq'], frames['tempExt'], frames['tempInt'], frames['battVolt'] = seq, tempExt, tempInt, battVolt
+    raw = frames.view(np.uint8).reshape(len(frames), -1)
+    frames['crc'] = crc_ccitt(raw[:, :FRAME_DTYPE.fields['crc'][1]])
+    return b''.join(b'\x00' + cobs_encode(frame.tobytes()) + b'\x00' for frame in frames)
+
+
+def cobs_decode_fixed(encoded):
+    """
+    COBS decoding of equal-length packets.
+
+    Args:
+        encoded: uint8 array (frames, n+1) of encoded packets without delimiter
+
+    Returns:
+        (decoded uint8 array (frames, n), valid bool array): a packet is valid
+        when its chain of code bytes lands exactly on its end and it has no 0x00
+    """
+    n_frames, size = encoded.shape
+    rows = np.arange(n_frames)
+    decoded = encoded[:, 1:].copy()
+    valid = (encoded != 0).all(axis=1)
+    pos = np.zeros(n_frames, np.int64)
+    # Follow the chain of code bytes: each one points at the next, which stands for a 0x00
+    for _ in range(size):
+        pos = np.where(pos < size, pos + encoded[rows, np.minimum(pos, size - 1)], pos)
+        inside = pos < size
+        if not inside.any():
+            break
+        decoded[rows[inside], pos[inside] - 1] = 0
+    return decoded, valid & (pos == size)
+
+
+def decode(buffer):
+    """
+    Decode every complete frame of a byte buffer.
+
+    Returns:
+        (frames, consumed, errors): FRAME_DTYPE array of the frames with a valid
+        COBS chain and CRC, number of bytes that can be dropped from the buffer
+        (everything up to the last delimiter), and the number of candidate
+        frames rejected by their CRC
+    """
+    data = np.frombuffer(buffer, np.uint8)
+    ends = np.flatnonzero(data == 0)
+    consumed = int(ends[-1]) + 1 if len(ends) else 0
+    ends = ends[ends >= ENCODED_SIZE]
+    if not len(ends):
+        return np.zeros(0, FRAME_DTYPE), consumed, 0
+    encoded = data[ends[:, None] - ENCODED_SIZE + np.arange(ENCODED_SIZE)]
+    decoded, valid = cobs_decode_fixed(encoded)
+    # Text before a frame or two frames back to back give invalid chains: not errors
+    decoded = decoded[valid]
+    crc_ok = crc_ccitt(decoded[:, :FRAME_DTYPE.fields['crc'][1]]) == decoded.view('<u2')[:, -1]
+    frames = np.ascontiguousarray(decoded[crc_ok]).view(FRAME_DTYPE).ravel()
+    return frames, consumed, int((~crc_ok).sum())
+
+
+class FrameReader:
+    """
+    Incremental decoder for a serial stream: feed() whatever bytes arrived and
+    get the frames they completed. Gaps in the sequence numbers are counted as
+    dropped frames.
+    """
+
+    def __init__(self):
+        self.buffer = b''
+        self.last_seq = None
+        self.frames = 0
+        self.dropped = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames, consumed, errors = decode(self.buffer)
+        self.buffer = self.buffer[consumed:]
+        self.crc_errors += errors
+        if len(frames):
+            seq = frames['seq'].astype(np.int64)
+            if self.last_seq is not None:
+                seq = np.concatenate(([self.last_seq], seq))
+            gaps = (np.diff(seq) - 1) % 65536
+            gaps[seq[1:] == 0] = 0           # Board reset: the counter restarts, nothing was lost
+            self.dropped += int(gaps.sum())
+            self.last_seq = int(frames['seq'][-1])
+            self.frames += len(frames)
+        return frames
+
+
+def samples(frames):
+    """
+    (frames, 3) float array of tempExt, tempInt, battVolt, the column order of the CSV logs.
+    """
+    return np.column_stack([frames[name].astype(float) for name in CHANNELS])
@@ -0,0 +1,299 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Payload scaling, as in send_data() in main/main.ino
+TMIN = -60.0
+TMAX = 60.0
+VMAX = 15.0
+TEMP_CODE_MAX = 0xFFF
+BATT_CODE_MAX = 0xFF
+
+PAYLOAD_BYTES = 12             # Sigfox uplink limit
+SEND_PERIOD = 128              # Wake-ups between two uplinks (send_counter_threshold)
+
+# Aggregated format, version 1. Fields are packed MSB first into the 96 bits:
+#   version(4) shift(2) count-1(3) interval(7) battery(8) tempExt(12) tempInt(12)
+#   then 6 x (dExt(4) dInt(4)) signed deltas going back in time
+# tempExt/tempInt/battery are the newest sample, coded as in the legacy payload.
+# Older sample k (1..count-1) was measured k*interval wake-ups before the newest
+# one and equals the previous (newer) one plus delta * 2**shift codes.
+AGG_VERSION = 1
+AGG_SAMPLES = 7
+DELTA_BITS = 4
+DELTA_MIN = -(1 << (DELTA_BITS - 1))
+DELTA_MAX = (1 << (DELTA_BITS - 1)) - 1
+_FIELDS = [('version', 4), ('shift', 2), ('count', 3), ('interval', 7),
+           ('batt', 8), ('ext', 12), ('int', 12)]
+_FIELDS += [(f'{name}{k}', DELTA_BITS) for k in range(1, AGG_SAMPLES) for name in ('d_ext', 'd_int')]
+assert sum(width for _, width in _FIELDS) == 8 * PAYLOAD_BYTES
+
+
+def temp_to_code(temp):
+    code = np.rint((np.asarray(temp, dtype=float) - TMIN) / (TMAX - TMIN) * TEMP_CODE_MAX)
+    return np.clip(code, 0, TEMP_CODE_MAX).astype(np.int64)
+
+
+def code_to_temp(code):
+    return np.asarray(code) * (TMAX - TMIN) / TEMP_CODE_MAX + TMIN
+
+
+def batt_to_code(volt):
+    code = np.rint(np.asarray(volt, dtype=float) * BATT_CODE_MAX / VMAX)
+    return np.clip(code, 0, BATT_CODE_MAX).astype(np.int64)
+
+
+def code_to_batt(code):
+    return np.asarray(code) * VMAX / BATT_CODE_MAX
+
+
+def encode_legacy(batt, ext, int_):
+    """
+    Build the current `XXYYYZZZ` payload string of one sample.
+    """
+    return f"{int(batt_to_code(batt)):02X}{int(temp_to_code(ext)):03X}{int(temp_to_code(int_)):03X}"
+
+
+def decode_legacy(payloads):
+    """
+    Decode `XXYYYZZZ` payload strings.
+
+    Args:
+        payloads: Iterable of 8-character hex strings
+
+    Returns:
+        (battery [V], tempExt [°C], tempInt [°C]) arrays
+    """
+    raw = np.frombuffer(bytes.fromhex(''.join(payloads)), np.uint8).reshape(-1, 4).astype(np.int64)
+    batt = raw[:, 0]
+    ext = (raw[:, 1] << 4) | (raw[:, 2] >> 4)
+    int_ = ((raw[:, 2] & 0xF) << 8) | raw[:, 3]
+    return code_to_batt(batt), code_to_temp(ext), code_to_temp(int_)
+
+
+def pack_fields(fields):
+    """
+    Pack unsigned integer fields into 12-byte payloads.
+
+    Args:
+        fields: dict name -> int array of shape (m,), following _FIELDS
+
+    Returns:
+        uint8 array of shape (m, 12)
+    """
+    columns = []
+    for name, width in _FIELDS:
+        value = np.asarray(fields[name], dtype=np.int64) & ((1 << width) - 1)
+        columns.append((value[:, None] >> np.arange(width - 1, -1, -1)) & 1)
+    return np.packbits(np.concatenate(columns, axis=1).astype(np.uint8), axis=1)
+
+
+def unpack_fields(payloads):
+    """
+    Inverse of pack_fields.
+
+    Args:
+        payloads: uint8 array of shape (m, 12)
+
+    Returns:
+        dict name -> int64 array of shape (m,)
+    """
+    bits = np.unpackbits(np.asarray(payloads, dtype=np.uint8).reshape(-1, PAYLOAD_BYTES), axis=1).astype(np.int64)
+    fields = {}
+    pos = 0
+    for name, width in _FIELDS:
+        fields[name] = bits[:, pos:pos + width] @ (1 << np.arange(width - 1, -1, -1))
+        pos += width
+    return fields
+
+
+def _delta_chain(codes, count, shift):
+    """
+    Closed-loop delta coding of codes (m, AGG_SAMPLES), newest first.
+
+    Returns:
+        (deltas (m, AGG_SAMPLES-1), reconstruction (m, AGG_SAMPLES))
+    """
+    step = 1 << shift
+    recon = np.empty_like(codes)
+    recon[:, 0] = codes[:, 0]
+    deltas = np.zeros((len(codes), AGG_SAMPLES - 1), np.int64)
+    for k in range(1, AGG_SAMPLES):
+        d = np.clip(np.rint((codes[:, k] - recon[:, k - 1]) / step), DELTA_MIN, DELTA_MAX).astype(np.int64)
+        d[count <= k] = 0
+        deltas[:, k - 1] = d
+        recon[:, k] = np.clip(recon[:, k - 1] + d * step, 0, TEMP_CODE_MAX)
+    return deltas, recon
+
+
+def encode_aggregated(batt, ext, int_, interval, count=None):
+    """
+    Build aggregated payloads, vectorized over messages.
+
+    Args:
+        batt: Battery voltage of the newest sample [V], shape (m,)
+        ext, int_: Temperatures [°C], shape (m, AGG_SAMPLES), newest first
+        interval: Wake-ups between consecutive samples (1..127), scalar or (m,)
+        count: Number of valid samples per message (1..AGG_SAMPLES), defaults to all
+
+    Returns:
+        uint8 array of shape (m, 12)
+    """
+    ext = temp_to_code(ext).reshape(-1, AGG_SAMPLES)
+    int_ = temp_to_code(int_).reshape(-1, AGG_SAMPLES)
+    m = len(ext)
+    count = np.broadcast_to(AGG_SAMPLES if count is None else count, m)
+    valid = np.arange(AGG_SAMPLES) < count[:, None]
+
+    # Smallest delta step that minimizes the worst reconstruction error
+    best_err = np.full(m, np.iinfo(np.int64).max)
+    best = None
+    for shift in range(4):
+        d_ext, r_ext = _delta_chain(ext, count, shift)
+        d_int, r_int = _delta_chain(int_, count, shift)
+        err = np.where(valid, np.maximum(abs(r_ext - ext), abs(r_int - int_)), 0).max(axis=1)
+        better = err < best_err
+        if best is None:
+            best = {'shift': np.zeros(m, np.int64), 'd_ext': d_ext, 'd_int': d_int}
+        best['shift'][better] = shift
+        best['d_ext'][better] = d_ext[better]
+        best['d_int'][better] = d_int[better]
+        best_err = np.minimum(best_err, err)
+
+    fields = {
+        'version': np.full(m, AGG_VERSION),
+        'shift': best['shift'],
+        'count': count - 1,
+        'interval': np.broadcast_to(interval, m),
+        'batt': batt_to_code(batt).reshape(m),
+        'ext': ext[:, 0],
+        'int': int_[:, 0],
+    }
+    for k in range(1, AGG_SAMPLES):
+        fields[f'd_ext{k}'] = best['d_ext'][:, k - 1]
+        fields[f'd_int{k}'] = best['d_int'][:, k - 1]
+    return pack_fields(fields)
+
+
+def decode_aggregated(payloads):
+    """
+    Decode aggregated payloads, vectorized over messages.
+
+    Args:
+        payloads: uint8 array of shape (m, 12), bytes, or iterable of 24-character hex strings
+
+    Returns:
+        dict with 'batt' [V] (m,), 'ext' and 'int' [°C] (m, AGG_SAMPLES) newest first
+        (NaN past 'count'), 'count' (m,) and 'age' (m, AGG_SAMPLES), the
+        wake-ups elapsed between each sample and the newest one
+    """
+    if isinstance(payloads, (bytes, bytearray)):
+        payloads = np.frombuffer(payloads, np.uint8)
+    elif not isinstance(payloads, np.ndarray):
+        payloads = np.frombuffer(bytes.fromhex(''.join(payloads)), np.uint8)
+    f = unpack_fields(payloads)
+    if np.any(f['version'] != AGG_VERSION):
+        raise ValueError("Unsupported aggregated payload version")
+
+    def signed(v):
+        return np.where(v > DELTA_MAX, v - (1 << DELTA_BITS), v)
+
+    step = 1 << f['shift']
+    ext = np.empty((len(step), AGG_SAMPLES), np.int64)
+    int_ = np.empty_like(ext)
+    ext[:, 0], int_[:, 0] = f['ext'], f['int']
+    for k in range(1, AGG_SAMPLES):
+        ext[:, k] = np.clip(ext[:, k - 1] + signed(f[f'd_ext{k}']) * step, 0, TEMP_CODE_MAX)
+        int_[:, k] = np.clip(int_[:, k - 1] + signed(f[f'd_int{k}']) * step, 0, TEMP_CODE_MAX)
+
+    count = f['count'] + 1
+    valid = np.arange(AGG_SAMPLES) < count[:, None]
+    return {
+        'batt': code_to_batt(f['batt']),
+        'ext': np.where(valid, code_to_temp(ext), np.nan),
+        'int': np.where(valid, code_to_temp(int_), np.nan),
+        'count': count,
+        'age': f['interval'][:, None] * np.arange(AGG_SAMPLES),
+    }
+
+
+def simulate(values, period=SEND_PERIOD, interval=None):
+    """
+    Replay a trace (one row per wake-up) through both payload formats.
+
+    Args:
+        values: array (n, 3) of tempExt, tempInt, battVolt
+        period: Wake-ups between two uplinks
+        interval: Wake-ups between aggregated samples, defaults to spreading
+            AGG_SAMPLES over the period
+
+    Returns:
+        dict format -> dict of metrics
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if interval is None:
+        interval = max(1, min(127, period // AGG_SAMPLES))
+    sends = np.arange(period - 1, n, period)
+    if len(sends) == 0:
+        raise ValueError(f"Trace shorter than one send period ({n} < {period} wake-ups)")
+    wake = np.arange(n)
+    results = {}
+
+    # Legacy: the newest sample only
+    batt, ext, int_ = decode_legacy([encode_legacy(*values[i, [2, 0, 1]]) for i in sends])
+    results['legacy'] = _reconstruction_metrics(values, wake, sends, ext, int_, 1, 4)
+
+    # Aggregated: AGG_SAMPLES samples going back in time from each send
+    idx = sends[:, None] - interval * np.arange(AGG_SAMPLES)
+    count = np.minimum(AGG_SAMPLES, sends // interval + 1)
+    idx = np.maximum(idx, 0)
+    payloads = encode_aggregated(values[sends, 2], values[idx, 0], values[idx, 1], interval, count)
+    decoded = decode_aggregated(payloads)
+    t = (sends[:, None] - decoded['age'])[:, ::-1].ravel()
+    keep = ~np.isnan(decoded['ext'][:, ::-1].ravel())
+    results['aggregated'] = _reconstruction_metrics(
+        values, wake, t[keep], decoded['ext'][:, ::-1].ravel()[keep], decoded['int'][:, ::-1].ravel()[keep],
+        count.mean(), PAYLOAD_BYTES)
+    return results
+
+
+def _reconstruction_metrics(values, wake, t, ext, int_, samples_per_message, payload_bytes):
+    order = np.argsort(t, kind='stable')
+    t, ext, int_ = t[order], ext[order], int_[order]
+    # Only score the span the receiver actually covers
+    span = (wake >= t[0]) & (wake <= t[-1])
+    err_ext = np.interp(wake[span], t, ext) - values[span, 0]
+    err_int = np.interp(wake[span], t, int_) - values[span, 1]
+    return {
+        'samples/message': samples_per_message,
+        'payload bytes': payload_bytes,
+        'rmse tempExt': np.sqrt(np.mean(err_ext ** 2)),
+        'max tempExt': np.abs(err_ext).max(),
+        'rmse tempInt': np.sqrt(np.mean(err_int ** 2)),
+        'max tempInt': np.abs(err_int).max(),
+    }
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compare the legacy and aggregated payloads on logged traces")
+    parser.add_argument('csv', nargs='*', default=['arduino_data2.csv', 'arduino_data3.csv'])
+    parser.add_argument('--period', type=int, default=SEND_PERIOD, help="Wake-ups between two uplinks")
+    parser.add_argument('--interval', type=int, help="Wake-ups between aggregated samples")
+    args = parser.parse_args()
+
+    for path in args.csv:
+        frame = pd.read_csv(path)
+        results = simulate(frame[['tempExt', 'tempInt', 'battVolt']].to_numpy(), args.period, args.interval)
+        print(f"{Path(path).name} ({len(frame)} wake-ups, one uplink every {args.period}):")
+        names = list(results['legacy'])
+        print(f"  {'':>16}" + ''.join(f"{name:>16}" for name in names))
+        for fmt, metrics in results.items():
+            print(f"  {fmt:>16}" + ''.join(f"{metrics[name]:>16.4g}" for name in names))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,732 @@
+"""
+Live web dashboard of the loggers, served by an asyncio server (standard
+library only: HTTP and RFC 6455 WebSocket are handled here).
+
+Samples come from the WALs of running loggers (tailed, so the serial port
+stays with main.py / main2.py), from logged CSVs (loader.py) or from
+synthetic devices. Every browser panel shows one device and tells the server
+its viewport: a time range (or a span following the newest sample) and its
+width in pixels. The server answers with a per-pixel min/max envelope
+(decimation.minmax_envelope) of that range, read from the raw history for
+short spans and from the rollup pyramid (rollup.py) when a pixel covers a
+whole bucket or the range is older than the raw history kept (the last
+RAW_HISTORY_S of every device), so a message never holds more than 4 points
+per pixel column and channel whatever the number of samples behind it.
+
+Followed views then get deltas: the envelope of the samples from the start
+of their last pixel column on, which replaces the client's points from that
+column on. Identical deltas and snapshots (same device, range and pixel
+size) are encoded once per push and sent to every viewer that needs them,
+and a viewer that cannot keep up gets a fresh snapshot instead of a backlog.
+
+Data messages are binary (little-endian):
+    <u8 kind (0 snapshot, 1 delta)> <u8 channels> <u16 device index> <u32 points> <f64 replace-from [ms]>
+    <f64 time [ms, local wall clock as logged]> * points
+    <f32 value> * points * channels
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+from clock_align import HostClock
+from decimation import minmax_envelope
+from rollup import CHANNELS, NS_PER_S, RollupStore
+from sample_history import SampleHistory
+from wal import list_segments, scan_segment
+
+PORT = 8080
+PUSH_INTERVAL_S = 0.25         # Deltas are batched over this interval
+WAL_POLL_S = 1.0               # The loggers commit their WAL every second
+SEND_QUEUE = 16                # Messages waiting for a viewer before it gets a snapshot instead
+MAX_WIDTH_PX = 8192
+MAX_MESSAGE = 1 << 16          # Largest message accepted from a viewer [bytes] (views are small JSON)
+RAW_HISTORY_S = 3 * 86400      # Raw samples kept per device; older ranges come from the rollup
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+SNAPSHOT, DELTA = 0, 1
+_DATA_HEADER = struct.Struct('<BBHId')
+CLOSE_TOO_BIG = 1009
+
+
+def envelope(t_ns, values, ns_per_px):
+    """
+    Min/max envelope of every channel on a pixel grid aligned to multiples of ns_per_px.
+
+    Returns:
+        (timestamps, values) of the union of the points kept for every channel
+    """
+    if len(t_ns) == 0:
+        return t_ns, values
+    x0 = t_ns[0] // ns_per_px * ns_per_px
+    n_pixels = int((t_ns[-1] - x0) // ns_per_px) + 1
+    keep = np.unique(np.concatenate([
+        minmax_envelope(t_ns, values[:, i], n_pixels, (x0, x0 + n_pixels * ns_per_px))
+        for i in range(values.shape[1])
+    ]))
+    return t_ns[keep], values[keep]
+
+
+def encode_points(kind, device_index, since_ns, t_ns, values):
+    header = _DATA_HEADER.pack(kind, values.shape[1], device_index, len(t_ns), since_ns / 1e6)
+    return header + (t_ns / 1e6).astype('<f8').tobytes() + values.astype('<f4').tobytes()
+
+
+class Device:
+    def __init__(self, name, index, n_channels):
+        self.name = name
+        self.index = index
+        self.history = SampleHistory(n_channels, time_dtype=np.int64)
+        self.raw_from_ns = None        # Oldest raw sample kept, once older ones were dropped
+
+    @property
+    def latest_ns(self):
+        return int(self.history.timestamps[-1]) if len(self.history) else None
+
+
+class Hub:
+    """
+    Sample store of every device and the views of every connected viewer.
+    """
+
+    def __init__(self, channels=CHANNELS):
+        self.channels = tuple(channels)
+        self.devices = {}
+        self.rollup = RollupStore(self.channels)
+        self.viewers = set()
+        self.stats = {'pushes': 0, 'encoded': 0, 'sent': 0, 'bytes': 0, 'push_s': 0.0}
+
+    def device(self, name):
+        if name not in self.devices:
+            self.devices[name] = Device(name, len(self.devices), len(self.channels))
+            for viewer in self.viewers:
+                viewer.send_text(self.devices_message())
+        return self.devices[name]
+
+    def devices_message(self):
+        return json.dumps({'type': 'devices', 'devices': list(self.devices), 'channels': self.channels})
+
+    def append(self, name, t_ns, values):
+        """
+        Add samples of a device (int64 ns timestamps, values (n, channels)), newer than what it has.
+        """
+        device = self.device(name)
+        t_ns = np.asarray(t_ns, np.int64)
+        values = np.asarray(values, float).reshape(len(t_ns), len(self.channels))
+        if device.latest_ns is not None:
+            newer = t_ns > device.latest_ns
+            t_ns, values = t_ns[newer], values[newer]
+        if len(t_ns):
+            device.history.extend(t_ns, values)
+            self.rollup.append(name, t_ns, values)
+            # Bound the raw history, dropping a quarter of it at a time
+            timestamps = device.history.timestamps
+            if timestamps[-1] - timestamps[0] > RAW_HISTORY_S * 5 // 4 * NS_PER_S:
+                device.history.drop(np.searchsorted(timestamps, timestamps[-1] - RAW_HISTORY_S * NS_PER_S))
+                device.raw_from_ns = int(device.history.timestamps[0])
+
+    def points(self, device, start_ns, end_ns, ns_per_px):
+        """
+        Envelope of a device over [start_ns, end_ns), from the coarsest rollup
+        level with at least one bucket per pixel, or from the raw samples.
+        Ranges older than the raw history kept come from the finest level.
+        """
+        width_px = max(1, -(-(end_ns - start_ns) // ns_per_px))
+        level = self.rollup.pick_level(start_ns, end_ns, width_px)
+        bucket_ns = self.rollup.levels[level] * NS_PER_S
+        if bucket_ns <= ns_per_px or (device.raw_from_ns is not None and start_ns < device.raw_from_ns):
+            r = self.rollup.query(device.name, start_ns, end_ns, level=level)
+            # Each bucket as its min then its max, half a bucket apart
+            t = (r['timestamp'].view(np.int64)[:, None] + [0, bucket_ns // 2]).ravel()
+            values = np.stack((r['min'], r['max']), axis=1).reshape(len(t), -1)
+        else:
+            timestamps = device.history.timestamps
+            s = slice(np.searchsorted(timestamps, start_ns), np.searchsorted(timestamps, end_ns))
+            t, values = timestamps[s], device.history.values[s]
+        return envelope(t, values, ns_per_px)
+
+    def push(self):
+        """
+        Send the pending snapshots and deltas of every viewer.
+        """
+        t0 = time.perf_counter()
+        cache = {}
+
+        def message(key, build):
+            if key not in cache:
+                cache[key] = build()
+                self.stats['encoded'] += 1
+            return cache[key]
+
+        for viewer in list(self.viewers):
+            for view in list(viewer.views.values()):
+                device = self.devices.get(view.device)
+                if device is None or device.latest_ns is None:
+                    continue
+                if view.needs_snapshot:
+                    start, end = view.range(device.latest_ns)
+                    payload = message(('snapshot', device.name, start, end, view.ns_per_px),
+                                      lambda: self._snapshot(device, start, end, view.ns_per_px))
+                    view.needs_snapshot = False
+                elif view.span_ns is not None and device.latest_ns > view.sent_ns:
+                    payload = message(('delta', device.name, view.cursor, view.ns_per_px),
+                                      lambda: self._delta(device, view.cursor, view.ns_per_px))
+                else:
+                    continue
+                view.sent_ns = device.latest_ns
+                view.cursor = device.latest_ns // view.ns_per_px * view.ns_per_px
+                viewer.send_binary(payload)
+        self.stats['pushes'] += 1
+        self.stats['push_s'] += time.perf_counter() - t0
+
+    def _snapshot(self, device, start, end, ns_per_px):
+        t, values = self.points(device, start, end, ns_per_px)
+        return encode_points(SNAPSHOT, device.index, start, t, values)
+
+    def _delta(self, device, cursor, ns_per_px):
+        timestamps = device.history.timestamps
+        s = slice(np.searchsorted(timestamps, cursor), None)
+        t, values = envelope(timestamps[s], device.history.values[s], ns_per_px)
+        return encode_points(DELTA, device.index, cursor, t, values)
+
+    async def run(self, interval_s=PUSH_INTERVAL_S):
+        while True:
+            await asyncio.sleep(interval_s)
+            self.push()
+
+
+class View:
+    """
+    What one panel of a viewer shows: a fixed range, or the last span_ns before the newest sample.
+    """
+
+    def __init__(self, device, width_px, span_ns=None, start_ns=None, end_ns=None):
+        self.device = device
+        self.span_ns = span_ns
+        self.start_ns, self.end_ns = start_ns, end_ns
+        duration = span_ns if span_ns is not None else end_ns - start_ns
+        self.ns_per_px = max(1, duration // min(max(16, width_px), MAX_WIDTH_PX))
+        self.needs_snapshot = True
+        self.sent_ns = 0
+        self.cursor = 0
+
+    def range(self, latest_ns):
+        if self.span_ns is None:
+            return self.start_ns, self.end_ns
+        end = (latest_ns // self.ns_per_px + 1) * self.ns_per_px
+        return end - self.span_ns, end
+
+
+class WebSocket:
+    """
+    Server side of an RFC 6455 connection (no extensions).
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def accept_key(key):
+        return base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+
+    @staticmethod
+    def frame(opcode, payload):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, n)
+        elif n < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+        return header + payload
+
+    async def _read_frame(self, limit):
+        first, second = await self.reader.readexactly(2)
+        n = second & 0x7F
+        if n == 126:
+            n, = struct.unpack('!H', await self.reader.readexactly(2))
+        elif n == 127:
+            n, = struct.unpack('!Q', await self.reader.readexactly(8))
+        if n > limit:
+            raise ValueError(f"Frame of {n} bytes, over the {limit} left for the message")
+        mask = await self.reader.readexactly(4) if second & 0x80 else None
+        payload = await self.reader.readexactly(n)
+        if mask:
+            key = int.from_bytes((mask * (n // 4 + 1))[:n], 'little')
+            payload = (int.from_bytes(payload, 'little') ^ key).to_bytes(n, 'little')
+        return first & 0x80, first & 0x0F, payload
+
+    async def receive(self, max_size=MAX_MESSAGE):
+        """
+        Next text or binary message, or None once the connection is closed.
+        Messages over max_size bytes close it (status 1009, too big).
+        """
+        message, message_opcode = b'', None
+        while True:
+            try:
+                fin, opcode, payload = await self._read_frame(max_size - len(message))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+            except ValueError:
+                self.writer.write(self.frame(0x8, struct.pack('!H', CLOSE_TOO_BIG)))
+                return None
+            if opcode == 0x8:
+                self.writer.write(self.frame(0x8, payload[:2]))
+                return None
+            if opcode == 0x9:
+                self.writer.write(self.frame(0xA, payload))
+                continue
+            if opcode == 0xA:
+                continue
+            if opcode != 0x0:
+                message_opcode = opcode
+            message += payload
+            if fin:
+                return message.decode() if message_opcode == 0x1 else message
+
+
+class Viewer:
+    def __init__(self, hub, websocket):
+        self.hub = hub
+        self.websocket = websocket
+        self.views = {}
+        self.queue = asyncio.Queue(SEND_QUEUE)
+
+    def _send(self, data):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Too slow for the deltas: drop the backlog and start over from snapshots
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            for view in self.views.values():
+                view.needs_snapshot = True
+
+    def send_text(self, text):
+        self._send(WebSocket.frame(0x1, text.encode()))
+
+    def send_binary(self, data):
+        self.hub.stats['sent'] += 1
+        self.hub.stats['bytes'] += len(data)
+        self._send(WebSocket.frame(0x2, data))
+
+    async def _sender(self):
+        try:
+            while True:
+                self.websocket.writer.write(await self.queue.get())
+                await self.websocket.writer.drain()
+        except Exception:
+            # Also ends the receive loop of run(), which raises this
+            self.websocket.writer.close()
+            raise
+
+    def handle(self, message):
+        request = json.loads(message)
+        device = request.get('device')
+        if request.get('type') == 'view' and device:
+            if request.get('span'):
+                view = View(device, int(request['width']), span_ns=int(float(request['span']) * NS_PER_S))
+            else:
+                view = View(device, int(request['width']), start_ns=int(float(request['start']) * 1e6),
+                            end_ns=int(float(request['end']) * 1e6))
+            self.views[device] = view
+        elif request.get('type') == 'close':
+            self.views.pop(device, None)
+
+    async def run(self):
+        self.send_text(self.hub.devices_message())
+        sender = asyncio.create_task(self._sender())
+        self.hub.viewers.add(self)
+        try:
+            while (message := await self.websocket.receive()) is not None:
+                try:
+                    self.handle(message)
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_text(json.dumps({'type': 'error', 'message': str(e)}))
+        finally:
+            self.hub.viewers.discard(self)
+            sender.cancel()
+            try:
+                await sender
+            except asyncio.CancelledError:
+                pass
+
+
+async def handle_connection(hub, reader, writer):
+    try:
+        request = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        writer.close()
+        return
+    request_line, *header_lines = request.decode('latin-1').split('\r\n')
+    headers = {name.strip().lower(): value.strip()
+               for name, _, value in (line.partition(':') for line in header_lines if line)}
+    path = request_line.split(' ')[1] if request_line.count(' ') >= 2 else ''
+    try:
+        if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+            writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                          f"Sec-WebSocket-Accept: {WebSocket.accept_key(headers['sec-websocket-key'])}\r\n\r\n").encode())
+            await Viewer(hub, WebSocket(reader, writer)).run()
+        elif path == '/':
+            body = INDEX_HTML.encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                         b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+        else:
+            writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+    except (ConnectionError, KeyError):
+        pass
+    finally:
+        writer.close()
+
+
+class WalTail:
+    """
+    Follow the WAL directory of a running logger: committed records are read
+    as they appear, across sealed segments (records of a sealed segment that
+    the compactor deleted before it was read are skipped).
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.number = 0
+        self.offset = 0
+
+    def poll(self):
+        """
+        Returns:
+            (timestamps int64 ns, values (n, channels)) committed since the last call
+        """
+        times, values = [], []
+        for path in list_segments(self.directory):
+            number = int(path.stem.split('-')[1])
+            if number < self.number:
+                continue
+            if number > self.number:
+                self.number, self.offset = number, 0
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                continue
+            meta, t, v, self.offset = scan_segment(data, self.offset)
+            if meta is not None and len(t):
+                times.append(t)
+                values.append(v)
+        if not times:
+            return np.zeros(0, np.int64), np.zeros((0, len(CHANNELS)))
+        return np.concatenate(times), np.concatenate(values)
+
+
+async def follow_wal(hub, name, directory, interval_s=WAL_POLL_S):
+    tail = WalTail(directory)
+    while True:
+        t, values = tail.poll()
+        if len(t):
+            hub.append(name, t, values)
+        await asyncio.sleep(interval_s)
+
+
+async def synthetic_device(hub, name, days, rate, seed):
+    """
+    Demo device: `days` of history, then live samples at `rate` times real time.
+    """
+    from soak import PERIOD_S, SyntheticSerial
+    from telemetry_frame import FrameReader, samples
+
+    port = SyntheticSerial(int(days * 86400 / PERIOD_S), seed=seed)
+    reader = FrameReader()
+    clock = HostClock()
+    start_ns = clock.to_wall_ns(clock.monotonic_ns()) - int(days * 86400) * NS_PER_S
+
+    def read():
+        first = port.samples
+        rows = samples(reader.feed(port.read(port.in_waiting)))
+        return start_ns + (first + np.arange(len(rows))) * PERIOD_S * NS_PER_S, rows
+
+    hub.append(name, *read())
+    port.rows_per_read = max(1, round(rate * PUSH_INTERVAL_S / PERIOD_S))
+    while True:
+        await asyncio.sleep(port.rows_per_read * PERIOD_S / rate)
+        hub.append(name, *read())
+
+
+async def serve(hub, host='127.0.0.1', port=PORT, sources=()):
+    server = await asyncio.start_server(lambda r, w: handle_connection(hub, r, w), host, port)
+    tasks = [asyncio.create_task(hub.run())] + [asyncio.create_task(source) for source in sources]
+    print(f"Dashboard on http://{host}:{port}/")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _bench_viewer(port, device, width, span_s, duration_s, received):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = base64.b64encode(np.random.bytes(16)).decode()
+    writer.write(f"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+    await reader.readuntil(b'\r\n\r\n')
+    payload = json.dumps({'type': 'view', 'device': device, 'width': width, 'span': span_s}).encode()
+    # Client frames are masked (with a zero mask here)
+    writer.write(struct.pack('!BBH', 0x81, 0x80 | 126, len(payload)) + b'\0' * 4 + payload)
+    websocket = WebSocket(reader, writer)
+    deadline = time.perf_counter() + duration_s
+    try:
+        while (left := deadline - time.perf_counter()) > 0:
+            message = await asyncio.wait_for(websocket.receive(max_size=1 << 30), left)
+            if isinstance(message, bytes):
+                received.append(_DATA_HEADER.unpack_from(message)[3])
+    except asyncio.TimeoutError:
+        pass
+    writer.close()
+
+
+async def bench(devices, viewers, days, rate, width, span_s, duration_s, port=PORT + 1):
+    """
+    Serve synthetic devices to concurrent viewers (all following the first
+    span_s of a device at width pixels) and measure the server side.
+    """
+    hub = Hub()
+    sources = [synthetic_device(hub, f"device{i:02d}", days, rate, i) for i in range(devices)]
+    server = asyncio.create_task(serve(hub, port=port, sources=sources))
+    await asyncio.sleep(0.5)
+    received = []
+    cpu = time.process_time()
+    await asyncio.gather(*(_bench_viewer(port, f"device{i % devices:02d}", width, span_s, duration_s, received)
+                           for i in range(viewers)))
+    cpu = time.process_time() - cpu
+    server.cancel()
+    samples = sum(len(device.history) for device in hub.devices.values())
+    print(f"{devices} devices ({samples} samples), {viewers} viewers of {span_s / 86400:g} days "
+          f"at {width} px for {duration_s:g} s")
+    print(f"  {hub.stats['sent']} messages sent, {hub.stats['encoded']} encoded, "
+          f"{hub.stats['bytes'] / 1e6:.1f} MB, at most {max(received, default=0)} points per message")
+    print(f"  push: {hub.stats['push_s'] / max(1, hub.stats['pushes']) * 1e3:.2f} ms per interval, "
+          f"process CPU {cpu / duration_s * 100:.0f} %")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live web dashboard of the loggers")
+    parser.add_argument('--host', default='127.0.0.1', help="0.0.0.0 to serve the local network")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--wal', nargs='*', default=[], metavar='[DEVICE=]DIR',
+                        help="WAL directories of running loggers (WAL_DIR of main.py)")
+    parser.add_argument('--history', nargs='*', default=[], help="Logged CSVs to preload (loader.py sources)")
+    parser.add_argument('--synthetic', type=int, default=0, metavar='DEVICES', help="Add demo devices")
+    parser.add_argument('--days', type=float, default=30, help="History of the demo devices")
+    parser.add_argument('--rate', type=float, default=60, help="Speed of the demo devices (x real time)")
+    parser.add_argument('--bench', type=int, metavar='VIEWERS', help="Measure the server with demo devices")
+    parser.add_argument('--span', type=float, default=86400, help="Span followed by the bench viewers [s]")
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(bench(max(1, args.synthetic), args.bench, args.days, args.rate, 1600, args.span, 10.0))
+        return
+
+    hub = Hub()
+    if args.history:
+        from loader import load, to_arrays
+
+        for device, (timestamps, values) in to_arrays(load(args.history, list(hub.channels))).items():
+            hub.append(device, timestamps.astype('datetime64[ns]').view(np.int64), values)
+    sources = []
+    for item in args.wal:
+        name, _, directory = item.rpartition('=')
+        sources.append(follow_wal(hub, name or Path(directory).resolve().parent.name, directory))
+    sources += [synthetic_device(hub, f"demo{i}", args.days, args.rate, i) for i in range(args.synthetic)]
+    try:
+        asyncio.run(serve(hub, args.host, args.port, sources))
+    except KeyboardInterrupt:
+        pass
+
+
+INDEX_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Sigfox sensor logs</title>
+<style>
+body { font-family: sans-serif; margin: 8px; }
+.panel { margin-bottom: 12px; }
+.panel canvas { width: 100%; height: 360px; display: block; border: 1px solid #ccc; }
+.bar { margin: 4px 0; }
+</style></head>
+<body>
+<div class="bar">Devices: <span id="devices"></span>
+ Span: <select id="span">
+  <option value="3600">1 h</option><option value="21600">6 h</option><option value="86400" selected>1 day</option>
+  <option value="604800">7 days</option><option value="2592000">30 days</option><option value="31536000">1 year</option>
+ </select>
+ <small>wheel: zoom, drag: pan, double click: live</small></div>
+<div id="panels"></div>
+<script>
+const COLORS = ['#d62728', '#2ca02c', '#1f77b4'];
+let ws, names = [], channels = [], panels = {};
+
+function connect() {
+  ws = new WebSocket(`ws://${location.host}/ws`);
+  ws.binaryType = 'arraybuffer';
+  ws.onmessage = (event) => typeof event.data === 'string' ? control(JSON.parse(event.data)) : data(event.data);
+  ws.onopen = () => Object.values(panels).forEach(sendView);
+  ws.onclose = () => setTimeout(connect, 1000);
+}
+
+function control(message) {
+  if (message.type !== 'devices') return console.log(message);
+  names = message.devices;
+  channels = message.channels;
+  const list = document.getElementById('devices');
+  for (const name of names) {
+    if (document.getElementById('cb-' + name)) continue;
+    const label = document.createElement('label');
+    label.innerHTML = `<input type="checkbox" id="cb-${name}"> ${name} `;
+    label.firstChild.onchange = (e) => e.target.checked ? openPanel(name) : closePanel(name);
+    list.appendChild(label);
+  }
+  if (!Object.keys(panels).length && names.length) {
+    document.getElementById('cb-' + names[0]).checked = true;
+    openPanel(names[0]);
+  }
+}
+
+function openPanel(name) {
+  const div = document.createElement('div');
+  div.className = 'panel';
+  div.innerHTML = `<b>${name}</b> <span></span><canvas></canvas>`;
+  document.getElementById('panels').appendChild(div);
+  const panel = panels[name] = {name, div, canvas: div.querySelector('canvas'), info: div.querySelector('span'),
+                                t: [], v: [], live: true, span: +document.getElementById('span').value};
+  const canvas = panel.canvas;
+  canvas.onwheel = (e) => {
+    e.preventDefault();
+    const [t0, t1] = extent(panel), x = t0 + (t1 - t0) * e.offsetX / canvas.clientWidth;
+    const k = Math.exp(e.deltaY * 0.002);
+    setRange(panel, x - (x - t0) * k, x + (t1 - x) * k);
+  };
+  canvas.onmousedown = (e) => { panel.drag = {x: e.clientX, range: extent(panel)}; };
+  window.addEventListener('mouseup', () => { panel.drag = null; });
+  canvas.onmousemove = (e) => {
+    if (!panel.drag) return;
+    const [t0, t1] = panel.drag.range, dt = (panel.drag.x - e.clientX) * (t1 - t0) / canvas.clientWidth;
+    setRange(panel, t0 + dt, t1 + dt);
+  };
+  canvas.ondblclick = () => { panel.live = true; sendView(panel); };
+  sendView(panel);
+}
+
+function closePanel(name) {
+  panels[name].div.remove();
+  delete panels[name];
+  ws.send(JSON.stringify({type: 'close', device: name}));
+}
+
+function setRange(panel, t0, t1) {
+  panel.live = false;
+  panel.range = [t0, t1];
+  clearTimeout(panel.timer);
+  panel.timer = setTimeout(() => sendView(panel), 100);
+  draw(panel);
+}
+
+function sendView(panel) {
+  if (!ws || ws.readyState !== 1) return;
+  const width = Math.round(panel.canvas.clientWidth * devicePixelRatio);
+  const view = {type: 'view', device: panel.name, width};
+  if (panel.live) view.span = panel.span;
+  else [view.start, view.end] = panel.range;
+  ws.send(JSON.stringify(view));
+}
+
+function extent(panel) {
+  if (!panel.live) return panel.range;
+  // Times are the loggers' local wall clock: shift the browser's UTC clock the same way
+  const last = panel.t.length ? panel.t[panel.t.length - 1] : Date.now() - new Date().getTimezoneOffset() * 60000;
+  return [last - panel.span * 1000, last];
+}
+
+function data(buffer) {
+  const header = new DataView(buffer);
+  const kind = header.getUint8(0), nch = header.getUint8(1), n = header.getUint32(4, true);
+  const from = header.getFloat64(8, true);
+  const panel = panels[names[header.getUint16(2, true)]];
+  if (!panel) return;
+  const t = new Float64Array(buffer, 16, n), v = new Float32Array(buffer, 16 + 8 * n, n * nch);
+  let keep = 0;
+  if (kind === 1) {
+    // Delta: replaces the points from its first pixel column on, and the view slides
+    keep = panel.t.length;
+    while (keep > 0 && panel.t[keep - 1] >= from) keep--;
+    let first = 0, start = (t.length ? t[n - 1] : from) - panel.span * 1000 * 1.05;
+    while (first < keep && panel.t[first] < start) first++;
+    panel.t = panel.t.slice(first, keep);
+    panel.v = panel.v.slice(first * nch, keep * nch);
+  } else {
+    panel.t = [];
+    panel.v = [];
+  }
+  for (let i = 0; i < n; i++) panel.t.push(t[i]);
+  for (let i = 0; i < n * nch; i++) panel.v.push(v[i]);
+  panel.info.textContent = `${panel.t.length} points`;
+  draw(panel);
+}
+
+function draw(panel) {
+  if (panel.frame) return;
+  panel.frame = requestAnimationFrame(() => {
+    panel.frame = null;
+    const canvas = panel.canvas, w = canvas.width = canvas.clientWidth * devicePixelRatio;
+    const h = canvas.height = canvas.clientHeight * devicePixelRatio;
+    const ctx = canvas.getContext('2d'), nch = channels.length, rowH = h / nch;
+    const [t0, t1] = extent(panel), n = panel.t.length;
+    ctx.font = `${11 * devicePixelRatio}px sans-serif`;
+    for (let c = 0; c < nch; c++) {
+      let lo = Infinity, hi = -Infinity;
+      for (let i = 0; i < n; i++) {
+        if (panel.t[i] < t0 || panel.t[i] > t1) continue;
+        const y = panel.v[i * nch + c];
+        if (y < lo) lo = y;
+        if (y > hi) hi = y;
+      }
+      if (!(hi >= lo)) continue;
+      const pad = (hi - lo) * 0.1 || 0.1, top = c * rowH;
+      lo -= pad; hi += pad;
+      ctx.fillStyle = '#444';
+      ctx.fillText(`${channels[c]}  ${lo.toFixed(2)} .. ${hi.toFixed(2)}`, 4, top + 12 * devicePixelRatio);
+      ctx.strokeStyle = COLORS[c % COLORS.length];
+      ctx.beginPath();
+      for (let i = 0; i < n; i++) {
+        const x = (panel.t[i] - t0) / (t1 - t0) * w;
+        const y = top + rowH - (panel.v[i * nch + c] - lo) / (hi - lo) * rowH;
+        i ? ctx.lineTo(x, y) : ctx.moveTo(x, y);
+      }
+      ctx.stroke();
+    }
+    ctx.fillStyle = '#444';
+    ctx.fillText(new Date(t0).toLocaleString(undefined, {timeZone: 'UTC'}), 4, h - 4);
+    const right = new Date(t1).toLocaleString(undefined, {timeZone: 'UTC'});
+    ctx.fillText(right, w - ctx.measureText(right).width - 4, h - 4);
+  });
+}
+
+document.getElementById('span').onchange = (e) => {
+  for (const panel of Object.values(panels)) {
+    panel.span = +e.target.value;
+    panel.live = true;
+    sendView(panel);
+  }
+};
+window.onresize = () => Object.values(panels).forEach(sendView);
+connect();
+</script>
+</body></html>
+"""
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 #include <avr/sleep.h>
 #include <avr/power.h>
 #include <avr/wdt.h>
+#include <util/crc16.h>
+#include <stddef.h>
 
 // Define the pins for software serial
 const int UART_SIG_RX = 10;
@@ -22,6 +24,12 @@ float voltBatt = 0;
 int send_counter = 0;
 const int send_counter_threshold = 128;
 
+// Telemetry on the debug serial: text lines, binary frames, or both (TELEMETRY_TEXT | TELEMETRY_BINARY)
+#define TELEMETRY_TEXT 1
+#define TELEMETRY_BINARY 2
+const int telemetry_mode = TELEMETRY_TEXT;
+uint16_t frame_seq = 0;
+
 void blink(int n) {
   for (int i=0; i < n; ++i) {
     digitalWrite(LED_PIN, LOW);
@@ -222,12 +230,62 @@ float filter(float val, float newval) {
   return alpha*val+(1-alpha)*newval;
 }
 
+// Binary telemetry frame (little-endian). The CRC is the avr-libc CRC-CCITT
+// (_crc_ccitt_update, init 0xFFFF) of the fields before it. The frame is COBS
+// encoded and sent between two 0x00 delimiters. Decoded by logging/telemetry_frame.py
+struct __attribute__((packed)) Frame {
+  uint16_t seq;
+  float tempExt;
+  float tempInt;
+  float battVolt;
+  uint16_t crc;
+};
+
+// COBS encoding of `length` bytes (length < 254), returns the encoded length (length+1)
+size_t cobs_encode(const uint8_t *in, size_t length, uint8_t *out) {
+  size_t code_index = 0;
+  size_t out_index = 1;
+  uint8_t code = 1;
+  for (size_t i = 0; i < length; ++i) {
+    if (in[i] == 0) {
+      out[code_index] = code;
+      code = 1;
+      code_index = out_index++;
+    } else {
+      out[out_index++] = in[i];
+      ++code;
+    }
+  }
+  out[code_index] = code;
+  return out_index;
+}
+
+void send_frame(struct Data data) {
+  struct Frame frame = { frame_seq++, data.tempExt, data.tempInt, data.battVolt, 0 };
+  const uint8_t *raw = (const uint8_t *)&frame;
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < offsetof(struct Frame, crc); ++i) {
+    crc = _crc_ccitt_update(crc, raw[i]);
+  }
+  frame.crc = crc;
+  uint8_t encoded[sizeof(struct Frame) + 1];
+  size_t n = cobs_encode(raw, sizeof(struct Frame), encoded);
+  Serial.write((uint8_t)0);
+  Serial.write(encoded, n);
+  Serial.write((uint8_t)0);
+}
+
 void print_data(struct Data data){
-  Serial.print(data.tempExt, 8);
-  Serial.print(", ");
-  Serial.print(data.tempInt, 8);
-  Serial.print(", ");
-  Serial.println(data.battVolt, 8);
+  if (telemetry_mode & TELEMETRY_TEXT) {
+    Serial.print(data.tempExt, 8);
+    Serial.print(", ");
+    Serial.print(data.tempInt, 8);
+    Serial.print(", ");
+    Serial.println(data.battVolt, 8);
+  }
+  if (telemetry_mode & TELEMETRY_BINARY) {
+    send_frame(data);
+  }
 }
 
 void setup() {
@@ -0,0 +1,297 @@
+"""
+Cost model of Th() implementations on the ATmega328P of the board.
+
+Th() of main/main.ino turns the NTC divider ratio H into a temperature with
+a degree-6 float polynomial (horner()) times B. Alternatives are compared on
+three axes:
+
+    - accuracy: the implementation is simulated bit for bit on a dense grid
+      of H over the operating range (float32 operations rounded one by one as
+      the soft-float library does, integer shifts flooring as avr-gcc's), and
+      compared with the Beta model it approximates;
+    - cycles: per-operation costs of the avr-gcc soft-float routines and of
+      the integer sequences, summed over the operations of one call;
+    - flash: call sites, tables and library routines the rest of the
+      firmware does not link already.
+
+Candidates: float Horner of several degrees (refitted, plus the flashed
+coefficients), Q-format integer Horner (16 and 32-bit accumulators), a
+lookup table and a piecewise-linear table. The operation costs are typical
+values (avr-libc fplib with the hardware multiplier); they rank the
+candidates, a cycle-exact figure needs simavr or a timer on the board.
+"""
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from sensor_models import B, KELVIN, TH_COEFFS, beta_ratio, beta_temperature
+
+F_CPU = 8e6                    # Pro Mini 3.3 V
+T_RANGE_DEGC = (-20.0, 60.0)   # Operating range the accuracy is evaluated on
+SPEC_DEGC = 0.1                # Default accuracy requirement
+GRID = 100_000                 # H points of the accuracy evaluation
+TABLE_LSB_DEGC = 0.01          # Resolution of the int16 tables (LUT and piecewise-linear)
+
+# Cycles per operation (ATmega328P, avr-gcc -Os, avr-libc fplib)
+CYCLES = {
+    'fadd': 105,               # __addsf3 / __subsf3, average
+    'fmul': 125,               # __mulsf3 with MUL
+    'f2i': 65,                 # __fixsfsi / __fixunssfsi
+    'i2f': 75,                 # __floatsisf
+    'fload': 8,                # float from RAM (4 x LD)
+    'mul16': 18,               # 16x16 -> 32 bits, inline MUL/MULSU
+    'mul32x16': 48,            # 32x16 -> 48 bits, two 16x16 products and a 48-bit add
+    'add16': 2,
+    'add32': 4,
+    'shift_byte': 1,           # Per byte moved for shifts by multiples of 8 bits
+    'shift_bit16': 3,          # Per bit of a 16-bit shift (loop)
+    'shift_bit32': 5,          # Per bit of a 32-bit shift (loop)
+    'lpm16': 6,                # pgm_read_word, address setup included
+    'lpm32': 10,               # pgm_read_dword
+    'compare': 4,              # Clamp of an index
+    'loop': 5,                 # Counter and branch per iteration
+    'call': 10,                # call, ret, argument moves
+}
+
+# Flash bytes per call site and of the library routines
+SITE_BYTES = {'fadd': 10, 'fmul': 10, 'f2i': 8, 'i2f': 8, 'fload': 8, 'mul16': 12, 'mul32x16': 40, 'add16': 4,
+              'add32': 8, 'shift_byte': 2, 'shift_bit16': 3, 'shift_bit32': 5, 'lpm16': 8, 'lpm32': 12,
+              'compare': 8, 'loop': 6, 'call': 8}
+ROUTINE_BYTES = {'fadd': 420, 'fmul': 260, 'f2i': 110, 'i2f': 120}
+# Already in the firmware: meas_pin_raw() and filter() use float add, multiply and int -> float
+LINKED = {'fadd', 'fmul', 'i2f'}
+
+
+def operating_range(t_range=T_RANGE_DEGC):
+    """
+    Divider ratios of the operating temperature range (H decreases when T rises).
+    """
+    return float(beta_ratio(KELVIN + t_range[1])), float(beta_ratio(KELVIN + t_range[0]))
+
+
+def cost(ops, sites=None, tables=0, body_bytes=20):
+    """
+    Cycles and flash bytes of one call.
+
+    Args:
+        ops: Counter of operations executed per call
+        sites: Counter of operations as written in flash (a loop body once),
+            ops when None (straight-line code)
+        tables: Bytes of constant tables
+        body_bytes: Prologue, epilogue and glue
+
+    Returns:
+        (cycles, flash bytes)
+    """
+    sites = ops if sites is None else sites
+    cycles = sum(CYCLES[op] * n for op, n in ops.items())
+    flash = body_bytes + tables + sum(SITE_BYTES[op] * n for op, n in sites.items())
+    flash += sum(ROUTINE_BYTES.get(op, 0) for op in ops if op not in LINKED)
+    return cycles, flash
+
+
+def shift(bits, width):
+    """
+    Operations of an arithmetic shift: whole bytes are moves, the rest a bit loop.
+    """
+    ops = Counter()
+    if bits // 8:
+        ops['shift_byte'] += width // 8
+    if bits % 8:
+        ops[f'shift_bit{width}'] += bits % 8
+    return ops
+
+
+def float_horner(degree, H_range, coeffs=None, name=None):
+    """
+    Th() as flashed: float Horner of T/B in H, times B, minus 273.15.
+    """
+    H_fit = np.linspace(*H_range, 1000)
+    if coeffs is None:
+        coeffs = np.polyfit(H_fit, beta_temperature(H_fit) / B, degree)
+    c32 = np.asarray(coeffs, np.float32)
+
+    def evaluate(H):
+        x = H.astype(np.float32)
+        acc = np.full_like(x, c32[0])
+        for c in c32[1:]:
+            acc = acc * x + c
+        return acc * np.float32(B) - np.float32(KELVIN)
+
+    # The local coeffs[] array is copied from .data at every call
+    step = Counter({'fmul': 1, 'fadd': 1, 'fload': 1, 'loop': 1})
+    tail = Counter({'fmul': 1, 'fadd': 1, 'fload': degree + 2, 'call': 1})
+    ops = tail + Counter({op: n * degree for op, n in step.items()})
+    cycles, flash = cost(ops, step + tail - Counter({'fload': degree + 1}), tables=4 * (degree + 1))
+    return {'name': name or f"float Horner deg {degree}", 'evaluate': evaluate, 'cycles': cycles, 'flash': flash,
+            'constants': coeffs}
+
+
+def q_horner(degree, acc_bits, H_range, grid):
+    """
+    Integer Horner of T [°C] in x = H in Q16, coefficients and accumulator in
+    Q(f) with the largest f that never overflows on the operating range.
+    """
+    H_fit = np.linspace(*H_range, 1000)
+    coeffs = np.polyfit(H_fit, beta_temperature(H_fit) - KELVIN, degree)
+    x = np.floor(grid * 65536).astype(np.int64)
+    limit = 2 ** (acc_bits - 1)
+
+    def run(q, frac):
+        acc = np.full_like(x, q[0])
+        peak = abs(int(q[0]))
+        for c in q[1:]:
+            acc = ((acc * x) >> 16) + c
+            peak = max(peak, int(np.abs(acc).max()))
+        return acc, peak
+
+    for frac in range(acc_bits - 1, -1, -1):
+        q = np.rint(np.asarray(coeffs) * 2.0 ** frac).astype(np.int64)
+        if np.abs(q).max() < limit and run(q, frac)[1] < limit:
+            break
+
+    def evaluate(H):
+        x_ = np.floor(H * 65536).astype(np.int64)
+        acc = np.full_like(x_, q[0])
+        for c in q[1:]:
+            acc = ((acc * x_) >> 16) + c
+        return (acc.astype(np.float32) * np.float32(2.0 ** -frac)).astype(np.float32)
+
+    width = 16 if acc_bits <= 16 else 32
+    step = Counter({'mul16' if width == 16 else 'mul32x16': 1, f'add{width}': 1, f'lpm{width}': 1, 'loop': 1})
+    step += shift(16, 32 if width == 16 else 48) if width == 16 else Counter({'shift_byte': 6})
+    tail = Counter({'fmul': 2, 'f2i': 1, 'i2f': 1, f'lpm{width}': 1, 'call': 1})
+    ops = tail + Counter({op: n * degree for op, n in step.items()})
+    cycles, flash = cost(ops, step + tail, tables=width // 8 * (degree + 1))
+    return {'name': f"Q{acc_bits - 1 - frac}.{frac} Horner deg {degree}", 'evaluate': evaluate, 'cycles': cycles,
+            'flash': flash, 'constants': q}
+
+
+def _table(H_range, points):
+    H = np.linspace(*H_range, points)
+    return np.rint((beta_temperature(H) - KELVIN) / TABLE_LSB_DEGC).astype(np.int16)
+
+
+def lut(entries, H_range):
+    """
+    Nearest entry of an int16 table of T uniformly spaced in H.
+    """
+    table = _table(H_range, entries)
+    scale = (entries - 1) / (H_range[1] - H_range[0])
+    offset = 0.5 - H_range[0] * scale      # Rounding to the nearest entry folded into the offset
+
+    def evaluate(H):
+        index = np.clip(np.floor(H * scale + offset).astype(np.int64), 0, entries - 1)
+        return table[index].astype(np.float32) * np.float32(TABLE_LSB_DEGC)
+
+    # index = H * scale + offset, clamp, read, back to float in °C: the index costs what piecewise_linear()'s does
+    ops = Counter({'fadd': 1, 'fmul': 2, 'f2i': 1, 'compare': 2, 'lpm16': 1, 'i2f': 1, 'call': 1})
+    cycles, flash = cost(ops, tables=2 * entries)
+    return {'name': f"LUT {entries}", 'evaluate': evaluate, 'cycles': cycles, 'flash': flash, 'constants': table}
+
+
+def piecewise_linear(segments, H_range):
+    """
+    Linear interpolation in an int16 table of segments + 1 breakpoints
+    uniformly spaced in H: x in 16 bits, the index in its high bits.
+    """
+    table = _table(H_range, segments + 1)
+    frac_bits = 16 - int(np.log2(segments))
+    scale = segments * 2 ** frac_bits / (H_range[1] - H_range[0])
+
+    def evaluate(H):
+        x = np.clip(np.floor((H - H_range[0]) * scale), 0, segments * 2 ** frac_bits - 1).astype(np.int64)
+        index, frac = x >> frac_bits, x & (2 ** frac_bits - 1)
+        y0, y1 = table[index].astype(np.int64), table[index + 1].astype(np.int64)
+        y = y0 + (((y1 - y0) * frac) >> frac_bits)
+        return y.astype(np.float32) * np.float32(TABLE_LSB_DEGC)
+
+    ops = Counter({'fadd': 1, 'fmul': 2, 'f2i': 1, 'compare': 2, 'lpm16': 2, 'add16': 2, 'mul16': 1, 'add32': 1,
+                   'i2f': 1, 'call': 1})
+    ops += shift(frac_bits, 16) + shift(frac_bits, 32)
+    cycles, flash = cost(ops, tables=2 * (segments + 1))
+    return {'name': f"piecewise-linear {segments}", 'evaluate': evaluate, 'cycles': cycles, 'flash': flash,
+            'constants': table}
+
+
+def candidates(H_range, grid):
+    rows = [float_horner(6, (0.1, 0.9), TH_COEFFS, "float Horner deg 6 (flashed)")]
+    rows += [float_horner(d, H_range) for d in range(2, 9)]
+    rows += [q_horner(d, bits, H_range, grid) for bits in (16, 32) for d in range(2, 9)]
+    rows += [lut(n, H_range) for n in (64, 128, 256, 512, 1024, 2048, 4096)]
+    rows += [piecewise_linear(n, H_range) for n in (4, 8, 16, 32, 64, 128, 256)]
+    return rows
+
+
+def evaluate_all(rows, H):
+    """
+    Add the accuracy (max and RMS error against the Beta model [°C]) to every candidate.
+    """
+    reference = beta_temperature(H) - KELVIN
+    for row in rows:
+        error = row['evaluate'](H).astype(float) - reference
+        row['max_error'] = float(np.abs(error).max())
+        row['rms_error'] = float(np.sqrt(np.mean(error ** 2)))
+    return rows
+
+
+def pareto(rows, keys=('max_error', 'cycles', 'flash')):
+    """
+    Flag the candidates no other one beats on every key (lower is better).
+    """
+    values = np.array([[row[k] for k in keys] for row in rows], float)
+    dominated = ((values[None, :, :] <= values[:, None, :]).all(axis=2) &
+                 (values[None, :, :] < values[:, None, :]).any(axis=2)).any(axis=1)
+    for row, flag in zip(rows, dominated):
+        row['pareto'] = not flag
+    return rows
+
+
+def c_constants(row):
+    """
+    The constants of a candidate as a C declaration.
+    """
+    values = np.asarray(row['constants'])
+    if values.dtype.kind == 'f':
+        ctype, body = 'float', ', '.join(f"{v:.8g}" for v in values)
+    else:
+        ctype = 'int16_t' if np.abs(values).max() < 2 ** 15 else 'int32_t'
+        body = ', '.join(str(int(v)) for v in values)
+    return f"const {ctype} th_constants[{len(values)}] PROGMEM = {{{body}}};"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy, cycles and flash of Th() implementations")
+    parser.add_argument('--spec', type=float, default=SPEC_DEGC, help="Maximum error allowed [°C]")
+    parser.add_argument('--max-flash', type=int, help="Flash budget [bytes]")
+    parser.add_argument('--range', type=float, nargs=2, default=T_RANGE_DEGC, metavar=('TMIN', 'TMAX'))
+    parser.add_argument('--all', action='store_true', help="List every candidate, not only the Pareto front")
+    args = parser.parse_args()
+
+    H_range = operating_range(args.range)
+    H = np.linspace(*H_range, GRID)
+    rows = pareto(evaluate_all(candidates(H_range, H), H))
+    print(f"H in [{H_range[0]:.3f}, {H_range[1]:.3f}] ({args.range[0]:g} to {args.range[1]:g} °C), "
+          f"{GRID} points; cycles at {F_CPU / 1e6:g} MHz")
+    print(f"{'implementation':<32} {'max err °C':>10} {'rms °C':>8} {'cycles':>7} {'µs':>6} {'flash B':>8}  pareto")
+    for row in sorted(rows, key=lambda r: r['cycles']):
+        if args.all or row['pareto'] or 'flashed' in row['name']:
+            print(f"{row['name']:<32} {row['max_error']:10.4f} {row['rms_error']:8.4f} {row['cycles']:7d} "
+                  f"{row['cycles'] / F_CPU * 1e6:6.1f} {row['flash']:8d}  {'*' if row['pareto'] else ''}")
+
+    meeting = [row for row in rows if row['max_error'] <= args.spec and
+               (args.max_flash is None or row['flash'] <= args.max_flash)]
+    if not meeting:
+        print(f"\nNo candidate meets {args.spec:g} °C")
+        return
+    best = min(meeting, key=lambda r: (r['cycles'], r['flash']))
+    flashed = rows[0]
+    print(f"\nFastest within {args.spec:g} °C: {best['name']} ({best['cycles']} cycles, {best['flash']} B, "
+          f"max error {best['max_error']:.4f} °C) vs flashed Th() ({flashed['cycles']} cycles, "
+          f"max error {flashed['max_error']:.3f} °C)")
+    print(c_constants(best))
+
+
+if __name__ == "__main__":
+    main()
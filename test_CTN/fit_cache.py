@@ -0,0 +1,148 @@
+"""
+Content-addressed cache of fit results and evaluation grids.
+
+An entry is keyed by the SHA-256 of the model name, the input data and the
+parameters, so changing any input selects another entry: nothing has to be
+invalidated by hand. The model name must be changed (e.g. 'beta_fit/v2')
+when the computation itself changes.
+
+Entries are .npz files in CACHE_DIR. Reading an entry touches its mtime, and
+the least recently used entries are deleted once the directory grows over
+max_bytes.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+CACHE_DIR = Path(__file__).resolve().parent / '.fit_cache'
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def _feed(h, value):
+    """
+    Hash a value: arrays by dtype, shape and content, containers recursively,
+    anything else by its JSON form.
+    """
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = np.ascontiguousarray(value)
+        h.update(f"ndarray:{value.dtype.str}:{value.shape}:".encode())
+        h.update(value.tobytes())
+    elif isinstance(value, dict):
+        h.update(b"dict:")
+        for key in sorted(value):
+            _feed(h, str(key))
+            _feed(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"list:{len(value)}:".encode())
+        for item in value:
+            _feed(h, item)
+    else:
+        h.update(json.dumps(value).encode())
+        h.update(b";")
+
+
+def cache_key(model, data, params=None):
+    h = hashlib.sha256()
+    _feed(h, [model, data, params])
+    return h.hexdigest()
+
+
+class FitCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.directory / f"{key}.npz"
+
+    def get(self, key):
+        """
+        Returns:
+            dict of arrays, or None if the entry is missing or unreadable
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                result = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return result
+
+    def put(self, key, arrays):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # Write next to the target then rename, so a reader never sees half an entry
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            np.savez(f, **{name: np.asarray(value) for name, value in arrays.items()})
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for path in self.directory.glob('*.npz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def cached(self, model, data, params, compute):
+        """
+        Result of compute() for these inputs, computed only on a cache miss.
+
+        Args:
+            model: Name (and version) of the computation
+            data: Input arrays (anything _feed() can hash)
+            params: Parameters of the computation
+            compute: Function returning a dict of arrays
+
+        Returns:
+            dict of arrays
+        """
+        key = cache_key(model, data, params)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = {name: np.asarray(value) for name, value in compute().items()}
+        self.put(key, result)
+        return result
+
+    def clear(self):
+        for path in self.directory.glob('*.npz'):
+            path.unlink(missing_ok=True)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the fit cache")
+    parser.add_argument('--clear', action='store_true')
+    args = parser.parse_args()
+    cache = FitCache()
+    if args.clear:
+        cache.clear()
+    entries = list(cache.directory.glob('*.npz'))
+    size = sum(path.stat().st_size for path in entries)
+    print(f"{cache.directory}: {len(entries)} entries, {size / 1024:.1f} KiB (limit {cache.max_bytes / 1024 ** 2:.0f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
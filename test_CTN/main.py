@@ -1,6 +1,10 @@
 import numpy as np
 from matplotlib import pyplot as plt
-from scipy.optimize import curve_fit
+
+from fit_cache import FitCache
+from sensor_models import beta_ratio, beta_temperature, fit_beta, fit_firmware_polynomial
+
+cache = FitCache()
 
 T0 = 273.15+25
 B = 4887
@@ -68,27 +72,22 @@ T = np.linspace(273.15-30, 373.15, 1000)
 # plt.axvline(x=R0)
 # plt.legend()
 
-def Ht(T):
-    return 1/(1+np.exp(B*(1/T-1/T0)))
-def Th1(H):
-    alpha = 1
-    return -1/np.log((1/H-1)/(alpha*np.exp(B/T0)))
-
 def Th2(H):
     alpha = 1
-    H0 = Ht(T0)
+    H0 = beta_ratio(T0)
     return T0-(T0**2/B)*((1+alpha)**2/alpha)*(H-H0)
 
 plt.figure()
 H = np.linspace(0.1, 0.9, 1000)
-x = H
-y = np.vectorize(Th1)(H)
-fit = np.polyfit(x, y, 6)
+polynomial = cache.cached('firmware_polynomial/v1', H, {'B': B, 'T0': T0, 'degree': 6},
+                          lambda: {'fit': fit_firmware_polynomial(B, T0, degree=6, H=H),
+                                   'Th1': beta_temperature(H, B, T0)/B})
+fit = polynomial['fit']
 print(repr(fit))
-# plt.plot(np.vectorize(Th1)(H)-273.15, np.vectorize(Th1)(H)-np.vectorize(Th2)(H), label="Th1")
-plt.plot(H, np.vectorize(Th1)(H), label="Th1")
+# plt.plot(beta_temperature(H)-273.15, beta_temperature(H)-Th2(H), label="Th1")
+plt.plot(H, polynomial['Th1'], label="Th1")
 plt.plot(H, np.polyval(fit, H), label="pol")
-# plt.plot(H, np.vectorize(Th2)(H)-273.15, label="Th2")
+# plt.plot(H, Th2(H)-273.15, label="Th2")
 plt.grid()
 plt.xlabel("H [∅]")
 plt.ylabel("T [K]")
@@ -118,10 +117,6 @@ plt.legend()
 # plot_T0(273.15+25)
 # plot_T0(273.15+20)
 
-def Th1(H, B, T0):
-    alpha = 1
-    return -B/np.log((1/H-1)/(alpha*np.exp(B/T0)))
-
 T = np.array([17.2, 17.7, 18.2, 20.0, 22.6])
 H = np.array([0.607, 0.604, 0.603, 0.564, 0.54])
 
@@ -129,12 +124,18 @@ H = np.array([0.607, 0.604, 0.603, 0.564, 0.54])
 # # Estimation initiale des paramètres
 initial_guess = [2900, 25+273.15]
 # # Ajustement des données
-params, covariance = curve_fit(Th1, H, T+273.15, p0=initial_guess)
+H_range = np.linspace(0.1, 0.9, 1000)
+
+def beta_fit():
+    params, covariance = fit_beta(H, T+273.15, p0=initial_guess)
+    return {'params': params, 'covariance': covariance, 'T_fit': beta_temperature(H_range, *params)}
+
+beta = cache.cached('beta_fit/v1', {'H': H, 'T': T, 'H_range': H_range}, initial_guess, beta_fit)
+params, covariance = beta['params'], beta['covariance']
 B_opt, T0_opt = params
 print(f"fit results: B={B_opt:.2f} K, T0={T0_opt:.2f} K")
-H_range = np.linspace(0.1, 0.9, 1000)
-T_fit = Th1(H_range, *params)
-# T_fit = Th1(H_range, 2900.0, 298.15, 285.01)
+T_fit = beta['T_fit']
+# T_fit = beta_temperature(H_range, 2900.0, 298.15)
 # Tracé de la courbe
 plt.figure(figsize=(8, 6))
 plt.plot(H_range, T_fit-273.15, label='Fitted Curve', color='blue')
@@ -150,7 +151,7 @@ plt.grid(True)
 # print(f"T0: {T0_opt}")
 
 # Hs = np.linspace(0.5, 0.7, 1000)
-# T2 = np.vectorize(Th1)(Hs)-273.15
+# T2 = beta_temperature(Hs)-273.15
 # plt.plot(Hs, T2, "-", label="formula")
 # plt.plot(H, T, "P", label="reel")
 # plt.grid()
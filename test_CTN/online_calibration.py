@@ -0,0 +1,209 @@
+"""
+Online calibration of the NTC Beta model of many boards at once, from a
+stream of (H, reference temperature) pairs: boards sitting next to a
+reference probe keep refining their B and T0 sample after sample.
+
+The Beta model is linear in (1/T0, 1/B):
+
+    1/T = 1/T0 + u / B,   u = ln(alpha*H / (1 - H))
+
+so a Kalman filter on theta = (1/T0, 1/B) is exact (recursive least
+squares, plus a random walk of the parameters to follow a slow drift). Each
+board holds theta and its 2x2 covariance; an update is O(1) in time and
+memory, vectorized over the boards. The measurement noise is the reference
+probe noise mapped to 1/T plus the H noise through u (with the current
+1/B), and samples whose innovation exceeds GATE_SIGMA are rejected (probe
+glitches, a board out of its holder). A board rejecting REACQUIRE_AFTER
+samples in a row (its estimate was pulled away, e.g. by a glitch accepted
+under the wide prior) gets its prior covariance back and converges again.
+
+B, T0 and their standard deviations (first-order propagation from the
+covariance of theta) are available at any time.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from sensor_models import ALPHA, B, KELVIN, T0, beta_ratio, fit_beta
+
+PRIOR_SIGMA_B = 1000.0         # [K] around the rough calibration
+PRIOR_SIGMA_T0 = 5.0           # [K]
+SIGMA_T = 0.1                  # Reference probe noise [K]
+SIGMA_H = 1e-4                 # Divider ratio noise (2000 averaged 10-bit readings)
+GATE_SIGMA = 5.0               # Innovations beyond this many sigmas are rejected
+REACQUIRE_AFTER = 20           # Consecutive rejections that reset a board's covariance to the prior
+SAMPLE_PERIOD_S = 6.0          # Default time between two samples of a board
+DAY_S = 86400
+
+
+class OnlineBetaCalibration:
+    def __init__(self, devices, B=B, T0=T0, sigma_B=PRIOR_SIGMA_B, sigma_T0=PRIOR_SIGMA_T0, sigma_T=SIGMA_T,
+                 sigma_H=SIGMA_H, drift_B=0.0, drift_T0=0.0, alpha=ALPHA, gate=GATE_SIGMA):
+        """
+        Args:
+            devices: Number of boards (indices 0..devices-1)
+            B, T0, sigma_B, sigma_T0: Prior of every board [K]
+            sigma_T: Reference probe noise [K]
+            sigma_H: Divider ratio noise
+            drift_B, drift_T0: Random walk of the parameters [K per sqrt(day)], 0 for fixed parameters
+        """
+        self.theta = np.tile([1 / T0, 1 / B], (devices, 1))
+        prior = np.diag([(sigma_T0 / T0 ** 2) ** 2, (sigma_B / B ** 2) ** 2])
+        self.prior = prior
+        self.P = np.tile(prior, (devices, 1, 1))
+        self.q = np.diag([(drift_T0 / T0 ** 2) ** 2, (drift_B / B ** 2) ** 2]) / DAY_S
+        self.sigma_T = sigma_T
+        self.sigma_H = sigma_H
+        self.alpha = alpha
+        self.gate = gate
+        self.samples = np.zeros(devices, np.int64)
+        self.rejected = np.zeros(devices, np.int64)
+        self._rejected_run = np.zeros(devices, np.int64)
+
+    def update(self, devices, H, T, dt_s=SAMPLE_PERIOD_S):
+        """
+        Fold a batch of samples in (any mix of boards, in time order per board).
+
+        Args:
+            devices: Board index of every sample
+            H: Divider ratio
+            T: Reference temperature [K]
+            dt_s: Time since the board's previous sample [s] (scalar or per sample)
+        """
+        devices, H, T, dt_s = np.broadcast_arrays(np.asarray(devices, np.int64), np.asarray(H, float),
+                                                  np.asarray(T, float), np.asarray(dt_s, float))
+        # Rank of every sample among those of its board: one vectorized step per rank
+        order = np.argsort(devices, kind='stable')
+        sorted_devices = devices[order]
+        first = np.r_[True, sorted_devices[1:] != sorted_devices[:-1]]
+        starts = np.flatnonzero(first)
+        rank = np.empty(len(devices), np.int64)
+        rank[order] = np.arange(len(devices)) - np.repeat(starts, np.diff(np.r_[starts, len(devices)]))
+        for r in range(rank.max() + 1 if len(rank) else 0):
+            sel = rank == r
+            self._step(devices[sel], H[sel], T[sel], dt_s[sel])
+
+    def _step(self, d, H, T, dt_s):
+        P = self.P[d] + dt_s[:, None, None] * self.q
+        theta = self.theta[d]
+        x = np.column_stack((np.ones_like(H), np.log(self.alpha * H / (1 - H))))
+        innovation = 1 / T - (theta * x).sum(axis=1)
+        noise = (self.sigma_T / T ** 2) ** 2 + (theta[:, 1] * self.sigma_H / (H * (1 - H))) ** 2
+        Px = np.einsum('nij,nj->ni', P, x)
+        s = (x * Px).sum(axis=1) + noise
+        accepted = innovation ** 2 <= self.gate ** 2 * s
+        gain = np.where(accepted[:, None], Px / s[:, None], 0.0)
+        self.theta[d] = theta + gain * innovation[:, None]
+        P = P - gain[:, :, None] * Px[:, None, :]
+        self.P[d] = 0.5 * (P + P.transpose(0, 2, 1))
+        self.samples[d] += accepted
+        self.rejected[d] += ~accepted
+        run = np.where(accepted, 0, self._rejected_run[d] + 1)
+        lost = run >= REACQUIRE_AFTER
+        self.P[d[lost]] = self.prior
+        self._rejected_run[d] = np.where(lost, 0, run)
+
+    def estimate(self):
+        """
+        Current parameters of every board.
+
+        Returns:
+            dict of arrays: B, T0, sigma_B, sigma_T0 [K], correlation of B and T0,
+            samples (accepted) and rejected
+        """
+        inv_T0, inv_B = self.theta[:, 0], self.theta[:, 1]
+        # d(1/x) = -dx/x^2: standard deviations scale by x^2, the correlation keeps its sign
+        sigma_T0 = np.sqrt(self.P[:, 0, 0]) / inv_T0 ** 2
+        sigma_B = np.sqrt(self.P[:, 1, 1]) / inv_B ** 2
+        return {
+            'B': 1 / inv_B,
+            'T0': 1 / inv_T0,
+            'sigma_B': sigma_B,
+            'sigma_T0': sigma_T0,
+            'correlation': self.P[:, 0, 1] / np.sqrt(self.P[:, 0, 0] * self.P[:, 1, 1]),
+            'samples': self.samples.copy(),
+            'rejected': self.rejected.copy(),
+        }
+
+    def temperature(self, devices, H):
+        """
+        Temperature [K] of boards at divider ratios H with the current parameters, and its standard deviation.
+        """
+        d = np.asarray(devices, np.int64)
+        x = np.column_stack((np.ones(np.shape(H)), np.log(self.alpha * np.asarray(H) / (1 - np.asarray(H)))))
+        inv_T = (self.theta[d] * x).sum(axis=1)
+        variance = np.einsum('ni,nij,nj->n', x, self.P[d], x)
+        return 1 / inv_T, np.sqrt(variance) / inv_T ** 2
+
+
+def _simulate_fleet(devices, hours, rng, period_s=SAMPLE_PERIOD_S):
+    """
+    Boards with their own B and T0, next to a reference probe, over daily temperature cycles.
+
+    Returns:
+        (true B, true T0, function(step) -> (H, reference T [K]) of every board at that step), steps
+    """
+    true_B = rng.normal(3950, 150, devices)
+    true_T0 = KELVIN + 25 + rng.normal(0, 1.0, devices)
+    phase = rng.uniform(0, 2 * np.pi, devices)
+    steps = int(hours * 3600 / period_s)
+
+    def sample(step):
+        t = step * period_s / DAY_S
+        T = KELVIN + 15 + 12 * np.sin(2 * np.pi * t + phase)
+        H = beta_ratio(T, true_B, true_T0) + rng.normal(0, SIGMA_H, devices)
+        reference = T + rng.normal(0, SIGMA_T, devices)
+        glitch = rng.random(devices) < 1e-3
+        reference[glitch] += rng.normal(0, 20, glitch.sum())
+        return H, reference
+
+    return true_B, true_T0, sample, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online Beta calibration of a fleet of boards")
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--batch', type=int, default=10, help="Samples per board and update call")
+    args = parser.parse_args()
+
+    # Calibration points of main.py, streamed one by one, against the batch fit
+    T_data = np.array([17.2, 17.7, 18.2, 20.0, 22.6]) + KELVIN
+    H_data = np.array([0.607, 0.604, 0.603, 0.564, 0.54])
+    single = OnlineBetaCalibration(1, sigma_H=1e-3, sigma_T=0.3)
+    for h, t in zip(H_data, T_data):
+        single.update([0], [h], [t])
+    online = single.estimate()
+    (batch_B, batch_T0), covariance = fit_beta(H_data, T_data, p0=(2900, T0))
+    print(f"main.py points: online B={online['B'][0]:.0f} ± {online['sigma_B'][0]:.0f} K, "
+          f"T0={online['T0'][0]:.2f} ± {online['sigma_T0'][0]:.2f} K; "
+          f"curve_fit B={batch_B:.0f} ± {np.sqrt(covariance[0, 0]):.0f} K, "
+          f"T0={batch_T0:.2f} ± {np.sqrt(covariance[1, 1]):.2f} K")
+
+    rng = np.random.default_rng(0)
+    true_B, true_T0, sample, steps = _simulate_fleet(args.devices, args.hours, rng)
+    calibration = OnlineBetaCalibration(args.devices)
+    # Time-major batches: the samples of every board stay in time order
+    boards = np.tile(np.arange(args.devices), args.batch)
+    elapsed, done = 0.0, 0
+    for step in range(0, steps - args.batch + 1, args.batch):
+        H, T = (np.concatenate(part) for part in zip(*(sample(step + i) for i in range(args.batch))))
+        t0 = time.perf_counter()
+        calibration.update(boards, H, T)
+        elapsed += time.perf_counter() - t0
+        done += len(H)
+    result = calibration.estimate()
+    z_B = (result['B'] - true_B) / result['sigma_B']
+    z_T0 = (result['T0'] - true_T0) / result['sigma_T0']
+    print(f"{args.devices} boards, {done} samples over {args.hours:g} h: {done / elapsed:,.0f} samples/s "
+          f"({elapsed / done * 1e9:.0f} ns per sample)")
+    print(f"B error median {np.median(np.abs(result['B'] - true_B)):.2f} K "
+          f"(sigma {np.median(result['sigma_B']):.2f} K), T0 error median "
+          f"{np.median(np.abs(result['T0'] - true_T0)) * 1e3:.1f} mK (sigma {np.median(result['sigma_T0']) * 1e3:.1f} mK)")
+    print(f"Within 2 sigma: B {np.mean(np.abs(z_B) < 2):.1%}, T0 {np.mean(np.abs(z_T0) < 2):.1%} (95.4% expected); "
+          f"{result['rejected'].sum()} samples rejected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Sensor models of the SigTempMini board, vectorized over numpy arrays.
+
+Every model has a forward (physical quantity -> measured quantity) and an
+inverse function, and the fitted ones an analytic Jacobian with respect to
+their parameters, handed to curve_fit instead of finite differences.
+
+Conventions (as in main/main.ino):
+    - temperatures in K unless the name says degc
+    - H is the NTC divider ratio, voltInt/3.3: H = R/(R + alpha*R0) with the
+      NTC on the measured side and a series resistor of alpha*R0
+"""
+import time
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+KELVIN = 273.15
+B = 4887.0                     # NTC Beta [K], rough calibration
+T0 = KELVIN + 25               # NTC reference temperature [K]
+R0 = 1e3                       # NTC resistance at T0 [Ω]
+ALPHA = 1.0                    # Series resistor / R0
+LM35_V_PER_DEGC = 0.01         # LM35DZ: 10 mV/°C
+BATT_RATIO = 0.2188            # Battery divider (meas_pin_raw(battPin, 3.3)/0.2188)
+
+# Th() polynomial flashed in main/main.ino: T/B as a function of H
+TH_COEFFS = np.array([0.12215323, -0.51134901, 0.81893543, -0.67687026, 0.31558427,
+                      -0.09557197, 0.07739318])
+
+
+# NTC, Beta model
+
+def beta_resistance(T, B=B, T0=T0, R0=R0):
+    return R0 * np.exp(B * (1 / T - 1 / T0))
+
+
+def beta_ratio(T, B=B, T0=T0, alpha=ALPHA):
+    """
+    Divider ratio H for a temperature T.
+    """
+    return 1 / (1 + alpha * np.exp(B * (1 / T0 - 1 / T)))
+
+
+def beta_temperature(H, B=B, T0=T0, alpha=ALPHA):
+    """
+    Temperature for a divider ratio H (inverse of beta_ratio).
+    """
+    return 1 / (1 / T0 + np.log(alpha * H / (1 - H)) / B)
+
+
+def beta_jacobian(H, B=B, T0=T0, alpha=ALPHA):
+    """
+    Derivatives of beta_temperature with respect to (B, T0).
+
+    Returns:
+        array (len(H), 2)
+    """
+    u = np.log(alpha * H / (1 - H))
+    T2 = beta_temperature(H, B, T0, alpha) ** 2
+    return np.column_stack((T2 * u / B ** 2, T2 / T0 ** 2))
+
+
+def fit_beta(H, T, p0=(B, T0), alpha=ALPHA):
+    """
+    Fit B and T0 to measured (H, T [K]) pairs.
+
+    Returns:
+        (params, covariance) as curve_fit
+    """
+    return curve_fit(lambda h, b, t0: beta_temperature(h, b, t0, alpha), H, T, p0=p0,
+                     jac=lambda h, b, t0: beta_jacobian(h, b, t0, alpha))
+
+
+# NTC, Steinhart-Hart model: 1/T = a + b ln(R/R0) + c ln(R/R0)^3
+
+def steinhart_hart_temperature(H, a, b, c, alpha=ALPHA):
+    L = np.log(alpha * H / (1 - H))
+    return 1 / (a + b * L + c * L ** 3)
+
+
+def steinhart_hart_ratio(T, a, b, c, alpha=ALPHA):
+    """
+    Divider ratio H for a temperature T, through the closed-form root of the cubic.
+    """
+    if c == 0:
+        L = (1 / T - a) / b
+    else:
+        y = (a - 1 / T) / c
+        x = np.sqrt((b / (3 * c)) ** 3 + y ** 2 / 4)
+        L = np.cbrt(x - y / 2) - np.cbrt(x + y / 2)
+    ratio = np.exp(L) / alpha
+    return ratio / (1 + ratio)
+
+
+def steinhart_hart_jacobian(H, a, b, c, alpha=ALPHA):
+    """
+    Derivatives of steinhart_hart_temperature with respect to (a, b, c).
+    """
+    L = np.log(alpha * H / (1 - H))
+    T2 = steinhart_hart_temperature(H, a, b, c, alpha) ** 2
+    return -T2[:, None] * np.column_stack((np.ones_like(L), L, L ** 3))
+
+
+def fit_steinhart_hart(H, T, p0=None, alpha=ALPHA):
+    """
+    Fit (a, b, c) to measured (H, T [K]) pairs. The initial guess defaults to
+    the linear least-squares solution on 1/T, which is usually already the answer
+    up to the weighting.
+    """
+    if p0 is None:
+        L = np.log(alpha * np.asarray(H) / (1 - np.asarray(H)))
+        p0 = np.linalg.lstsq(np.column_stack((np.ones_like(L), L, L ** 3)), 1 / np.asarray(T), rcond=None)[0]
+    return curve_fit(lambda h, a, b, c: steinhart_hart_temperature(h, a, b, c, alpha), H, T, p0=p0,
+                     jac=lambda h, a, b, c: steinhart_hart_jacobian(h, a, b, c, alpha))
+
+
+def beta_to_steinhart_hart(B=B, T0=T0):
+    """
+    Steinhart-Hart coefficients equivalent to a Beta model.
+    """
+    return 1 / T0, 1 / B, 0.0
+
+
+# Firmware polynomial
+
+def firmware_temperature(H, coeffs=TH_COEFFS, B=B):
+    """
+    Th() of main/main.ino (returns K, the firmware subtracts 273.15).
+    """
+    return np.polyval(coeffs, H) * B
+
+
+def fit_firmware_polynomial(B=B, T0=T0, alpha=ALPHA, degree=6, H=np.linspace(0.1, 0.9, 1000)):
+    """
+    Polynomial of T/B in H, as flashed in Th().
+    """
+    return np.polyfit(H, beta_temperature(H, B, T0, alpha) / B, degree)
+
+
+# LM35 (tempExt)
+
+def lm35_voltage(T_degc, gain=LM35_V_PER_DEGC):
+    return np.asarray(T_degc) * gain
+
+
+def lm35_temperature(v, gain=LM35_V_PER_DEGC):
+    """
+    Temperature in °C for an output voltage.
+    """
+    return np.asarray(v) / gain
+
+
+# Battery divider (battVolt)
+
+def battery_divider_voltage(v_batt, ratio=BATT_RATIO):
+    return np.asarray(v_batt) * ratio
+
+
+def battery_voltage(v, ratio=BATT_RATIO):
+    """
+    Battery voltage for the voltage measured at the divider output.
+    """
+    return np.asarray(v) / ratio
+
+
+def battery_jacobian(v, ratio=BATT_RATIO):
+    """
+    Derivative of battery_voltage with respect to the ratio.
+    """
+    return (-np.asarray(v, dtype=float) / ratio ** 2)[:, None]
+
+
+def fit_battery_ratio(v, v_batt, p0=BATT_RATIO):
+    """
+    Fit the divider ratio to (measured voltage, multimeter battery voltage) pairs.
+    """
+    return curve_fit(battery_voltage, v, v_batt, p0=[p0], jac=battery_jacobian)
+
+
+def _validate():
+    """
+    Check the analytic models against the reference ad hoc code they replace and
+    time the fits and dense evaluations.
+    """
+    T = np.linspace(KELVIN - 30, KELVIN + 100, 1000)
+    H = beta_ratio(T)
+    print(f"Beta round trip: {np.abs(beta_temperature(H) - T).max():.2e} K")
+    a, b, c = 1.1e-3, 2.4e-4, 8e-8
+    T_sh = steinhart_hart_temperature(H, a, b, c)
+    print(f"Steinhart-Hart round trip: {np.abs(steinhart_hart_ratio(T_sh, a, b, c) - H).max():.2e}")
+    inside = H[(H > 0.1) & (H < 0.9)]
+    print(f"Firmware polynomial vs Beta model: {np.abs(firmware_temperature(inside) - beta_temperature(inside)).max():.3f} K")
+
+    # Jacobians against central differences
+    for name, model, jac, params in (('Beta', beta_temperature, beta_jacobian, np.array([B, T0])),
+                                     ('Steinhart-Hart', steinhart_hart_temperature, steinhart_hart_jacobian,
+                                      np.array([a, b, c]))):
+        numeric = np.empty((len(H), len(params)))
+        for i in range(len(params)):
+            step = np.zeros_like(params)
+            step[i] = 1e-6 * abs(params[i])
+            numeric[:, i] = (model(H, *(params + step)) - model(H, *(params - step))) / (2 * step[i])
+        rel = np.abs(jac(H, *params) - numeric).max(axis=0) / np.abs(numeric).max(axis=0)
+        print(f"{name} Jacobian relative error: {rel.max():.1e}")
+
+    # Calibration points of main.py, reference path: np.vectorize + finite-difference Jacobian
+    T_data = np.array([17.2, 17.7, 18.2, 20.0, 22.6]) + KELVIN
+    H_data = np.array([0.607, 0.604, 0.603, 0.564, 0.54])
+
+    def th1(h, b, t0):
+        return -b / np.log((1 / h - 1) / (ALPHA * np.exp(b / t0)))
+
+    def timed(f, repeat):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            out = f()
+        return out, (time.perf_counter() - t0) / repeat
+
+    H_dense = np.linspace(0.1, 0.9, 100000)
+    reference, t_ref = timed(lambda: np.vectorize(th1)(H_dense, B, T0), 3)
+    dense, t_new = timed(lambda: beta_temperature(H_dense), 30)
+    print(f"Dense evaluation ({len(H_dense)} points): {t_ref * 1e3:.1f} ms -> {t_new * 1e3:.2f} ms "
+          f"({t_ref / t_new:.0f}x), max difference {np.abs(dense - reference).max():.1e} K")
+
+    T_synth = np.linspace(KELVIN - 20, KELVIN + 60, 2000)
+    H_synth = beta_ratio(T_synth, 3950, KELVIN + 25) + np.random.default_rng(0).normal(0, 1e-3, len(T_synth))
+    for name, H_fit, T_fit in (('main.py points', H_data, T_data), ('2000 synthetic points', H_synth, T_synth)):
+        (ref, _), t_ref = timed(lambda: curve_fit(lambda h, b, t0: np.vectorize(th1)(h, b, t0), H_fit, T_fit,
+                                                  p0=[2900, T0]), 5)
+        (new, _), t_new = timed(lambda: fit_beta(H_fit, T_fit, p0=(2900, T0)), 5)
+        print(f"Beta fit on {name}: {t_ref * 1e3:.1f} ms -> {t_new * 1e3:.2f} ms ({t_ref / t_new:.0f}x), "
+              f"B={new[0]:.2f} K (reference {ref[0]:.2f}), T0={new[1]:.3f} K (reference {ref[1]:.3f})")
+
+
+if __name__ == "__main__":
+    _validate()
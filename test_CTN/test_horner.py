@@ -3,6 +3,8 @@ from fixedpoint import FixedPoint
 import matplotlib.pyplot as plt
 from tabulate import tabulate
 
+from fit_cache import FitCache
+
 # Function to evaluate polynomial using Horner's method with high precision
 def horner_high_precision(coefficients, x):
     """
@@ -99,11 +101,20 @@ def main():
     # Define range of x values to test
     x_values = np.linspace(-2, 2, 9)
 
+    # Reference evaluations are cached on (coefficients, x values, format)
+    cache = FitCache()
+
+    def cached_comparison(n_int_bits, n_frac_bits):
+        return cache.cached('horner_fixed_point/v1', x_values,
+                            {'coefficients': coefficients, 'n_int_bits': n_int_bits, 'n_frac_bits': n_frac_bits},
+                            lambda: {'results': compare_implementations(coefficients, x_values, n_int_bits, n_frac_bits)}
+                            )['results']
+
     # Compare implementations with 8 bits for integer part and 8 bits for fractional part (common for Arduino)
-    results_8_8 = compare_implementations(coefficients, x_values, n_int_bits=8, n_frac_bits=8)
+    results_8_8 = cached_comparison(n_int_bits=8, n_frac_bits=8)
 
     # Compare implementations with 8 bits for integer part and 16 bits for fractional part
-    results_8_16 = compare_implementations(coefficients, x_values, n_int_bits=8, n_frac_bits=16)
+    results_8_16 = cached_comparison(n_int_bits=8, n_frac_bits=16)
 
     # Print results in a table
     headers = ["x", "High Precision", "Arduino (8.8)", "Absolute Error", "Relative Error (%)"]